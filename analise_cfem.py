@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 from pathlib import Path
+from dados_cfem import calcular_periodo, converter_colunas_numericas, rotulo_periodo
 
 # Configurar o estilo dos gráficos
 sns.set_style("whitegrid")
@@ -27,9 +28,11 @@ except UnicodeDecodeError:
     except UnicodeDecodeError:
         df = pd.read_csv(csv_file, sep=';', encoding='cp1252')
 
-# Converter colunas numéricas (tratar vírgula decimal brasileira)
-df['ValorRecolhido'] = df['ValorRecolhido'].astype(str).str.replace('R$', '').str.replace('.', '').str.replace(',', '.').str.strip().astype(float)
-df['QuantidadeComercializada'] = df['QuantidadeComercializada'].astype(str).str.replace(',', '.').str.strip().astype(float)
+# Converter colunas numéricas (tratar vírgula decimal brasileira; valores inválidos viram NaN)
+df = converter_colunas_numericas(df)
+valores_invalidos = df['ValorRecolhido'].isna().sum()
+if valores_invalidos:
+    print(f"Aviso: {valores_invalidos} valor(es) de ValorRecolhido nao puderam ser interpretados")
 
 print(f"Total de registros: {len(df)}")
 print(f"Colunas: {df.columns.tolist()}")
@@ -81,9 +84,10 @@ plt.close()
 # ===== GRÁFICO 4: Tendência Mensal de Arrecadação =====
 print("Gerando gráfico 4: Tendência Mensal...")
 plt.figure(figsize=(14, 6))
-# Criar coluna de ano-mês para melhor visualização
-df['AnoMes'] = df['Ano'].astype(str) + '-' + df['Mês'].astype(str).str.zfill(2)
-arrecadacao_mes = df.groupby('AnoMes')['ValorRecolhido'].sum().sort_index()
+# Código inteiro de período (Ano * 12 + Mês - 1); rótulos só para os meses distintos
+df['Periodo'] = calcular_periodo(df['Ano'], df['Mês'])
+arrecadacao_mes = df.groupby('Periodo')['ValorRecolhido'].sum().sort_index()
+arrecadacao_mes.index = [rotulo_periodo(periodo) for periodo in arrecadacao_mes.index]
 plt.plot(range(len(arrecadacao_mes)), arrecadacao_mes.values, marker='o', linewidth=2, color='darkgreen')
 plt.fill_between(range(len(arrecadacao_mes)), arrecadacao_mes.values, alpha=0.3, color='lightgreen')
 plt.title('Tendência de Arrecadação Mensal', fontsize=14, fontweight='bold')
@@ -141,7 +145,7 @@ print("ESTATÍSTICAS RESUMIDAS DA ARRECADAÇÃO CFEM")
 print("="*60)
 print(f"\nPeríodo: {df['Ano'].min()} a {df['Ano'].max()}")
 print(f"Total de registros: {len(df):,}")
-print(f"Total arrecadado: R$ {df['ValorRecolhido'].sum():,.2f}")
+print(f"Total arrecadado: R$ {df['ValorRecolhido_centavos'].sum() / 100:,.2f}")
 print(f"Arrecadação média por registro: R$ {df['ValorRecolhido'].mean():,.2f}")
 print(f"\nTop 5 Substâncias:")
 print(df.groupby('Substância')['ValorRecolhido'].sum().sort_values(ascending=False).head(5))
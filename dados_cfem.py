@@ -0,0 +1,1583 @@
+import codecs
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+# Versão do layout do cache colunar; incrementar sempre que o processamento mudar
+VERSAO_FORMATO = 11
+
+# Encodings aceitos para os CSVs, em ordem de preferência
+ENCODINGS_CSV = ("utf-8", "latin-1", "cp1252")
+TAMANHO_BLOCO_LEITURA = 1 << 20  # 1 MB
+TAMANHO_LOTE = 250_000  # linhas por lote na ingestão em streaming
+NIVEL_COMPRESSAO_BLOB = 3  # gzip rápido: CSVs ainda encolhem várias vezes
+
+# Colunas de texto com poucos valores distintos, guardadas como categorias (dicionário)
+COLUNAS_CATEGORICAS = ['UF', 'UF_raw', 'Município', 'Substância', 'Tipo_PF_PJ']
+
+# Identificadores lidos sempre como texto: inferidos como número perdem zeros à esquerda
+# e a chave de deduplicação passaria a depender da inferência de cada arquivo
+TIPOS_IDENTIFICADORES = {'CPF_CNPJ': str, 'Processo': str}
+
+# Tipos de leitura do CSV: valores também como texto, para que PADRAO_MOEDA_BR decida sempre;
+# com inferência por lote, "1.500" viraria 1,5 num lote numérico e 1.500,00 num lote textual
+TIPOS_LEITURA_CSV = {**TIPOS_IDENTIFICADORES, 'ValorRecolhido': str, 'QuantidadeComercializada': str}
+PARTICAO_SEM_PERIODO = "sem-periodo"
+
+# Granularidade do cubo de agregação consultado por gráficos, rankings e KPIs; a ordem
+# das dimensões é a ordem das linhas, então cada UF e cada (UF, Município) é uma fatia contígua
+DIMENSOES_CUBO = ['UF', 'Município', 'Ano', 'Mês', 'Substância', 'Tipo_PF_PJ']
+
+# Entidades com séries acumuladas mensais (somas de prefixo) e as colunas que as identificam
+DIMENSOES_ACUMULADAS = {'UF': ['UF'], 'Município': ['UF', 'Município'], 'Substância': ['Substância']}
+
+# Critérios dos meses atípicos: IQR (como nos insights) ou z robusto (mediana e MAD)
+MINIMO_MESES_ANOMALIA = 11
+MULTIPLICADOR_IQR = 1.5
+LIMITE_Z_ROBUSTO = 3.5
+
+# Colunas dos filtros do Painel Global com índice invertido de bitmaps
+COLUNAS_FILTRO = ['Ano', 'UF', 'Substância']
+
+# Entidades das curvas de concentração e a participação acumulada do corte de Pareto (%)
+DIMENSOES_CONCENTRACAO = {
+    'UF': ['UF'],
+    'Município': ['UF', 'Município'],
+    'Substância': ['Substância'],
+    'Titular': ['CPF_CNPJ'],
+}
+LIMIAR_PARETO = 80
+
+# Perfil de qualidade: linhas analisadas no modo rápido e z do intervalo de confiança de 95%
+AMOSTRA_QUALIDADE_RAPIDA = 200_000
+Z_CONFIANCA_95 = 1.959963984540054
+
+COLUNAS_OBRIGATORIAS = ['Ano', 'Mês', 'UF', 'Município', 'Substância', 'ValorRecolhido', 'QuantidadeComercializada']
+
+# Motivos de quarentena: cada linha recebe uma máscara de bits (bit i = i-ésimo motivo)
+# O painel exibe só as primeiras linhas da quarentena
+LINHAS_QUARENTENA_EXIBIDAS = 1000
+COLUNA_MOTIVOS = 'MotivosQuarentena'
+MOTIVOS_QUARENTENA = [
+    ('valor_invalido', 'ValorRecolhido ausente ou fora do padrão monetário'),
+    ('quantidade_invalida', 'QuantidadeComercializada preenchida mas não numérica'),
+    ('ano_invalido', 'Ano ausente ou fora do intervalo 1900-2100'),
+    ('mes_invalido', 'Mês não reconhecido'),
+    ('uf_invalida', 'UF não reconhecida'),
+    ('municipio_ausente', 'Município ausente'),
+    ('substancia_ausente', 'Substância ausente'),
+]
+
+MESES_MAP = {
+    "jan": 1,
+    "janeiro": 1,
+    "fev": 2,
+    "fevereiro": 2,
+    "mar": 3,
+    "marco": 3,
+    "março": 3,
+    "abr": 4,
+    "abril": 4,
+    "mai": 5,
+    "maio": 5,
+    "jun": 6,
+    "junho": 6,
+    "jul": 7,
+    "julho": 7,
+    "ago": 8,
+    "agosto": 8,
+    "set": 9,
+    "setembro": 9,
+    "out": 10,
+    "outubro": 10,
+    "nov": 11,
+    "novembro": 11,
+    "dez": 12,
+    "dezembro": 12,
+}
+
+UF_VALIDAS = {
+    "AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA",
+    "MT", "MS", "MG", "PA", "PB", "PR", "PE", "PI", "RJ", "RN",
+    "RS", "RO", "RR", "SC", "SP", "SE", "TO",
+}
+
+def normalizar_uf(valor):
+    """Normaliza UF para sigla valida (AC..TO) ou NaN."""
+    if pd.isna(valor):
+        return np.nan
+
+    texto = str(valor).strip().upper()
+    if not texto:
+        return np.nan
+
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    texto = "".join(ch for ch in texto if ch.isalpha())
+
+    if texto in UF_VALIDAS:
+        return texto
+
+    return np.nan
+
+def normalizar_mes(valor):
+    """Normaliza o valor do mes para inteiro 1-12 ou NaN."""
+    if pd.isna(valor):
+        return np.nan
+
+    if isinstance(valor, (int, np.integer)):
+        return valor if 1 <= valor <= 12 else np.nan
+
+    if isinstance(valor, (float, np.floating)):
+        if np.isnan(valor):
+            return np.nan
+        mes_int = int(valor)
+        return mes_int if 1 <= mes_int <= 12 else np.nan
+
+    texto = str(valor).strip().lower()
+    if not texto:
+        return np.nan
+
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    texto = texto.replace(".", " ").replace("-", " ").replace("/", " ")
+    texto = " ".join(texto.split())
+
+    if texto.isdigit():
+        mes_int = int(texto)
+        return mes_int if 1 <= mes_int <= 12 else np.nan
+
+    token = texto.split(" ")[0]
+    return MESES_MAP.get(token, np.nan)
+
+def normalizar_por_valores_unicos(serie, funcao):
+    """Aplica a normalização uma vez por valor distinto e mapeia a coluna pelos códigos"""
+    codigos, unicos = pd.factorize(serie)
+    # Tabela de consulta: um resultado por valor distinto + NaN na última posição
+    tabela = np.empty(len(unicos) + 1, dtype=object)
+    tabela[:-1] = [funcao(valor) for valor in unicos]
+    tabela[-1] = np.nan
+    return pd.Series(tabela[codigos], index=serie.index, name=serie.name)
+
+def calcular_hash_conteudo(dados):
+    """Calcula o SHA-256 (hex) do conteúdo enviado"""
+    return hashlib.sha256(dados).hexdigest()
+
+def calcular_hash_fonte(fonte):
+    """SHA-256 (hex) de bytes em memória ou do conteúdo de um arquivo (.gz do armazém: conteúdo original)"""
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        return calcular_hash_conteudo(fonte)
+    hash_sha256 = hashlib.sha256()
+    for bloco in iterar_blocos_bytes(fonte):
+        hash_sha256.update(bloco)
+    return hash_sha256.hexdigest()
+
+def abrir_fonte_binaria(fonte):
+    """Abre bytes em memória, um arquivo em disco ou um arquivo .gz do armazém para leitura binária"""
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        return io.BytesIO(fonte)
+    if str(fonte).endswith(".gz"):
+        return gzip.open(fonte, 'rb')
+    return open(fonte, 'rb')
+
+def iterar_blocos_bytes(fonte, tamanho_bloco=TAMANHO_BLOCO_LEITURA):
+    """Percorre bytes em memória ou um arquivo em disco em blocos de tamanho fixo"""
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        visao = memoryview(fonte)
+        for inicio in range(0, len(visao), tamanho_bloco):
+            yield visao[inicio:inicio + tamanho_bloco]
+        return
+
+    with abrir_fonte_binaria(fonte) as arquivo:
+        while True:
+            bloco = arquivo.read(tamanho_bloco)
+            if not bloco:
+                break
+            yield bloco
+
+def detectar_encoding(fonte, encodings=ENCODINGS_CSV):
+    """Retorna o primeiro encoding que decodifica todo o conteúdo, sem parsear o CSV"""
+    for encoding in encodings:
+        decodificador = codecs.getincrementaldecoder(encoding)()
+        try:
+            for bloco in iterar_blocos_bytes(fonte):
+                decodificador.decode(bloco)
+            decodificador.decode(b"", final=True)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    return None
+
+def ler_csv_detectando_encoding(fonte, **kwargs):
+    """Detecta o encoding uma única vez e faz um único parse do CSV (bytes ou caminho)"""
+    encoding = detectar_encoding(fonte)
+    if encoding is None:
+        encoding = ENCODINGS_CSV[0]
+        kwargs.setdefault('encoding_errors', 'replace')
+    with abrir_fonte_binaria(fonte) as arquivo:
+        df = pd.read_csv(arquivo, encoding=encoding, **kwargs)
+    df.attrs['encoding'] = encoding
+    return df, encoding
+
+# Valor monetário no padrão brasileiro: "R$ 1.234,56", "-R$ 5", "R$ -1234,5", "1.234"
+# Milhar só em trios completos e no máximo dois decimais: "1234.56" e "1.234,567" são erros
+PADRAO_MOEDA_BR = r'^\s*(?:-[ ]*(?:R\$)?|R\$[ ]*-?)?[ ]*(?:\d{1,3}(?:\.\d{3})*|\d+)(?:,\d{1,2})?\s*$'
+# Partes de um valor já validado: sem ambiguidade, o RE2 extrai os grupos em uma passada
+# rápida (one-pass), o que os grupos nomeados do padrão completo não permitem
+PARTES_MOEDA_BR = r'^(?P<prefixo>[^\d.]*)(?P<inteiro>[\d.]+)(?:,(?P<decimais>\d*))?'
+MAXIMO_DIGITOS_REAIS = 16  # reais × 100 ainda cabe em int64
+
+def converter_moeda_br_centavos(serie):
+    """Converte valores no formato "R$ 1.234,56" para centavos (int64)
+
+    Retorna ``(centavos, erros)``: células que não puderam ser interpretadas
+    ficam com 0 centavos e ``True`` na máscara de erros, sem interromper a carga.
+    O texto é validado pelo padrão completo e decomposto por ``extract_regex`` (sinal,
+    parte inteira e decimais); os centavos saem dos grupos por aritmética inteira, sem
+    float. Colunas já numéricas (frames montados em memória) passam direto; o CSV é
+    lido sempre como texto (``TIPOS_LEITURA_CSV``).
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        valores = serie.to_numpy(dtype=float, na_value=np.nan)
+        erros = ~np.isfinite(valores)
+        centavos = np.round(np.where(erros, 0, valores) * 100).astype(np.int64)
+        return centavos, erros
+
+    texto = pa.array(serie, from_pandas=True)
+    if not pa.types.is_string(texto.type) and not pa.types.is_large_string(texto.type):
+        texto = pa.array(serie.astype(str), from_pandas=True)
+    validos = pc.match_substring_regex(texto, PADRAO_MOEDA_BR)
+    grupos = pc.extract_regex(texto, PARTES_MOEDA_BR)
+    # Só a parte inteira perde os pontos de milhar; valores inválidos ficam nulos
+    inteiro = pc.replace_substring(pc.struct_field(grupos, 'inteiro'), '.', '')
+    validos = pc.and_(validos, pc.less_equal(pc.utf8_length(inteiro), MAXIMO_DIGITOS_REAIS))
+    inteiro = pc.if_else(validos, inteiro, None)
+    decimais = pc.utf8_rpad(pc.struct_field(grupos, 'decimais'), width=2, padding='0')
+    centavos = pc.add(pc.multiply(pc.cast(inteiro, pa.int64()), 100), pc.cast(decimais, pa.int64()))
+    negativo = pc.match_substring(pc.struct_field(grupos, 'prefixo'), '-')
+    centavos = pc.if_else(negativo, pc.negate(centavos), centavos)
+
+    erros = pc.is_null(centavos).to_numpy(zero_copy_only=False)
+    return pc.fill_null(centavos, 0).to_numpy(zero_copy_only=False).astype(np.int64), erros
+
+def formatar_moeda_br_vetorizado(valores, ausente="—"):
+    """Formata uma série/array de reais como "R$ 1.234.567,89" (mesmo texto de f"{valor:,.2f}")
+
+    O "%.2f" do NumPy arredonda como o f-string; a troca de separadores e os pontos de
+    milhar saem de kernels de texto do Arrow. Valores NaN/infinitos viram ``ausente``.
+    """
+    serie = pd.Series(valores, dtype='float64')
+    numeros = serie.to_numpy()
+    validos = np.isfinite(numeros)
+    texto = pa.array(np.char.mod('%.2f', np.abs(np.where(validos, numeros, 0.0))), type=pa.string())
+    partes = pc.split_pattern(texto, '.')
+    # Pontos de milhar: inverte a parte inteira, marca cada trio de dígitos e desinverte
+    invertido = pc.replace_substring_regex(pc.utf8_reverse(pc.list_element(partes, 0)), r'(\d{3})', r'\1.')
+    inteiro = pc.utf8_reverse(pc.utf8_rtrim(invertido, characters='.'))
+    sinal = pa.array(np.where(np.signbit(numeros), '-', ''), type=pa.string())
+    resultado = pc.binary_join_element_wise('R$ ', sinal, inteiro, ',', pc.list_element(partes, 1), '')
+    return pd.Series(resultado, index=serie.index, dtype='str').mask(~validos, ausente)
+
+def converter_numero_br(serie):
+    """Converte números com vírgula decimal para float; inválidos viram NaN"""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    return pd.to_numeric(serie.astype(str).str.replace(',', '.', regex=False).str.strip(), errors='coerce')
+
+def converter_colunas_numericas(df):
+    """Converte ValorRecolhido (em reais e centavos exatos) e QuantidadeComercializada"""
+    centavos, erros = converter_moeda_br_centavos(df['ValorRecolhido'])
+    df['ValorRecolhido_centavos'] = centavos
+    df['ValorRecolhido'] = np.where(erros, np.nan, centavos / 100)
+    df['QuantidadeComercializada'] = converter_numero_br(df['QuantidadeComercializada'])
+    return df
+
+def verificar_colunas_obrigatorias(df):
+    """Falha logo no primeiro lote se o arquivo não tiver o layout CFEM"""
+    ausentes = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in df.columns]
+    if ausentes:
+        raise ValueError(f"Colunas obrigatórias ausentes no CSV CFEM: {', '.join(ausentes)}")
+
+def texto_ausente(serie):
+    """Máscara de valores nulos ou em branco"""
+    return serie.isna().to_numpy() | (serie.astype(str).str.strip() == "").to_numpy()
+
+def calcular_motivos_quarentena(df, quantidade_preenchida):
+    """Máscara de bits com os motivos de rejeição de cada linha (0 = linha aceita)"""
+    ano = df['Ano']
+    verificacoes = [
+        df['ValorRecolhido'].isna().to_numpy(),
+        quantidade_preenchida & df['QuantidadeComercializada'].isna().to_numpy(),
+        (ano.isna() | (ano % 1 != 0) | ~ano.between(1900, 2100)).to_numpy(),
+        df['Mês'].isna().to_numpy(),
+        df['UF'].isna().to_numpy(),
+        texto_ausente(df['Município']),
+        texto_ausente(df['Substância']),
+    ]
+    motivos = np.zeros(len(df), dtype=np.uint8)
+    for bit, falhou in enumerate(verificacoes):
+        motivos |= falhou.astype(np.uint8) << bit
+    return motivos
+
+def contar_motivos_quarentena(motivos, contagem=None):
+    """Soma, por código de motivo, as linhas marcadas na máscara"""
+    contagem = {codigo: 0 for codigo, _ in MOTIVOS_QUARENTENA} if contagem is None else contagem
+    motivos = np.asarray(motivos, dtype=np.uint8)
+    for bit, (codigo, _) in enumerate(MOTIVOS_QUARENTENA):
+        contagem[codigo] += int(((motivos >> bit) & 1).sum())
+    return contagem
+
+def descrever_motivos_quarentena(mascara):
+    """Códigos dos motivos presentes em uma máscara, separados por vírgula"""
+    return ", ".join(codigo for bit, (codigo, _) in enumerate(MOTIVOS_QUARENTENA) if int(mascara) >> bit & 1)
+
+def separar_quarentena(df):
+    """Divide o lote processado em (aceitas, quarentena) pela coluna de motivos"""
+    rejeitadas = df[COLUNA_MOTIVOS].to_numpy() != 0
+    aceitas = df.loc[~rejeitadas].drop(columns=COLUNA_MOTIVOS)
+    if 'Ano' in aceitas.columns and not pd.api.types.is_integer_dtype(aceitas['Ano']):
+        aceitas['Ano'] = aceitas['Ano'].astype('int64')
+    return aceitas, df.loc[rejeitadas]
+
+def processar_lote_cfem(df):
+    """Valida, converte valores numéricos e normaliza UF e mês de um lote do CSV CFEM
+
+    O lote volta com a coluna de motivos de quarentena; ``separar_quarentena`` divide
+    as linhas aceitas das rejeitadas.
+    """
+    verificar_colunas_obrigatorias(df)
+    quantidade_preenchida = ~texto_ausente(df['QuantidadeComercializada'])
+
+    # Converter colunas numéricas
+    df = converter_colunas_numericas(df)
+    df['Ano'] = pd.to_numeric(df['Ano'], errors='coerce')
+
+    # Normalizar UF para siglas validas
+    if 'UF' in df.columns:
+        df['UF_raw'] = df['UF']
+        df['UF'] = normalizar_por_valores_unicos(df['UF'], normalizar_uf)
+
+    # Normalizar coluna de mes para nomenclatura brasileira (1-12)
+    if 'Mês' in df.columns:
+        df['Mês'] = normalizar_por_valores_unicos(df['Mês'], normalizar_mes).astype('Int64')
+
+    df[COLUNA_MOTIVOS] = calcular_motivos_quarentena(df, quantidade_preenchida)
+    return df
+
+def calcular_periodo(ano, mes):
+    """Código inteiro do mês (Ano * 12 + Mês - 1) como Int16; nulo sem Ano ou Mês válidos"""
+    ano = pd.to_numeric(ano, errors='coerce').astype('Int32')
+    mes = pd.to_numeric(mes, errors='coerce').astype('Int32')
+    periodo = ano * 12 + mes - 1
+    return periodo.where(mes.between(1, 12)).astype('Int16')
+
+def aplicar_esquema_compacto(df):
+    """Converte o frame para o layout compacto: categorias ordenadas e inteiros pequenos"""
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna not in df.columns:
+            continue
+        serie = df[coluna]
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype('category')
+        # Categorias em ordem alfabética: filtros e ordenações viram operações sobre os códigos
+        try:
+            categorias_ordenadas = serie.cat.categories.sort_values()
+        except TypeError:
+            categorias_ordenadas = serie.cat.categories
+        if not serie.cat.categories.equals(categorias_ordenadas):
+            serie = serie.cat.reorder_categories(categorias_ordenadas)
+        df[coluna] = serie
+
+    if 'Ano' in df.columns and pd.api.types.is_numeric_dtype(df['Ano']):
+        df['Ano'] = df['Ano'].astype('Int16' if df['Ano'].isna().any() else 'int16')
+
+    if 'Mês' in df.columns:
+        df['Mês'] = df['Mês'].astype('Int8')
+
+    if 'Ano' in df.columns and 'Mês' in df.columns:
+        df['Periodo'] = calcular_periodo(df['Ano'], df['Mês'])
+
+    return df
+
+# ===== INGESTÃO EM LOTES =====
+def novos_totais_parciais():
+    """Estado inicial dos agregados acumulados durante a ingestão em lotes"""
+    return {
+        'linhas_lidas': 0,
+        'linhas_quarentena': 0,
+        'motivos_quarentena': contar_motivos_quarentena([]),
+        'progresso': 0.0,
+        'total_centavos': 0,
+        'mensal': None,
+        'municipios': set(),
+        'estados': set(),
+        'substancias': set(),
+    }
+
+def atualizar_totais_parciais(totais, lote, quarentena):
+    """Acumula no estado parcial os totais das linhas aceitas e as contagens da quarentena"""
+    totais['linhas_lidas'] += len(lote) + len(quarentena)
+    totais['linhas_quarentena'] += len(quarentena)
+    contar_motivos_quarentena(quarentena[COLUNA_MOTIVOS], totais['motivos_quarentena'])
+
+    totais['total_centavos'] += int(lote['ValorRecolhido_centavos'].sum())
+    mensal = lote.groupby(['Ano', 'Mês'])['ValorRecolhido'].sum()
+    totais['mensal'] = mensal if totais['mensal'] is None else totais['mensal'].add(mensal, fill_value=0)
+    totais['municipios'].update(lote['Município'].dropna().unique())
+    totais['estados'].update(lote['UF'].dropna().unique())
+    totais['substancias'].update(lote['Substância'].dropna().unique())
+    return totais
+
+def concatenar_tabelas_arrow(tabelas):
+    """Concatena as tabelas dos lotes, convertendo para texto colunas com tipos conflitantes"""
+    try:
+        return pa.concat_tables(tabelas, promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+
+    # Uma coluna inferida como número em um lote e como texto em outro vira texto em todos
+    textuais = {
+        campo.name
+        for tabela in tabelas
+        for campo in tabela.schema
+        if pa.types.is_string(campo.type) or pa.types.is_large_string(campo.type)
+    }
+    ajustadas = []
+    for tabela in tabelas:
+        for nome in textuais.intersection(tabela.column_names):
+            indice = tabela.schema.get_field_index(nome)
+            if not pa.types.is_large_string(tabela.schema.field(indice).type):
+                coluna = pc.cast(tabela.column(indice), pa.large_string())
+                tabela = tabela.set_column(indice, nome, coluna)
+        ajustadas.append(tabela)
+    return pa.concat_tables(ajustadas, promote_options="permissive")
+
+def ler_csv_cfem_em_tabela(fonte, ao_processar_lote=None, tamanho_lote=TAMANHO_LOTE):
+    """Lê, valida e normaliza o CSV CFEM em lotes e devolve (tabela, quarentena, totais, encoding)
+
+    Cada lote processado vira uma tabela Arrow e o DataFrame do lote é descartado,
+    de modo que o pico de memória fica próximo de um lote mais a tabela final.
+    ``ao_processar_lote`` recebe os totais parciais após cada lote.
+    """
+    encoding = detectar_encoding(fonte)
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        tamanho_total = len(fonte)
+    else:
+        tamanho_total = os.path.getsize(fonte)
+    arquivo = abrir_fonte_binaria(fonte)
+    # Em arquivos .gz o progresso é medido sobre os bytes comprimidos já consumidos
+    arquivo_bruto = getattr(arquivo, 'fileobj', arquivo)
+
+    opcoes = {'encoding': encoding} if encoding else {'encoding': ENCODINGS_CSV[0], 'encoding_errors': 'replace'}
+    totais = novos_totais_parciais()
+    tabelas = []
+    quarentenas = []
+    with arquivo, pd.read_csv(arquivo, sep=';', chunksize=tamanho_lote, dtype=TIPOS_LEITURA_CSV, **opcoes) as leitor:
+        for lote in leitor:
+            lote, quarentena = separar_quarentena(processar_lote_cfem(lote))
+            atualizar_totais_parciais(totais, lote, quarentena)
+            tabelas.append(pa.Table.from_pandas(lote, preserve_index=False))
+            if len(quarentena):
+                quarentenas.append(pa.Table.from_pandas(quarentena, preserve_index=False))
+            del lote, quarentena
+
+            totais['progresso'] = arquivo_bruto.tell() / tamanho_total if tamanho_total else 1.0
+            if ao_processar_lote is not None:
+                ao_processar_lote(totais)
+
+    if totais['linhas_lidas'] == totais['linhas_quarentena']:
+        raise ValueError("Nenhuma linha válida no CSV CFEM: todas as linhas foram para a quarentena")
+    tabela = concatenar_tabelas_arrow(tabelas)
+    del tabelas
+
+    # Codificar as colunas categóricas no próprio Arrow evita materializar os textos no pandas
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in tabela.column_names:
+            indice = tabela.schema.get_field_index(coluna)
+            tabela = tabela.set_column(indice, coluna, pc.dictionary_encode(tabela.column(indice)))
+    quarentena = concatenar_tabelas_arrow(quarentenas) if quarentenas else None
+    return tabela, quarentena, totais, opcoes['encoding']
+
+def salvar_tabelas_como_dataset(diretorio, digest, tabelas, encoding, quarentenas=()):
+    """Combina tabelas Arrow com dicionários unificados e grava o dataset colunar"""
+    tabela = concatenar_tabelas_arrow([uniformizar_dicionarios(tabela) for tabela in tabelas]).unify_dictionaries()
+    entrada_quarentena = salvar_quarentena(diretorio, digest, [q for q in quarentenas if q is not None])
+    return salvar_dataset_colunar(diretorio, digest, tabela, encoding, entrada_quarentena)
+
+def ingerir_csv_cfem_em_lotes(fonte, diretorio, digest, ao_processar_lote=None, tamanho_lote=TAMANHO_LOTE):
+    """Lê o CSV CFEM em lotes e grava o dataset colunar final; retorna os totais"""
+    tabela, quarentena, totais, encoding = ler_csv_cfem_em_tabela(fonte, ao_processar_lote, tamanho_lote)
+    salvar_tabelas_como_dataset(diretorio, digest, [tabela], encoding, [quarentena])
+    return totais
+
+# ===== INGESTÃO DE VÁRIOS ARQUIVOS =====
+def combinar_digests(digests):
+    """Digest do dataset formado por arquivos já identificados pelos seus digests"""
+    if len(digests) == 1:
+        return digests[0]
+    # A ordem do upload não muda o dataset resultante
+    return calcular_hash_conteudo("+".join(sorted(digests)).encode("ascii"))
+
+def combinar_totais_parciais(totais, parcial):
+    """Soma aos totais acumulados os totais de um arquivo já processado"""
+    totais['linhas_lidas'] += parcial['linhas_lidas']
+    totais['linhas_quarentena'] += parcial['linhas_quarentena']
+    for codigo, quantidade in parcial['motivos_quarentena'].items():
+        totais['motivos_quarentena'][codigo] += quantidade
+    totais['total_centavos'] += parcial['total_centavos']
+    if parcial['mensal'] is not None:
+        totais['mensal'] = parcial['mensal'] if totais['mensal'] is None else totais['mensal'].add(parcial['mensal'], fill_value=0)
+    for chave in ('municipios', 'estados', 'substancias'):
+        totais[chave].update(parcial[chave])
+    return totais
+
+def converter_csv_cfem_para_arrow(fonte, destino):
+    """Tarefa do pool de processos: converte um CSV e grava a tabela em Feather no destino
+
+    A tabela volta ao processo principal pelo disco (memory-map) em vez de ser
+    serializada pelo pipe do pool; a quarentena, se houver, vai para ``destino.quarentena``.
+    """
+    tabela, quarentena, totais, encoding = ler_csv_cfem_em_tabela(fonte)
+    gravar_arquivo_atomico(
+        Path(destino),
+        lambda temporario: feather.write_feather(tabela, temporario, compression="uncompressed"),
+    )
+    destino_quarentena = None
+    if quarentena is not None:
+        destino_quarentena = gravar_arquivo_atomico(
+            Path(f"{destino}.quarentena"),
+            lambda temporario: feather.write_feather(quarentena, temporario, compression="uncompressed"),
+        )
+    return totais, encoding, destino_quarentena
+
+def contexto_processos():
+    """Contexto do pool de ingestão: forkserver onde existir, senão spawn
+
+    fork copiaria o servidor do Streamlit com threads no meio de operações (locks
+    de logging, do Arrow), e o worker pode travar; o forkserver parte de um processo
+    limpo que só pré-carrega este módulo.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        contexto = multiprocessing.get_context("forkserver")
+        contexto.set_forkserver_preload([__name__])
+        return contexto
+    return multiprocessing.get_context("spawn")
+
+@contextmanager
+def sem_script_principal():
+    """Oculta o ``__main__`` enquanto os workers do pool são criados
+
+    O Streamlit registra o script do painel como ``__main__``; com spawn/forkserver
+    cada worker reexecutaria o painel inteiro antes da tarefa. As tarefas vivem
+    neste módulo, então os workers não precisam do script.
+    """
+    principal = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = principal
+
+def ingerir_csvs_cfem_em_paralelo(fontes, diretorio, digest, ao_processar_arquivo=None, max_processos=None):
+    """Converte vários CSVs CFEM (ex.: um por ano) em paralelo, um processo por arquivo
+
+    As tabelas de cada arquivo são combinadas com dicionários unificados, de modo que
+    o dataset final tem as mesmas categorias ordenadas de uma ingestão única.
+    ``ao_processar_arquivo`` recebe os totais acumulados a cada arquivo concluído.
+    """
+    fontes = list(fontes)
+    if len(fontes) == 1:
+        return ingerir_csv_cfem_em_lotes(fontes[0], diretorio, digest, ao_processar_lote=ao_processar_arquivo)
+
+    particoes = Path(diretorio) / "particoes"
+    particoes.mkdir(parents=True, exist_ok=True)
+    temporarios = Path(tempfile.mkdtemp(dir=particoes, prefix=f"{digest}-", suffix="-arquivos"))
+    destinos = [temporarios / f"arquivo-{indice}.arrow" for indice in range(len(fontes))]
+    processos = min(len(fontes), max_processos or os.cpu_count() or 1)
+
+    totais = novos_totais_parciais()
+    encodings = [None] * len(fontes)
+    destinos_quarentena = [None] * len(fontes)
+    try:
+        with ProcessPoolExecutor(max_workers=processos, mp_context=contexto_processos()) as pool:
+            # Os workers nascem no submit
+            with sem_script_principal():
+                tarefas = {
+                    pool.submit(converter_csv_cfem_para_arrow, fonte, str(destino)): indice
+                    for indice, (fonte, destino) in enumerate(zip(fontes, destinos))
+                }
+            for concluidos, tarefa in enumerate(as_completed(tarefas), start=1):
+                indice = tarefas[tarefa]
+                parcial, encodings[indice], destinos_quarentena[indice] = tarefa.result()
+                combinar_totais_parciais(totais, parcial)
+                totais['progresso'] = concluidos / len(fontes)
+                if ao_processar_arquivo is not None:
+                    ao_processar_arquivo(totais)
+
+        tabelas = [feather.read_table(destino, memory_map=True) for destino in destinos]
+        quarentenas = [feather.read_table(destino) for destino in destinos_quarentena if destino is not None]
+        encoding = ", ".join(dict.fromkeys(encodings))
+        salvar_tabelas_como_dataset(diretorio, digest, tabelas, encoding, quarentenas)
+        del tabelas
+    finally:
+        shutil.rmtree(temporarios, ignore_errors=True)
+    return totais
+
+# ===== CACHE COLUNAR EM DISCO =====
+# Cada dataset é um manifesto JSON que aponta para partições mensais (Ano, Mês) em
+# Feather v2. Anexar um mês grava só as partições tocadas; as demais são reaproveitadas.
+def caminho_manifesto(diretorio, digest):
+    """Caminho do manifesto do dataset identificado pelo digest"""
+    return Path(diretorio) / f"{digest}-v{VERSAO_FORMATO}.json"
+
+def caminho_particao(diretorio, arquivo):
+    """Caminho de um arquivo de partição referenciado no manifesto"""
+    return Path(diretorio) / "particoes" / arquivo
+
+def chave_particao(ano, mes):
+    """Nome da partição mensal (AAAA-MM); linhas sem período válido ficam em uma partição própria"""
+    if pd.isna(ano) or pd.isna(mes):
+        return PARTICAO_SEM_PERIODO
+    return f"{int(ano):04d}-{int(mes):02d}"
+
+def posicoes_particoes_mensais(ano, mes):
+    """Posições das linhas de cada partição mensal (AAAA-MM), em ordem crescente"""
+    ano = pd.to_numeric(pd.Series(ano), errors='coerce')
+    mes = pd.Series(mes, index=ano.index)
+    grupos = ano.groupby([ano, mes], dropna=False, sort=True).indices
+    particoes = {}
+    for (ano_grupo, mes_grupo), posicoes in grupos.items():
+        chave = chave_particao(ano_grupo, mes_grupo)
+        if chave in particoes:
+            posicoes = np.sort(np.concatenate([particoes[chave], posicoes]))
+        particoes[chave] = posicoes
+    return particoes
+
+def separar_particoes_mensais(df):
+    """Divide o frame em partições por (Ano, Mês), preservando a ordem das linhas"""
+    if 'Ano' not in df.columns or 'Mês' not in df.columns:
+        return {PARTICAO_SEM_PERIODO: df}
+    particoes = posicoes_particoes_mensais(df['Ano'].to_numpy(), df['Mês'].to_numpy())
+    return {chave: df.iloc[posicoes] for chave, posicoes in particoes.items()}
+
+def resumir_particao(df):
+    """Agregados da partição guardados no manifesto"""
+    return {
+        'linhas': int(len(df)),
+        'total_centavos': int(df['ValorRecolhido_centavos'].sum()) if 'ValorRecolhido_centavos' in df.columns else 0,
+    }
+
+def gravar_arquivo_atomico(destino, escrever):
+    """Grava via arquivo temporário + rename: outros workers nunca enxergam um arquivo parcial
+
+    O temporário é exclusivo de cada chamada (mkstemp): sessões do Streamlit são threads
+    do mesmo processo e podem gravar o mesmo destino ao mesmo tempo.
+    """
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=destino.parent, prefix=f"{destino.name}.", suffix=".tmp")
+    os.close(descritor)
+    try:
+        escrever(temporario)
+        os.replace(temporario, destino)
+    except BaseException:
+        Path(temporario).unlink(missing_ok=True)
+        raise
+    return destino
+
+def salvar_particao(diretorio, digest, chave, df):
+    """Grava uma partição mensal sem compressão e retorna sua entrada no manifesto"""
+    arquivo = f"{digest}-{chave}-v{VERSAO_FORMATO}.arrow"
+    gravar_arquivo_atomico(
+        caminho_particao(diretorio, arquivo),
+        lambda temporario: feather.write_feather(df.reset_index(drop=True), temporario, compression="uncompressed"),
+    )
+    return {'arquivo': arquivo, **resumir_particao(df)}
+
+def ler_particao(diretorio, entrada):
+    """Lê uma partição mensal via memory-map como tabela Arrow"""
+    return feather.read_table(caminho_particao(diretorio, entrada['arquivo']), memory_map=True)
+
+def gravar_manifesto(diretorio, digest, manifesto):
+    """Grava o manifesto do dataset"""
+    conteudo = json.dumps(manifesto, ensure_ascii=False, indent=1)
+    return gravar_arquivo_atomico(
+        caminho_manifesto(diretorio, digest),
+        lambda temporario: Path(temporario).write_text(conteudo, encoding="utf-8"),
+    )
+
+def ler_manifesto(diretorio, digest):
+    """Lê o manifesto do dataset; retorna None se não existir ou estiver corrompido"""
+    origem = caminho_manifesto(diretorio, digest)
+    try:
+        return json.loads(origem.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def salvar_quarentena(diretorio, digest, tabelas):
+    """Grava as linhas rejeitadas em um único arquivo e retorna a entrada do manifesto"""
+    entrada = {'arquivo': None, 'linhas': 0, 'motivos': contar_motivos_quarentena([])}
+    tabelas = [tabela for tabela in tabelas if tabela.num_rows]
+    if not tabelas:
+        return entrada
+    tabela = concatenar_tabelas_arrow(tabelas)
+    arquivo = f"{digest}-quarentena-v{VERSAO_FORMATO}.arrow"
+    gravar_arquivo_atomico(
+        caminho_particao(diretorio, arquivo),
+        lambda temporario: feather.write_feather(tabela, temporario, compression="uncompressed"),
+    )
+    entrada['arquivo'] = arquivo
+    entrada['linhas'] = tabela.num_rows
+    contar_motivos_quarentena(tabela.column(COLUNA_MOTIVOS).to_numpy(), entrada['motivos'])
+    return entrada
+
+def ler_quarentena(diretorio, digest, limite=None):
+    """Linhas rejeitadas do dataset com a descrição dos motivos; None se não houver
+
+    Com `limite`, o arquivo (sem compressão) é mapeado em memória e só as primeiras
+    `limite` linhas são convertidas, sem materializar a quarentena inteira.
+    """
+    manifesto = ler_manifesto(diretorio, digest)
+    if manifesto is None or not (manifesto.get('quarentena') or {}).get('arquivo'):
+        return None
+    tabela = feather.read_table(caminho_particao(diretorio, manifesto['quarentena']['arquivo']), memory_map=True)
+    if limite is not None:
+        tabela = tabela.slice(0, limite)
+    df = tabela.to_pandas()
+    motivos = normalizar_por_valores_unicos(df.pop(COLUNA_MOTIVOS), descrever_motivos_quarentena)
+    df.insert(0, 'Motivos', motivos)
+    return df
+
+def salvar_dataset_colunar(diretorio, digest, tabela, encoding, quarentena=None):
+    """Grava a tabela Arrow processada como partições mensais mais o manifesto
+
+    Cada partição é recortada da tabela, convertida para o layout compacto e gravada
+    antes da próxima: o pico de memória é a tabela mais uma partição em pandas, sem um
+    frame do dataset inteiro.
+    """
+    if 'Ano' in tabela.column_names and 'Mês' in tabela.column_names:
+        posicoes = posicoes_particoes_mensais(
+            tabela.column('Ano').to_numpy(zero_copy_only=False),
+            tabela.column('Mês').to_pandas(),
+        )
+    else:
+        posicoes = {PARTICAO_SEM_PERIODO: np.arange(tabela.num_rows)}
+    particoes = {}
+    for chave, linhas in posicoes.items():
+        parte = aplicar_esquema_compacto(tabela.take(linhas).to_pandas())
+        particoes[chave] = salvar_particao(diretorio, digest, chave, parte)
+        del parte
+    return gravar_manifesto(diretorio, digest, {
+        'digest': digest,
+        'encoding': encoding,
+        'particoes': particoes,
+        'quarentena': quarentena or salvar_quarentena(diretorio, digest, []),
+        'incremento': None,
+    })
+
+def dataset_colunar_existe(diretorio, digest):
+    """Indica se o conteúdo já foi processado e persistido por completo"""
+    manifesto = ler_manifesto(diretorio, digest)
+    if manifesto is None:
+        return False
+    return all(caminho_particao(diretorio, entrada['arquivo']).exists() for entrada in manifesto['particoes'].values())
+
+def uniformizar_dicionarios(tabela):
+    """Usa o mesmo tipo de dicionário em todas as partições para que possam ser concatenadas"""
+    for indice, campo in enumerate(tabela.schema):
+        if pa.types.is_dictionary(campo.type):
+            tipo = pa.dictionary(pa.int32(), pa.large_string())
+            tabela = tabela.set_column(indice, campo.name, pc.cast(tabela.column(indice), tipo))
+    return tabela
+
+def ler_dataset_colunar(diretorio, digest):
+    """Lê as partições do dataset via memory-map e monta o frame; retorna None se não existir"""
+    manifesto = ler_manifesto(diretorio, digest)
+    if manifesto is None:
+        return None
+    try:
+        tabelas = [uniformizar_dicionarios(ler_particao(diretorio, entrada)) for entrada in manifesto['particoes'].values()]
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if not tabelas:
+        return None
+    df = aplicar_esquema_compacto(concatenar_tabelas_arrow(tabelas).unify_dictionaries().to_pandas())
+    df.attrs = {'encoding': manifesto.get('encoding')}
+    return df
+
+def texto_chave(serie):
+    """Representação textual estável de uma coluna-chave (números como float, categorias pelo rótulo, nulos vazios)"""
+    if pd.api.types.is_numeric_dtype(serie) and not isinstance(serie.dtype, pd.CategoricalDtype):
+        texto = pd.to_numeric(serie, errors='coerce').astype('Float64').astype(str)
+    else:
+        texto = serie.astype(str).str.strip()
+    return texto.where(serie.notna().to_numpy(), '')
+
+def hash_chaves_deduplicacao(df, chaves=None):
+    """Hash por linha das chaves presentes no frame (por padrão a linha inteira)"""
+    colunas = list(df.columns) if chaves is None else [coluna for coluna in chaves if coluna in df.columns]
+    chaves = pd.DataFrame({coluna: texto_chave(df[coluna]) for coluna in colunas}, index=df.index)
+    return pd.util.hash_pandas_object(chaves, index=False)
+
+def derivar_digest_incremental(digest_base, digest_incremento):
+    """Digest do dataset resultante de anexar um incremento ao dataset ``digest_base``"""
+    return calcular_hash_conteudo(f"{digest_base}+{digest_incremento}".encode("ascii"))
+
+def anexar_csv_cfem_incremental(diretorio, digest_base, fonte, digest_fonte=None):
+    """Anexa um CSV incremental (tipicamente um novo mês) ao dataset persistido
+
+    Só as partições mensais presentes no incremento são lidas e regravadas; as demais
+    continuam apontando para os arquivos do dataset base. Linhas idênticas (todas as
+    colunas) a uma já existente na partição ou repetidas no próprio incremento são
+    ignoradas, e linhas rejeitadas já presentes na quarentena não são gravadas de novo.
+    As células do cubo das linhas novas são somadas ao cubo do dataset base, de modo que
+    rankings, séries e métricas do novo digest saem do cubo sem reagregar o histórico.
+    Retorna o digest do novo dataset e o resumo do incremento; reaplicar
+    o mesmo incremento apenas devolve o resultado já gravado. ``digest_fonte`` evita
+    recalcular o hash quando o incremento já vem do armazém de arquivos.
+    """
+    if digest_fonte is None:
+        digest_fonte = calcular_hash_fonte(fonte)
+    digest = derivar_digest_incremental(digest_base, digest_fonte)
+    if dataset_colunar_existe(diretorio, digest):
+        return digest, ler_manifesto(diretorio, digest)['incremento']
+
+    manifesto_base = ler_manifesto(diretorio, digest_base)
+    if manifesto_base is None:
+        raise FileNotFoundError(f"Dataset base {digest_base} não encontrado em {diretorio}")
+
+    delta, _ = ler_csv_detectando_encoding(fonte, sep=';', dtype=TIPOS_LEITURA_CSV)
+    linhas_recebidas = len(delta)
+    delta, quarentena_delta = separar_quarentena(processar_lote_cfem(delta))
+    quarentena = manifesto_base.get('quarentena') or salvar_quarentena(diretorio, digest_base, [])
+    tabela_quarentena_base = None
+    if len(quarentena_delta):
+        # Linha rejeitada idêntica (todas as colunas) a uma já em quarentena não é repetida
+        hashes_quarentena = hash_chaves_deduplicacao(quarentena_delta, list(quarentena_delta.columns))
+        repetidas = hashes_quarentena.duplicated().to_numpy()
+        if quarentena['arquivo']:
+            tabela_quarentena_base = feather.read_table(caminho_particao(diretorio, quarentena['arquivo']))
+            quarentena_base = tabela_quarentena_base.to_pandas()
+            hashes_base = hash_chaves_deduplicacao(quarentena_base, list(quarentena_delta.columns))
+            repetidas = repetidas | hashes_quarentena.isin(hashes_base).to_numpy()
+        quarentena_delta = quarentena_delta[~repetidas]
+    particoes = dict(manifesto_base['particoes'])
+    resumo = {
+        'linhas_recebidas': int(linhas_recebidas),
+        'linhas_novas': 0,
+        'linhas_duplicadas': 0,
+        'linhas_quarentena': int(len(quarentena_delta)),
+        'particoes_atualizadas': [],
+    }
+
+    # Quarentena do novo dataset: a do base mais as linhas rejeitadas inéditas do incremento
+    if len(quarentena_delta):
+        tabelas_quarentena = [pa.Table.from_pandas(quarentena_delta, preserve_index=False)]
+        if tabela_quarentena_base is not None:
+            tabelas_quarentena.insert(0, tabela_quarentena_base)
+        quarentena = salvar_quarentena(diretorio, digest, tabelas_quarentena)
+
+    anexadas = []
+    for chave, novas in separar_particoes_mensais(delta).items():
+        atual = None
+        duplicadas = hash_chaves_deduplicacao(novas).duplicated().to_numpy()
+        if chave in particoes:
+            atual = ler_particao(diretorio, particoes[chave]).to_pandas()
+            # A partição gravada tem colunas derivadas (Periodo) que o incremento ainda não tem
+            colunas = [coluna for coluna in novas.columns if coluna in atual.columns]
+            hashes_novas = hash_chaves_deduplicacao(novas, colunas)
+            duplicadas = duplicadas | hashes_novas.isin(hash_chaves_deduplicacao(atual, colunas)).to_numpy()
+        resumo['linhas_duplicadas'] += int(duplicadas.sum())
+        novas = novas[~duplicadas]
+        if novas.empty:
+            continue
+
+        combinada = novas if atual is None else pd.concat([atual, novas], ignore_index=True)
+        particoes[chave] = salvar_particao(diretorio, digest, chave, aplicar_esquema_compacto(combinada))
+        anexadas.append(novas)
+        resumo['linhas_novas'] += int(len(novas))
+        resumo['particoes_atualizadas'].append(chave)
+
+    # Cubo do novo digest: o do base (construído agora se ainda não existir) mais as células novas
+    cubo = carregar_ou_calcular_tabela(
+        caminho_cubo(diretorio, digest_base),
+        lambda: construir_cubo_cfem(ler_dataset_colunar(diretorio, digest_base)),
+    )
+    if anexadas:
+        cubo = mesclar_cubos(cubo, construir_cubo_cfem(pd.concat(anexadas, ignore_index=True)))
+    gravar_tabela(caminho_cubo(diretorio, digest), cubo)
+
+    gravar_manifesto(diretorio, digest, {
+        'digest': digest,
+        'encoding': manifesto_base.get('encoding'),
+        'particoes': dict(sorted(particoes.items())),
+        'quarentena': quarentena,
+        'base': digest_base,
+        'incremento': resumo,
+    })
+    return digest, resumo
+
+def limpar_datasets_colunares(diretorio):
+    """Remove todos os datasets colunares persistidos (manifestos e partições)"""
+    diretorio = Path(diretorio)
+    for arquivo in [*diretorio.glob("*.json"), *diretorio.glob("*.arrow"), *diretorio.glob("particoes/*.arrow")]:
+        try:
+            arquivo.unlink()
+        except OSError:
+            pass
+
+# ===== CUBO DE AGREGAÇÃO =====
+# Somas pré-agregadas por UF × Município × Ano × Mês × Substância × Tipo_PF_PJ, ordenadas
+# nessa sequência. Construído uma vez por dataset; as abas consultam o cubo em vez do frame
+# bruto e recortam estados/municípios por offsets, sem varrer colunas.
+def caminho_cubo(diretorio, digest):
+    """Caminho do cubo persistido do dataset"""
+    return caminho_particao(diretorio, f"{digest}-cubo-v{VERSAO_FORMATO}.arrow")
+
+# Medidas somadas em cada célula do cubo
+MEDIDAS_CUBO = ['ValorRecolhido_centavos', 'Registros', 'QuantidadeComercializada']
+
+def agregar_celulas_cubo(df, medidas):
+    """Soma as medidas por célula das dimensões presentes no frame, na ordem do cubo"""
+    dimensoes = [coluna for coluna in DIMENSOES_CUBO if coluna in df.columns]
+    cubo = medidas.groupby([df[coluna] for coluna in dimensoes], observed=True, dropna=False, sort=True).sum()
+    cubo = cubo.reset_index()
+    cubo['ValorRecolhido'] = cubo['ValorRecolhido_centavos'] / 100
+    cubo['Periodo'] = calcular_periodo(cubo['Ano'], cubo['Mês'])
+    return cubo
+
+def construir_cubo_cfem(df):
+    """Agrega o frame na granularidade do cubo (soma, contagem e quantidade), ordenado por UF e Município"""
+    medidas = pd.DataFrame({
+        'ValorRecolhido_centavos': df['ValorRecolhido_centavos'],
+        'Registros': np.ones(len(df), dtype='int64'),
+        'QuantidadeComercializada': df['QuantidadeComercializada'],
+    }, index=df.index)
+    return agregar_celulas_cubo(df, medidas)
+
+def mesclar_cubos(cubo, delta):
+    """Soma as células do cubo ``delta`` às do cubo base; o resultado tem a ordem e as categorias de um cubo novo"""
+    combinado = aplicar_esquema_compacto(pd.concat([cubo, delta], ignore_index=True))
+    return agregar_celulas_cubo(combinado, combinado[MEDIDAS_CUBO])
+
+def gravar_tabela(destino, tabela):
+    """Grava uma tabela derivada em Feather sem compressão"""
+    return gravar_arquivo_atomico(
+        destino,
+        lambda temporario: feather.write_feather(tabela, temporario, compression="uncompressed"),
+    )
+
+def carregar_ou_calcular_tabela(destino, calcular):
+    """Lê a tabela derivada persistida em destino; se não existir, calcula e grava"""
+    try:
+        return feather.read_table(destino, memory_map=True).to_pandas()
+    except (OSError, pa.ArrowInvalid):
+        pass
+    tabela = calcular()
+    gravar_tabela(destino, tabela)
+    return tabela
+
+def carregar_cubo_cfem(diretorio, digest, df):
+    """Lê o cubo persistido do dataset; se não existir, constrói a partir do frame e grava"""
+    return carregar_ou_calcular_tabela(caminho_cubo(diretorio, digest), lambda: construir_cubo_cfem(df))
+
+def intervalos_contiguos(cubo, colunas):
+    """Offsets [início, fim) de cada valor das colunas-chave no cubo ordenado"""
+    grupos = cubo.groupby(colunas, observed=True, sort=False).indices
+    return {chave: (int(posicoes[0]), int(posicoes[-1]) + 1) for chave, posicoes in grupos.items()}
+
+def indexar_cubo(cubo):
+    """Índice de fatias do cubo: por UF e por (UF, Município); por Município só os pares (UF, Município)"""
+    municipios = intervalos_contiguos(cubo, ['UF', 'Município'])
+    por_nome = {}
+    for (uf, municipio), intervalo in sorted(municipios.items(), key=lambda item: item[1]):
+        por_nome.setdefault(municipio, []).append(intervalo)
+    return {
+        'estados': intervalos_contiguos(cubo, 'UF'),
+        'municipios': municipios,
+        'nomes_municipios': por_nome,
+    }
+
+def fatiar_cubo(cubo, indice, uf, municipio=None):
+    """Fatia contígua do cubo para a UF (ou o par UF, Município), sem varrer as colunas"""
+    if municipio is None:
+        inicio, fim = indice['estados'].get(uf, (0, 0))
+    else:
+        inicio, fim = indice['municipios'].get((uf, municipio), (0, 0))
+    return cubo.iloc[inicio:fim]
+
+def fatiar_cubo_por_municipio(cubo, indice, municipio):
+    """Células do cubo de todos os municípios com o nome dado, em qualquer UF"""
+    intervalos = indice['nomes_municipios'].get(municipio, [])
+    if len(intervalos) == 1:
+        inicio, fim = intervalos[0]
+        return cubo.iloc[inicio:fim]
+    if not intervalos:
+        return cubo.iloc[0:0]
+    return pd.concat([cubo.iloc[inicio:fim] for inicio, fim in intervalos])
+
+def classificar_totais(totais, nacional=True):
+    """Tabela de ranking a partir dos totais em centavos indexados por (UF, Município)"""
+    tabela = totais.rename('total_centavos').to_frame()
+    totais = tabela['total_centavos']
+    por_uf = totais.groupby(level='UF', observed=True)
+    tabela['posicao_estado'] = por_uf.rank(method='min', ascending=False).astype('int32')
+    tabela['municipios_estado'] = por_uf.transform('size')
+    tabela['percentil_estado'] = (1 - tabela['posicao_estado'] / tabela['municipios_estado']) * 100
+    tabela['participacao_estado'] = totais / por_uf.transform('sum') * 100
+    if nacional:
+        tabela['posicao_nacional'] = totais.rank(method='min', ascending=False).astype('int32')
+        tabela['municipios_nacional'] = len(tabela)
+        tabela['percentil_nacional'] = (1 - tabela['posicao_nacional'] / len(tabela)) * 100
+        tabela['participacao_nacional'] = totais / totais.sum() * 100
+    return tabela
+
+def classificar_municipios(cubo, nacional=True):
+    """Tabela de ranking indexada por (UF, Município): posição (empates com a menor posição), percentil e participação na UF (e no país)"""
+    totais = cubo.groupby(['UF', 'Município'], observed=True)['ValorRecolhido_centavos'].sum()
+    return classificar_totais(totais, nacional)
+
+def taxa_crescimento(atual, anterior):
+    """Crescimento percentual elemento a elemento; 0 onde o valor anterior é nulo ou zero"""
+    atual = np.asarray(atual, dtype='float64')
+    anterior = np.asarray(anterior, dtype='float64')
+    comparavel = np.isfinite(anterior) & (anterior != 0)
+    return np.where(comparavel, (atual - anterior) / np.where(comparavel, anterior, 1) * 100, 0.0)
+
+def calcular_metricas_municipios(cubo):
+    """Métricas dos insights municipais para todos os municípios de uma vez, indexadas por (UF, Município)
+
+    Evolução e tendência anual, substância principal, comparação com a média da UF,
+    ranking, diversificação e coeficiente de variação mensal, tudo em operações agrupadas.
+    """
+    chaves = ['UF', 'Município']
+    somas = cubo.groupby(chaves, observed=True)[['ValorRecolhido', 'ValorRecolhido_centavos', 'Registros']].sum()
+    metricas = classificar_totais(somas['ValorRecolhido_centavos'], nacional=False)
+    metricas['total'] = somas['ValorRecolhido']
+    metricas['registros'] = somas['Registros']
+    metricas['media_registro'] = somas['ValorRecolhido'] / somas['Registros']
+
+    somas_uf = cubo.groupby('UF', observed=True)[['ValorRecolhido', 'Registros']].sum()
+    media_uf = somas_uf['ValorRecolhido'] / somas_uf['Registros']
+    metricas['media_estadual'] = media_uf.reindex(metricas.index.get_level_values('UF')).to_numpy()
+    metricas['diferenca_media_estadual'] = (metricas['media_registro'] - metricas['media_estadual']) / metricas['media_estadual'] * 100
+
+    # Série anual: primeiro, penúltimo e último ano de cada município
+    anual = cubo.groupby(chaves + ['Ano'], observed=True)['ValorRecolhido'].sum().reset_index()
+    por_municipio = anual.groupby(chaves, observed=True)
+    anual['ordem_reversa'] = por_municipio.cumcount(ascending=False)
+    penultimo = anual[anual['ordem_reversa'] == 1].set_index(chaves)['ValorRecolhido']
+    metricas['anos'] = por_municipio.size()
+    metricas['ano_inicial'] = por_municipio['Ano'].first()
+    metricas['ano_final'] = por_municipio['Ano'].last()
+    valor_inicial = por_municipio['ValorRecolhido'].first().reindex(metricas.index)
+    valor_final = por_municipio['ValorRecolhido'].last().reindex(metricas.index)
+    metricas['crescimento_total'] = taxa_crescimento(valor_final, valor_inicial)
+    metricas['crescimento_recente'] = taxa_crescimento(valor_final, penultimo.reindex(metricas.index))
+
+    # Substância principal (primeira em ordem alfabética em caso de empate) e diversificação
+    por_substancia = cubo.groupby(chaves + ['Substância'], observed=True)['ValorRecolhido'].sum().reset_index()
+    principal = por_substancia.loc[por_substancia.groupby(chaves, observed=True)['ValorRecolhido'].idxmax()].set_index(chaves)
+    metricas['substancia_principal'] = principal['Substância'].reindex(metricas.index)
+    metricas['participacao_substancia'] = principal['ValorRecolhido'].reindex(metricas.index) / metricas['total'] * 100
+    metricas['num_substancias'] = por_substancia.groupby(chaves, observed=True).size().reindex(metricas.index, fill_value=0)
+
+    # Volatilidade mensal
+    mensal = cubo.groupby(chaves + ['Periodo'], observed=True)['ValorRecolhido'].sum().groupby(level=chaves, observed=True)
+    metricas['meses'] = mensal.size()
+    metricas['cv_mensal'] = mensal.std() / mensal.mean() * 100
+    return metricas
+
+def consultar_ranking(tabela, uf, municipio):
+    """Linha do ranking do município (acesso pelo índice); None se não estiver na tabela"""
+    try:
+        return tabela.loc[(uf, municipio)]
+    except KeyError:
+        return None
+
+def media_por_registro(cubo, coluna='ValorRecolhido'):
+    """Média por registro original de uma medida somada no cubo"""
+    registros = cubo['Registros'].sum()
+    return cubo[coluna].sum() / registros if registros else 0.0
+
+def resumir_municipios(cubo):
+    """Total, registros, média, nº de substâncias e primeiro/último período de cada (UF, Município) do cubo
+
+    Só agregações nativas (soma, mínimo, máximo, nunique) sobre as células do cubo,
+    sem função Python por grupo.
+    """
+    grupos = cubo.groupby(['UF', 'Município'], observed=True)
+    resumo = grupos.agg(
+        centavos=('ValorRecolhido_centavos', 'sum'),
+        registros=('Registros', 'sum'),
+        num_substancias=('Substância', 'nunique'),
+        periodo_inicial=('Periodo', 'min'),
+        periodo_final=('Periodo', 'max'),
+    )
+    resumo.insert(0, 'total', resumo.pop('centavos') / 100)
+    resumo.insert(1, 'media_registro', resumo['total'] / resumo['registros'])
+    return resumo
+
+# ===== SÉRIES ACUMULADAS POR PERÍODO =====
+# Linha do tempo mensal densa (período = Ano * 12 + Mês - 1) com somas de prefixo por
+# entidade: o total de qualquer intervalo contíguo de meses é a diferença de dois prefixos.
+def rotulo_periodo(periodo):
+    """Rótulo AAAA-MM do código de período"""
+    ano, mes = divmod(int(periodo), 12)
+    return f"{ano:04d}-{mes + 1:02d}"
+
+def rotular_intervalos_periodo(inicio, fim, ausente="N/D"):
+    """Rótulo "AAAA-MM a AAAA-MM" de cada par de códigos; só os pares distintos são formatados"""
+    pares = np.stack([
+        pd.Series(inicio).to_numpy(dtype='int64', na_value=-1),
+        pd.Series(fim).to_numpy(dtype='int64', na_value=-1),
+    ], axis=1)
+    distintos, posicoes = np.unique(pares, axis=0, return_inverse=True)
+    rotulos = np.array([
+        f"{rotulo_periodo(primeiro)} a {rotulo_periodo(ultimo)}" if primeiro >= 0 and ultimo >= 0 else ausente
+        for primeiro, ultimo in distintos
+    ], dtype=object)
+    return rotulos[posicoes.reshape(-1)]
+
+def periodos_cubo(cubo):
+    """Código de período de cada célula do cubo; -1 nas células sem Ano ou Mês"""
+    return cubo['Periodo'].to_numpy(dtype='int64', na_value=-1)
+
+def construir_acumulados(cubo):
+    """Somas de prefixo mensais de centavos e registros por UF, (UF, Município) e Substância"""
+    periodos = periodos_cubo(cubo)
+    validos = periodos >= 0
+    if not validos.any():
+        return {'inicio': 0, 'periodos': 0, 'dimensoes': {}}
+    inicio = int(periodos[validos].min())
+    quantidade = int(periodos[validos].max()) - inicio + 1
+    coluna = periodos - inicio + 1  # a coluna 0 é o prefixo vazio
+    centavos = cubo['ValorRecolhido_centavos'].to_numpy()
+    registros = cubo['Registros'].to_numpy()
+    dimensoes = {}
+    for nome, chaves in DIMENSOES_ACUMULADAS.items():
+        grupos = cubo.groupby(chaves, observed=True, sort=True)
+        linha = grupos.ngroup().to_numpy()
+        selecao = validos & (linha >= 0)
+        acumulados = {}
+        for medida, valores in (('centavos', centavos), ('registros', registros)):
+            serie = np.zeros((grupos.ngroups, quantidade + 1), dtype='int64')
+            np.add.at(serie, (linha[selecao], coluna[selecao]), valores[selecao])
+            acumulados[medida] = np.cumsum(serie, axis=1, out=serie)
+        dimensoes[nome] = {'entidades': grupos.size().index, **acumulados}
+    return {'inicio': inicio, 'periodos': quantidade, 'dimensoes': dimensoes}
+
+def limites_intervalo(acumulados, inicio, fim):
+    """Colunas de prefixo [a, b) do intervalo de períodos inicio..fim (inclusive), limitado à linha do tempo"""
+    a = min(max(int(inicio) - acumulados['inicio'], 0), acumulados['periodos'])
+    b = min(max(int(fim) - acumulados['inicio'] + 1, a), acumulados['periodos'])
+    return a, b
+
+def totais_periodo(acumulados, dimensao, inicio, fim):
+    """Centavos e registros de todas as entidades da dimensão no intervalo de períodos (inclusive)"""
+    serie = acumulados['dimensoes'][dimensao]
+    a, b = limites_intervalo(acumulados, inicio, fim)
+    return pd.DataFrame({
+        'total_centavos': serie['centavos'][:, b] - serie['centavos'][:, a],
+        'registros': serie['registros'][:, b] - serie['registros'][:, a],
+    }, index=serie['entidades'])
+
+def total_periodo(acumulados, dimensao, chave, inicio, fim):
+    """Total em centavos de uma entidade no intervalo de períodos (inclusive); 0 se não existir"""
+    serie = acumulados['dimensoes'].get(dimensao)
+    if serie is None or chave not in serie['entidades']:
+        return 0
+    linha = serie['entidades'].get_loc(chave)
+    a, b = limites_intervalo(acumulados, inicio, fim)
+    return int(serie['centavos'][linha, b] - serie['centavos'][linha, a])
+
+def matriz_mensal(acumulados, dimensao):
+    """Arrecadação mensal (entidades × períodos) a partir dos prefixos; NaN nos meses sem registros"""
+    serie = acumulados['dimensoes'][dimensao]
+    valores = np.diff(serie['centavos'], axis=1) / 100
+    valores[np.diff(serie['registros'], axis=1) == 0] = np.nan
+    periodos = range(acumulados['inicio'], acumulados['inicio'] + acumulados['periodos'])
+    return pd.DataFrame(valores, index=serie['entidades'], columns=periodos)
+
+# ===== TENDÊNCIAS EM LOTE =====
+# Regressão linear de todas as séries de uma matriz (entidades × períodos) em forma fechada,
+# por operações sobre arrays; meses ausentes (NaN) ficam fora do ajuste da sua linha.
+def ajustar_tendencias(matriz, passos=3):
+    """Inclinação, intercepto, R² e projeção de cada linha da matriz; NaN em linhas com menos de 3 meses"""
+    y = np.asarray(matriz, dtype='float64')
+    observado = np.isfinite(y)
+    x = np.arange(y.shape[1], dtype='float64')
+    observacoes = observado.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media_x = np.where(observado, x, 0.0).sum(axis=1) / observacoes
+        media_y = np.where(observado, y, 0.0).sum(axis=1) / observacoes
+        dx = np.where(observado, x - media_x[:, None], 0.0)
+        dy = np.where(observado, y - media_y[:, None], 0.0)
+        sxx = (dx * dx).sum(axis=1)
+        syy = (dy * dy).sum(axis=1)
+        inclinacao = np.where(sxx != 0, (dx * dy).sum(axis=1) / sxx, 0.0)
+        intercepto = media_y - inclinacao * media_x
+        residuo = np.where(observado, y - (inclinacao[:, None] * x + intercepto[:, None]), 0.0)
+        r2 = np.where(syy != 0, 1 - (residuo * residuo).sum(axis=1) / syy, 0.0)
+    projecao = inclinacao[:, None] * np.arange(y.shape[1], y.shape[1] + passos) + intercepto[:, None]
+    insuficiente = observacoes < 3
+    for valores in (inclinacao, intercepto, r2, projecao):
+        valores[insuficiente] = np.nan
+    return {'observacoes': observacoes, 'inclinacao': inclinacao, 'intercepto': intercepto, 'r2': r2, 'projecao': projecao}
+
+def calcular_tendencias(acumulados, dimensao='Município', passos=3):
+    """Tendência linear mensal de todas as entidades da dimensão, como tabela indexada pela entidade"""
+    matriz = matriz_mensal(acumulados, dimensao)
+    ajuste = ajustar_tendencias(matriz.to_numpy(), passos)
+    tabela = pd.DataFrame({
+        'meses': ajuste['observacoes'],
+        'inclinacao': ajuste['inclinacao'],
+        'intercepto': ajuste['intercepto'],
+        'r2': ajuste['r2'],
+    }, index=matriz.index)
+    for passo in range(passos):
+        tabela[f'projecao_{passo + 1}'] = ajuste['projecao'][:, passo]
+    return tabela
+
+# ===== SAZONALIDADE E MESES ATÍPICOS EM LOTE =====
+# Índices sazonais e meses atípicos de todas as UFs, municípios e substâncias a partir das
+# matrizes mensais; o resultado é persistido junto do dataset, por digest.
+def calcular_indices_sazonais(matriz):
+    """Índice sazonal de cada linha: média do mês do calendário / média mensal geral × 100"""
+    valores = matriz.to_numpy()
+    observado = np.isfinite(valores)
+    meses_calendario = np.asarray(matriz.columns) % 12
+    calendario = (meses_calendario[:, None] == np.arange(12)).astype('float64')
+    soma_mes = np.where(observado, valores, 0.0) @ calendario
+    contagem_mes = observado.astype('float64') @ calendario
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media_mes = soma_mes / contagem_mes
+        media_geral = soma_mes.sum(axis=1) / contagem_mes.sum(axis=1)
+        indices = media_mes / media_geral[:, None] * 100
+    return pd.DataFrame(indices, index=matriz.index, columns=[f"mes_{mes:02d}" for mes in range(1, 13)])
+
+def detectar_meses_atipicos(matriz):
+    """Meses fora das cercas IQR ou com |z robusto| acima do limite, em formato longo por linha da matriz"""
+    valores = matriz.to_numpy()
+    elegiveis = np.isfinite(valores).sum(axis=1) >= MINIMO_MESES_ANOMALIA
+    valores = valores[elegiveis]
+    if not len(valores):
+        colunas = ['Periodo', 'Valor', 'Mediana', 'LimiteInferior', 'LimiteSuperior', 'ZRobusto', 'ForaIQR', 'ZExtremo']
+        return pd.DataFrame(columns=colunas, index=matriz.index[:0])
+    q1, mediana, q3 = np.nanquantile(valores, [0.25, 0.5, 0.75], axis=1)
+    iqr = q3 - q1
+    limite_inferior = q1 - MULTIPLICADOR_IQR * iqr
+    limite_superior = q3 + MULTIPLICADOR_IQR * iqr
+    mad = np.nanmedian(np.abs(valores - mediana[:, None]), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z_robusto = np.where(mad[:, None] > 0, 0.6745 * (valores - mediana[:, None]) / mad[:, None], 0.0)
+    fora_iqr = (valores < limite_inferior[:, None]) | (valores > limite_superior[:, None])
+    z_extremo = np.abs(z_robusto) > LIMITE_Z_ROBUSTO
+    linhas, colunas = np.nonzero((fora_iqr | z_extremo) & np.isfinite(valores))
+    return pd.DataFrame({
+        'Periodo': np.asarray(matriz.columns)[colunas],
+        'Valor': valores[linhas, colunas],
+        'Mediana': mediana[linhas],
+        'LimiteInferior': limite_inferior[linhas],
+        'LimiteSuperior': limite_superior[linhas],
+        'ZRobusto': z_robusto[linhas, colunas],
+        'ForaIQR': fora_iqr[linhas, colunas],
+        'ZExtremo': z_extremo[linhas, colunas],
+    }, index=matriz.index[elegiveis][linhas])
+
+def identificar_entidades(indice, dimensao):
+    """Colunas Dimensão, UF e Entidade a partir do índice das entidades de uma dimensão"""
+    if dimensao == 'Município':
+        uf = indice.get_level_values('UF').astype(str)
+        entidade = indice.get_level_values('Município').astype(str)
+    else:
+        entidade = indice.astype(str)
+        uf = entidade if dimensao == 'UF' else [None] * len(indice)
+    return pd.DataFrame({
+        'Dimensão': pd.Series(dimensao, index=range(len(indice)), dtype='str'),
+        'UF': pd.Series(np.asarray(uf, dtype=object), dtype='str'),
+        'Entidade': pd.Series(np.asarray(entidade, dtype=object), dtype='str'),
+    })
+
+def calcular_perfil_sazonal(acumulados, calcular):
+    """Aplica o cálculo a cada dimensão acumulada e empilha o resultado com a identificação das entidades"""
+    partes = []
+    for dimensao in acumulados['dimensoes']:
+        resultado = calcular(matriz_mensal(acumulados, dimensao))
+        identificacao = identificar_entidades(resultado.index, dimensao)
+        partes.append(pd.concat([identificacao, resultado.reset_index(drop=True)], axis=1))
+    if not partes:
+        return pd.DataFrame(columns=['Dimensão', 'UF', 'Entidade'])
+    return pd.concat(partes, ignore_index=True)
+
+def carregar_sazonalidade_entidades(diretorio, digest, acumulados):
+    """Índices sazonais de todas as entidades do dataset (persistidos por digest)"""
+    destino = caminho_particao(diretorio, f"{digest}-sazonalidade-v{VERSAO_FORMATO}.arrow")
+    return carregar_ou_calcular_tabela(destino, lambda: calcular_perfil_sazonal(acumulados, calcular_indices_sazonais))
+
+def carregar_meses_atipicos(diretorio, digest, acumulados):
+    """Meses atípicos de todas as entidades do dataset (persistidos por digest)"""
+    destino = caminho_particao(diretorio, f"{digest}-anomalias-v{VERSAO_FORMATO}.arrow")
+    return carregar_ou_calcular_tabela(destino, lambda: calcular_perfil_sazonal(acumulados, detectar_meses_atipicos))
+
+# ===== CONCENTRAÇÃO (PARETO, HHI, GINI) =====
+# Um único vetor por dimensão, ordenado por grupo e valor decrescente: somas acumuladas
+# inteiras (centavos) dão a curva de Lorenz completa e reduções por grupo (bincount) dão
+# HHI, Gini e o corte de 80% de todos os grupos (ex.: todas as UFs) de uma vez.
+def calcular_concentracao(df, dimensao, por=None):
+    """Curva de concentração completa e índices da dimensão; ``por`` (ex.: 'UF') separa grupos
+
+    Retorna ``{'curva', 'resumo'}``. A curva tem uma linha por entidade com Valor (R$),
+    Posicao, Participacao, Participacao_Acumulada e Populacao_Acumulada (em %); o resumo
+    tem uma linha por grupo com entidades, total, hhi (0 a 10.000), gini e corte_80.
+    """
+    grupos = [por] if por else []
+    chaves = grupos + [coluna for coluna in DIMENSOES_CONCENTRACAO[dimensao] if coluna not in grupos]
+    curva = df.groupby(chaves, observed=True)['ValorRecolhido_centavos'].sum().rename('Valor').reset_index()
+    if grupos:
+        codigos = curva.groupby(grupos, observed=True, sort=True).ngroup().to_numpy()
+    else:
+        codigos = np.zeros(len(curva), dtype=np.int64)
+    centavos = curva['Valor'].to_numpy(dtype=np.int64)
+    ordem = np.lexsort((-centavos, codigos))
+    curva = curva.iloc[ordem].reset_index(drop=True)
+    codigos, centavos = codigos[ordem], centavos[ordem]
+
+    num_grupos = int(codigos.max()) + 1 if len(codigos) else 0
+    entidades = np.bincount(codigos, minlength=num_grupos)
+    inicio = np.cumsum(entidades) - entidades
+    acumulado = np.cumsum(centavos)
+    acumulado -= np.concatenate([[0], acumulado])[inicio][codigos]
+    total = acumulado[inicio + entidades - 1] if len(codigos) else np.zeros(0, dtype=np.int64)
+    posicao = np.arange(len(curva)) - inicio[codigos] + 1
+    curva['Valor'] = centavos / 100
+    curva['Posicao'] = posicao
+    with np.errstate(divide='ignore', invalid='ignore'):
+        participacao = centavos / total[codigos] * 100
+        curva['Participacao'] = participacao
+        curva['Participacao_Acumulada'] = acumulado / total[codigos] * 100
+        curva['Populacao_Acumulada'] = posicao / entidades[codigos] * 100
+
+        # Gini pela fórmula ordenada: posição crescente i = n - posição decrescente + 1
+        soma_ponderada = np.bincount(codigos, weights=(entidades[codigos] - posicao + 1) * centavos.astype('float64'), minlength=num_grupos)
+        gini = 2 * soma_ponderada / (entidades * total.astype('float64')) - (entidades + 1) / entidades
+    resumo = pd.DataFrame({
+        'entidades': entidades,
+        'total': total / 100,
+        'hhi': np.bincount(codigos, weights=np.nan_to_num(participacao) ** 2, minlength=num_grupos),
+        'gini': np.where(total > 0, gini, np.nan),
+        # Entidades até a que cruza o limiar: as que começam abaixo dele
+        'corte_80': np.bincount(codigos, weights=(acumulado - centavos) * 100 < LIMIAR_PARETO * total[codigos], minlength=num_grupos).astype(np.int64),
+    })
+    if grupos:
+        resumo.index = pd.Index(curva[por].iloc[inicio].to_numpy(), name=por)
+    return {'curva': curva, 'resumo': resumo}
+
+def participacao_top(concentracao, k):
+    """Participação acumulada (%) das k maiores entidades de cada grupo"""
+    resumo = concentracao['resumo']
+    inicio = np.cumsum(resumo['entidades'].to_numpy()) - resumo['entidades'].to_numpy()
+    ultima = inicio + np.minimum(k, resumo['entidades'].to_numpy()) - 1
+    return pd.Series(concentracao['curva']['Participacao_Acumulada'].to_numpy()[ultima], index=resumo.index)
+
+# ===== PERFIL DE QUALIDADE =====
+# Nulos de todas as colunas em uma passagem, duplicatas por hash de 64 bits da linha e lacunas
+# pelo código inteiro de período. O modo rápido analisa só as linhas cujo hash das colunas sem
+# texto livre cai na faixa mais baixa: uma amostra pseudoaleatória em que cópias idênticas
+# entram (ou saem) juntas, e só essas linhas pagam o hash das colunas de texto.
+def hash_linhas(df):
+    """Hash de 64 bits de cada linha, sem o índice; linhas iguais têm o mesmo hash"""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def intervalo_wilson(sucessos, total, z=Z_CONFIANCA_95):
+    """Intervalo de Wilson (em %) para a proporção sucessos/total"""
+    if not total:
+        return [0.0, 0.0]
+    proporcao = sucessos / total
+    denominador = 1 + z * z / total
+    centro = (proporcao + z * z / (2 * total)) / denominador
+    margem = z * np.sqrt(proporcao * (1 - proporcao) / total + z * z / (4 * total * total)) / denominador
+    return [float(max(0.0, centro - margem) * 100), float(min(1.0, centro + margem) * 100)]
+
+def medir_proporcao(sucessos, analisadas, linhas):
+    """Quantidade (estimada para todas as linhas), percentual e, se amostral, intervalo de 95%"""
+    percentual = sucessos / analisadas * 100 if analisadas else 0.0
+    medida = {'quantidade': int(round(percentual / 100 * linhas)), 'percentual': float(percentual)}
+    if analisadas < linhas:
+        medida['intervalo_95'] = intervalo_wilson(sucessos, analisadas)
+    return medida
+
+def perfilar_qualidade(df, amostra=None):
+    """Métricas de qualidade do frame e score de 0 a 100; ``amostra`` (linhas) ativa o modo rápido"""
+    linhas = len(df)
+    if amostra is not None and amostra < linhas:
+        colunas_sorteio = [coluna for coluna in df.columns if not pd.api.types.is_string_dtype(df[coluna].dtype)]
+        sorteio = hash_linhas(df[colunas_sorteio or list(df.columns)])
+        base = df[sorteio < np.uint64(amostra / linhas * 2.0 ** 64)]
+    else:
+        base = df
+    hashes = hash_linhas(base)
+    analisadas = len(base)
+    qualidade = {
+        'modo': 'rapido' if analisadas < linhas else 'completo',
+        'linhas': linhas,
+        'linhas_analisadas': analisadas,
+    }
+
+    # 1. Dados faltantes: isna do frame inteiro, somado por coluna
+    nulos = base.isna().sum()
+    qualidade['dados_faltantes'] = {
+        str(coluna): medir_proporcao(int(quantidade), analisadas, linhas) for coluna, quantidade in nulos.items()
+    }
+
+    # 2. Registros duplicados: repetições do hash da linha
+    duplicados = int(pd.Series(hashes).duplicated().sum())
+    qualidade['duplicados'] = medir_proporcao(duplicados, analisadas, linhas)
+
+    # 3. Gaps temporais: sempre sobre todas as linhas (a coluna inteira de período é barata)
+    periodos = df['Periodo'].dropna().unique() if 'Periodo' in df.columns else []
+    if len(periodos) > 0:
+        meses_esperados = int(periodos.max()) - int(periodos.min()) + 1
+        qualidade['gaps_temporais'] = {
+            'gaps': meses_esperados - len(periodos),
+            'completude': len(periodos) / meses_esperados * 100,
+        }
+    else:
+        qualidade['gaps_temporais'] = {'gaps': 0, 'completude': 0}
+
+    # 4. Valores suspeitos, com outliers extremos a 3 desvios padrão
+    valores = base['ValorRecolhido']
+    media, desvio = valores.mean(), valores.std()
+    negativos = int((valores < 0).sum())
+    outliers = int(((valores > media + 3 * desvio) | (valores < media - 3 * desvio)).sum())
+    qualidade['valores_suspeitos'] = {
+        'negativos': medir_proporcao(negativos, analisadas, linhas),
+        'zeros': medir_proporcao(int((valores == 0).sum()), analisadas, linhas),
+        'outliers_extremos': medir_proporcao(outliers, analisadas, linhas),
+    }
+
+    # 5. Score geral (0-100): faltantes (máx -30), duplicados (máx -20), gaps (máx -20), suspeitos (máx -30)
+    percentuais_faltantes = [medida['percentual'] for medida in qualidade['dados_faltantes'].values()]
+    score = 100
+    score -= min(30, sum(percentuais_faltantes) / max(len(percentuais_faltantes), 1) * 0.5)
+    score -= min(20, qualidade['duplicados']['percentual'] * 2)
+    score -= min(20, (100 - qualidade['gaps_temporais']['completude']) * 0.2)
+    pct_suspeitos = (negativos + outliers) / analisadas * 100 if analisadas else 0.0
+    score -= min(30, pct_suspeitos * 3)
+    qualidade['score'] = float(max(0, score))
+    return qualidade
+
+def carregar_perfil_qualidade(diretorio, digest, df, amostra=None):
+    """Perfil de qualidade persistido por digest, versão do formato e modo; calcula e grava na primeira vez"""
+    modo = "completo" if amostra is None else f"amostra{amostra}"
+    destino = Path(diretorio) / f"{digest}-qualidade-{modo}-v{VERSAO_FORMATO}.json"
+    try:
+        return json.loads(destino.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+    qualidade = perfilar_qualidade(df, amostra)
+    conteudo = json.dumps(qualidade, ensure_ascii=False, indent=1)
+    gravar_arquivo_atomico(destino, lambda temporario: Path(temporario).write_text(conteudo, encoding="utf-8"))
+    return qualidade
+
+# ===== FILTROS POR BITMAPS =====
+# Índice invertido: um bitmap de linhas (np.packbits) por valor distinto de cada coluna de
+# filtro. Uma combinação de filtros vira OU entre valores e E entre colunas, sem varrer o frame.
+def construir_bitmaps(df, colunas=COLUNAS_FILTRO):
+    """Bitmaps compactados das linhas de cada valor das colunas de filtro"""
+    bitmaps = {}
+    for coluna in colunas:
+        if coluna not in df.columns:
+            continue
+        bitmaps[coluna] = {}
+        for valor, posicoes in df.groupby(coluna, observed=True, sort=False).indices.items():
+            mascara = np.zeros(len(df), dtype=bool)
+            mascara[posicoes] = True
+            bitmaps[coluna][valor] = np.packbits(mascara)
+    return {'linhas': len(df), 'colunas': bitmaps}
+
+def combinar_bitmaps(indice, filtros):
+    """Bitmap compactado das linhas que atendem {coluna: valores}; coluna sem valores não filtra, None = todas"""
+    selecao = None
+    for coluna, valores in filtros.items():
+        if not valores:
+            continue
+        por_valor = indice['colunas'].get(coluna, {})
+        bits = np.zeros((indice['linhas'] + 7) // 8, dtype=np.uint8)
+        for valor in valores:
+            if valor in por_valor:
+                np.bitwise_or(bits, por_valor[valor], out=bits)
+        selecao = bits if selecao is None else np.bitwise_and(selecao, bits, out=selecao)
+    return selecao
+
+def posicoes_bitmap(bits, linhas):
+    """Posições das linhas marcadas em um bitmap compactado de ``linhas`` bits"""
+    return np.flatnonzero(np.unpackbits(bits, count=linhas))
+
+def selecionar_por_bitmaps(indice, filtros):
+    """Posições das linhas que atendem {coluna: valores}; coluna sem valores não filtra, None = todas"""
+    selecao = combinar_bitmaps(indice, filtros)
+    if selecao is None:
+        return None
+    return posicoes_bitmap(selecao, indice['linhas'])
+
+def filtrar_por_bitmaps(df, indice, filtros):
+    """Linhas do frame que atendem os filtros; sem filtro ativo, o próprio frame (sem cópia)"""
+    posicoes = selecionar_por_bitmaps(indice, filtros)
+    if posicoes is None:
+        return df
+    return df.take(posicoes)
+
+# ===== ARMAZÉM DE ARQUIVOS ENVIADOS =====
+# Cada arquivo distinto é gravado uma única vez, comprimido, com o digest como nome;
+# as sessões guardam apenas digests e leem o conteúdo do disco quando precisam.
+def caminho_blob(diretorio, digest):
+    """Caminho do arquivo comprimido identificado pelo digest do conteúdo original"""
+    return Path(diretorio) / f"{digest}.gz"
+
+def salvar_blob(diretorio, dados):
+    """Grava o conteúdo no armazém (se ainda não existir) e retorna seu digest"""
+    digest = calcular_hash_conteudo(dados)
+    destino = caminho_blob(diretorio, digest)
+    if not destino.exists():
+        def escrever(temporario):
+            with gzip.open(temporario, 'wb', compresslevel=NIVEL_COMPRESSAO_BLOB) as arquivo:
+                arquivo.write(dados)
+        gravar_arquivo_atomico(destino, escrever)
+    return digest
+
+def blob_existe(diretorio, digest):
+    """Indica se o conteúdo do digest está no armazém"""
+    return caminho_blob(diretorio, digest).exists()
+
+def ler_blob(diretorio, digest):
+    """Lê e descomprime o conteúdo do digest; retorna None se não existir"""
+    try:
+        with gzip.open(caminho_blob(diretorio, digest), 'rb') as arquivo:
+            return arquivo.read()
+    except OSError:
+        return None
+
+def limpar_blobs(diretorio):
+    """Remove todos os arquivos do armazém"""
+    for arquivo in Path(diretorio).glob("*.gz"):
+        try:
+            arquivo.unlink()
+        except OSError:
+            pass
@@ -11,39 +11,108 @@ import unicodedata
 import io
 import tempfile
 import os
-import pickle
 import requests
 import json
+from dados_cfem import (
+    UF_VALIDAS,
+    MOTIVOS_QUARENTENA,
+    AMOSTRA_QUALIDADE_RAPIDA,
+    LIMIAR_PARETO,
+    LINHAS_QUARENTENA_EXIBIDAS,
+    combinar_digests,
+    ler_csv_detectando_encoding,
+    ingerir_csvs_cfem_em_paralelo,
+    anexar_csv_cfem_incremental,
+    dataset_colunar_existe,
+    ler_dataset_colunar,
+    ler_manifesto,
+    ler_quarentena,
+    limpar_datasets_colunares,
+    caminho_blob,
+    salvar_blob,
+    blob_existe,
+    ler_blob,
+    limpar_blobs,
+    carregar_cubo_cfem,
+    indexar_cubo,
+    fatiar_cubo,
+    fatiar_cubo_por_municipio,
+    classificar_municipios,
+    classificar_totais,
+    calcular_metricas_municipios,
+    calcular_tendencias,
+    carregar_sazonalidade_entidades,
+    carregar_meses_atipicos,
+    calcular_perfil_sazonal,
+    calcular_indices_sazonais,
+    detectar_meses_atipicos,
+    consultar_ranking,
+    construir_acumulados,
+    periodos_cubo,
+    rotulo_periodo,
+    rotular_intervalos_periodo,
+    totais_periodo,
+    total_periodo,
+    construir_bitmaps,
+    combinar_bitmaps,
+    posicoes_bitmap,
+    filtrar_por_bitmaps,
+    formatar_moeda_br_vetorizado,
+    media_por_registro,
+    resumir_municipios,
+    carregar_perfil_qualidade,
+    calcular_concentracao,
+    participacao_top,
+)
 
 # Criar diretório para arquivos persistentes
 PERSIST_DIR = Path(tempfile.gettempdir()) / "cfem_dashboard_data"
 PERSIST_DIR.mkdir(exist_ok=True)
+DATASETS_DIR = PERSIST_DIR / "datasets"
+ARQUIVOS_DIR = PERSIST_DIR / "arquivos"
 
 # Funções para persistência de arquivos
+# O conteúdo enviado fica no armazém por digest; aqui só se grava o índice (nome, tamanho, digests)
 def salvar_arquivo_persistente(nome, dados):
-    """Salva dados em arquivo para persistência entre sessões"""
-    arquivo_path = PERSIST_DIR / f"{nome}.pkl"
-    with open(arquivo_path, 'wb') as f:
-        pickle.dump(dados, f)
+    """Salva o índice do arquivo em JSON para persistência entre sessões"""
+    arquivo_path = PERSIST_DIR / f"{nome}.json"
+    arquivo_path.write_text(json.dumps(dados, ensure_ascii=False), encoding="utf-8")
 
 def carregar_arquivo_persistente(nome):
-    """Carrega dados persistidos"""
-    arquivo_path = PERSIST_DIR / f"{nome}.pkl"
+    """Carrega o índice persistido"""
+    arquivo_path = PERSIST_DIR / f"{nome}.json"
     if arquivo_path.exists():
         try:
-            with open(arquivo_path, 'rb') as f:
-                return pickle.load(f)
+            return json.loads(arquivo_path.read_text(encoding="utf-8"))
         except:
             return None
     return None
 
 def limpar_arquivos_persistentes():
     """Remove todos os arquivos persistidos"""
-    for arquivo in PERSIST_DIR.glob("*.pkl"):
+    for arquivo in [*PERSIST_DIR.glob("*.json"), *PERSIST_DIR.glob("*.pkl")]:
         try:
             arquivo.unlink()
         except:
             pass
+    limpar_blobs(ARQUIVOS_DIR)
+    limpar_datasets_colunares(DATASETS_DIR)
+
+def registrar_upload(arquivo_enviado):
+    """Grava o upload no armazém uma única vez por arquivo recebido e retorna seu digest"""
+    recebidos = st.session_state.setdefault('arquivos_recebidos', {})
+    if arquivo_enviado.file_id not in recebidos:
+        recebidos[arquivo_enviado.file_id] = salvar_blob(ARQUIVOS_DIR, arquivo_enviado.getvalue())
+    return recebidos[arquivo_enviado.file_id]
+
+def persistir_csv_cfem():
+    """Grava o índice do CSV CFEM (arquivos base e meses anexados) a partir do session_state"""
+    salvar_arquivo_persistente("csv_data", {
+        'digests': st.session_state.csv_digests,
+        'name': st.session_state.csv_name,
+        'size': st.session_state.csv_size,
+        'incrementos': st.session_state.get('csv_incrementos', [])
+    })
 
 # Inicializar session state para filtros persistentes
 if 'filtros_inicializados' not in st.session_state:
@@ -52,20 +121,23 @@ if 'filtros_inicializados' not in st.session_state:
     
     # Carregar arquivos persistidos se existirem
     csv_persistido = carregar_arquivo_persistente("csv_data")
-    if csv_persistido:
-        st.session_state.csv_data = csv_persistido['data']
+    if csv_persistido and all(blob_existe(ARQUIVOS_DIR, digest) for digest in csv_persistido['digests']):
+        st.session_state.csv_digests = csv_persistido['digests']
         st.session_state.csv_name = csv_persistido['name']
         st.session_state.csv_size = csv_persistido['size']
+        st.session_state.csv_incrementos = [
+            item for item in csv_persistido.get('incrementos', []) if blob_existe(ARQUIVOS_DIR, item['digest'])
+        ]
     
     processos_persistido = carregar_arquivo_persistente("processos_data")
-    if processos_persistido:
-        st.session_state.processos_data = processos_persistido['data']
+    if processos_persistido and blob_existe(ARQUIVOS_DIR, processos_persistido['digest']):
+        st.session_state.processos_digest = processos_persistido['digest']
         st.session_state.processos_name = processos_persistido['name']
         st.session_state.processos_size = processos_persistido['size']
     
     pptx_persistido = carregar_arquivo_persistente("pptx_data")
-    if pptx_persistido:
-        st.session_state.pptx_data = pptx_persistido['data']
+    if pptx_persistido and blob_existe(ARQUIVOS_DIR, pptx_persistido['digest']):
+        st.session_state.pptx_digest = pptx_persistido['digest']
         st.session_state.pptx_name = pptx_persistido['name']
         st.session_state.pptx_size = pptx_persistido['size']
 
@@ -570,6 +642,16 @@ def formatar_moeda_br(valor):
     """Formata valor no padrão brasileiro: R$ 1.234.567,89"""
     return f"R$ {valor:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
 
+def estilizar_moeda_br(df, colunas):
+    """Tabela com as colunas monetárias numéricas (ordenáveis pelo valor), exibidas como R$ 1.234,56
+
+    O texto de cada valor distinto sai de uma chamada ao formatador vetorizado; o Styler
+    só consulta o dicionário.
+    """
+    valores = pd.unique(df[colunas].to_numpy(dtype='float64').ravel())
+    textos = dict(zip(valores, formatar_moeda_br_vetorizado(valores)))
+    return df.style.format(textos.get, subset=colunas, na_rep="—")
+
 MESES_PT = [
     "Janeiro",
     "Fevereiro",
@@ -585,88 +667,6 @@ MESES_PT = [
     "Dezembro",
 ]
 
-MESES_MAP = {
-    "jan": 1,
-    "janeiro": 1,
-    "fev": 2,
-    "fevereiro": 2,
-    "mar": 3,
-    "marco": 3,
-    "março": 3,
-    "abr": 4,
-    "abril": 4,
-    "mai": 5,
-    "maio": 5,
-    "jun": 6,
-    "junho": 6,
-    "jul": 7,
-    "julho": 7,
-    "ago": 8,
-    "agosto": 8,
-    "set": 9,
-    "setembro": 9,
-    "out": 10,
-    "outubro": 10,
-    "nov": 11,
-    "novembro": 11,
-    "dez": 12,
-    "dezembro": 12,
-}
-
-UF_VALIDAS = {
-    "AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA",
-    "MT", "MS", "MG", "PA", "PB", "PR", "PE", "PI", "RJ", "RN",
-    "RS", "RO", "RR", "SC", "SP", "SE", "TO",
-}
-
-def normalizar_uf(valor):
-    """Normaliza UF para sigla valida (AC..TO) ou NaN."""
-    if pd.isna(valor):
-        return np.nan
-
-    texto = str(valor).strip().upper()
-    if not texto:
-        return np.nan
-
-    texto = unicodedata.normalize("NFKD", texto)
-    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
-    texto = "".join(ch for ch in texto if ch.isalpha())
-
-    if texto in UF_VALIDAS:
-        return texto
-
-    return np.nan
-
-def normalizar_mes(valor):
-    """Normaliza o valor do mes para inteiro 1-12 ou NaN."""
-    if pd.isna(valor):
-        return np.nan
-
-    if isinstance(valor, (int, np.integer)):
-        return valor if 1 <= valor <= 12 else np.nan
-
-    if isinstance(valor, (float, np.floating)):
-        if np.isnan(valor):
-            return np.nan
-        mes_int = int(valor)
-        return mes_int if 1 <= mes_int <= 12 else np.nan
-
-    texto = str(valor).strip().lower()
-    if not texto:
-        return np.nan
-
-    texto = unicodedata.normalize("NFKD", texto)
-    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
-    texto = texto.replace(".", " ").replace("-", " ").replace("/", " ")
-    texto = " ".join(texto.split())
-
-    if texto.isdigit():
-        mes_int = int(texto)
-        return mes_int if 1 <= mes_int <= 12 else np.nan
-
-    token = texto.split(" ")[0]
-    return MESES_MAP.get(token, np.nan)
-
 def calcular_taxa_crescimento(valor_atual, valor_anterior):
     """Calcula taxa de crescimento percentual"""
     if valor_anterior == 0 or pd.isna(valor_anterior):
@@ -683,138 +683,141 @@ def detectar_anomalias_iqr(serie, multiplicador=1.5):
     return (serie < limite_inferior) | (serie > limite_superior)
 
 @st.cache_data
-def gerar_insights_automaticos(df_filtrado):
-    """Gera insights automáticos sobre os dados"""
+def gerar_insights_automaticos(digest, anos=(), estados=(), substancias=()):
+    """Gera os insights do Painel Global, como pares (título, descrição), a partir do cubo filtrado (tupla vazia = sem filtro)
+
+    Cada agregado (por ano, UF, período e UF × ano) é calculado uma única vez e
+    compartilhado entre os insights; rankings e concentração vêm das curvas já
+    memorizadas do painel, sem laço em Python.
+    """
+    cubo = filtrar_painel_global(digest, anos, estados, substancias)
+    concentracao = calcular_concentracao_painel_global(digest, anos, estados, substancias)
+    valores = cubo['ValorRecolhido']
     insights = []
     
+    # Agregados compartilhados
+    total = cubo['ValorRecolhido_centavos'].sum() / 100  # soma exata em centavos
+    arrecadacao_por_ano = valores.groupby(cubo['Ano']).sum().sort_index()
+    arrecadacao_por_uf = valores.groupby(cubo['UF'], observed=True).sum()
+    arrecadacao_mensal = valores.groupby(cubo['Periodo']).sum()
+    arrecadacao_uf_ano = valores.groupby([cubo['UF'], cubo['Ano']], observed=True).sum().unstack('Ano')
+    ranking_municipios = concentracao['Município']['curva']
+    ranking_substancias = concentracao['Substância']['curva']
+    
     # Insight 1: Ano com maior arrecadação
-    arrecadacao_por_ano = df_filtrado.groupby('Ano')['ValorRecolhido'].sum()
     ano_max = arrecadacao_por_ano.idxmax()
-    valor_max = arrecadacao_por_ano.max()
-    insights.append(f"Recorde: {ano_max} foi o ano com maior arrecadacao ({formatar_moeda_br(valor_max)})")
-    
-    # Insight 2: Taxa de crescimento ano mais recente
+    insights.append(("📊 Ano de maior arrecadação", f"{int(ano_max)} com {formatar_moeda_br(arrecadacao_por_ano.max())}"))
+    
+    # Insight 2: Estado líder
+    uf_lider = arrecadacao_por_uf.idxmax()
+    insights.append((
+        "🗺️ Estado líder",
+        f"{uf_lider} concentra {arrecadacao_por_uf[uf_lider] / total * 100:.1f}% do total "
+        f"({formatar_moeda_br(arrecadacao_por_uf[uf_lider])})"
+    ))
+    
+    # Insight 3: Município líder, identificado por (UF, Município)
+    municipio_lider = ranking_municipios.iloc[0]
+    insights.append((
+        "🏙️ Município destaque",
+        f"{municipio_lider['Município']} ({municipio_lider['UF']}) "
+        f"com {formatar_moeda_br(municipio_lider['Valor'])} arrecadados"
+    ))
+    
+    # Insight 4: Substância dominante
+    substancia_lider = ranking_substancias.iloc[0]
+    insights.append((
+        "⛏️ Substância principal",
+        f"{substancia_lider['Substância']} representa "
+        f"{substancia_lider['Participacao']:.1f}% da arrecadação total"
+    ))
+    
+    # Insight 5: Taxa de crescimento entre o ano mais recente e o anterior
     if len(arrecadacao_por_ano) >= 2:
-        anos_ordenados = sorted(arrecadacao_por_ano.index)
-        ano_recente = anos_ordenados[-1]
-        ano_anterior = anos_ordenados[-2]
+        ano_anterior, ano_recente = arrecadacao_por_ano.index[-2:]
         taxa = calcular_taxa_crescimento(arrecadacao_por_ano[ano_recente], arrecadacao_por_ano[ano_anterior])
-        sinal = "+" if taxa > 0 else ""
-        insights.append(f"Tendencia: crescimento de {sinal}{taxa:.1f}% entre {ano_anterior} e {ano_recente}")
-    
-    # Insight 3: Substância dominante
-    top_substancia = df_filtrado.groupby('Substância')['ValorRecolhido'].sum().idxmax()
-    valor_top_subst = df_filtrado.groupby('Substância')['ValorRecolhido'].sum().max()
-    participacao_subst = (valor_top_subst / df_filtrado['ValorRecolhido'].sum()) * 100
-    insights.append(f"Substancia lider: {top_substancia} representa {participacao_subst:.1f}% da arrecadacao")
-    
-    # Insight 4: Estado com maior crescimento recente
-    if len(df_filtrado['Ano'].unique()) >= 2:
-        anos = sorted(df_filtrado['Ano'].unique())
-        ano_atual = anos[-1]
-        ano_ant = anos[-2]
-        
-        df_ano_atual = df_filtrado[df_filtrado['Ano'] == ano_atual].groupby('UF')['ValorRecolhido'].sum()
-        df_ano_ant = df_filtrado[df_filtrado['Ano'] == ano_ant].groupby('UF')['ValorRecolhido'].sum()
+        tendencia = "Crescimento" if taxa > 0 else "Queda"
+        insights.append(("📈 Tendência", f"{tendencia} de {abs(taxa):.1f}% entre {int(ano_anterior)} e {int(ano_recente)}"))
         
-        crescimentos = {}
-        for uf in df_ano_atual.index:
-            if uf in df_ano_ant.index and df_ano_ant[uf] > 0:
-                crescimentos[uf] = calcular_taxa_crescimento(df_ano_atual[uf], df_ano_ant[uf])
-        
-        if crescimentos:
-            uf_maior_cresc = max(crescimentos, key=crescimentos.get)
-            taxa_cresc = crescimentos[uf_maior_cresc]
-            if taxa_cresc > 5:
-                insights.append(f"Destaque regional: {uf_maior_cresc} cresceu {taxa_cresc:.1f}% no ultimo ano")
-    
-    # Insight 5: Concentração (Top 3 municípios)
-    top3_municipios = df_filtrado.groupby('Município')['ValorRecolhido'].sum().nlargest(3)
-    concentracao_top3 = (top3_municipios.sum() / df_filtrado['ValorRecolhido'].sum()) * 100
-    insights.append(f"Concentracao: top 3 municipios representam {concentracao_top3:.1f}% da arrecadacao")
-    
-    # Insight 6: Anomalias detectadas
-    arrecadacao_mensal = df_filtrado.groupby(['Ano', 'Mês'])['ValorRecolhido'].sum()
+        # Insight 6: Estado com maior crescimento recente
+        valor_atual = arrecadacao_uf_ano[ano_recente]
+        valor_ant = arrecadacao_uf_ano[ano_anterior]
+        comparaveis = valor_atual.notna() & (valor_ant > 0)
+        crescimentos = ((valor_atual - valor_ant) / valor_ant * 100)[comparaveis]
+        if len(crescimentos) > 0 and crescimentos.max() > 5:
+            insights.append(("🚀 Destaque regional", f"{crescimentos.idxmax()} cresceu {crescimentos.max():.1f}% no último ano"))
+    
+    # Insight 7: Concentração (Top 10 municípios), da curva completa de concentração
+    concentracao_top10 = participacao_top(concentracao['Município'], 10).iloc[0]
+    insights.append(("🎯 Concentração", f"Top 10 municípios representam {concentracao_top10:.1f}% da arrecadação total"))
+    
+    # Insight 8: Anomalias detectadas
     if len(arrecadacao_mensal) > 10:
-        anomalias = detectar_anomalias_iqr(arrecadacao_mensal)
-        num_anomalias = anomalias.sum()
+        num_anomalias = int(detectar_anomalias_iqr(arrecadacao_mensal).sum())
         if num_anomalias > 0:
-            insights.append(f"Alerta: {num_anomalias} mes(es) com arrecadacao atipica detectada")
+            insights.append(("🚨 Alerta", f"{num_anomalias} mês(es) com arrecadação atípica detectada"))
     
     return insights
 
-def gerar_insights_municipio(df_municipio, municipio_nome, df_completo):
-    """Gera insights automáticos específicos para um município"""
+def gerar_insights_municipio(metricas_municipio):
+    """Gera insights automáticos (título, descrição) de um município a partir da sua linha na tabela de métricas municipais"""
     insights_mun = []
-    
-    if len(df_municipio) == 0:
-        return insights_mun
+    uf_municipio = metricas_municipio.name[0]
     
     # Insight 1: Evolução temporal
-    arrecadacao_anos = df_municipio.groupby('Ano')['ValorRecolhido'].sum().sort_index()
-    if len(arrecadacao_anos) >= 2:
-        anos = list(arrecadacao_anos.index)
-        valor_inicial = arrecadacao_anos.iloc[0]
-        valor_final = arrecadacao_anos.iloc[-1]
-        taxa_total = calcular_taxa_crescimento(valor_final, valor_inicial)
+    if metricas_municipio['anos'] >= 2:
+        taxa_total = metricas_municipio['crescimento_total']
         sinal = "+" if taxa_total > 0 else ""
-        insights_mun.append(f"Evolucao: {sinal}{taxa_total:.1f}% entre {anos[0]} e {anos[-1]}")
+        insights_mun.append(("Evolucao", f"{sinal}{taxa_total:.1f}% entre {metricas_municipio['ano_inicial']} e {metricas_municipio['ano_final']}"))
     
     # Insight 2: Substância dominante
-    substancia_principal = df_municipio.groupby('Substância')['ValorRecolhido'].sum().idxmax()
-    valor_subst_principal = df_municipio.groupby('Substância')['ValorRecolhido'].sum().max()
-    participacao_subst = (valor_subst_principal / df_municipio['ValorRecolhido'].sum()) * 100
-    insights_mun.append(f"Substancia principal: {substancia_principal} ({participacao_subst:.1f}% da arrecadacao)")
+    insights_mun.append((
+        "Substancia principal",
+        f"{metricas_municipio['substancia_principal']} "
+        f"({metricas_municipio['participacao_substancia']:.1f}% da arrecadacao)"
+    ))
     
     # Insight 3: Comparação com média estadual
-    uf_municipio = df_municipio['UF'].iloc[0]
-    df_estado = df_completo[df_completo['UF'] == uf_municipio]
-    media_municipal = df_municipio['ValorRecolhido'].mean()
-    media_estadual = df_estado['ValorRecolhido'].mean()
-    diferenca_media = ((media_municipal - media_estadual) / media_estadual) * 100
+    diferenca_media = metricas_municipio['diferenca_media_estadual']
     if abs(diferenca_media) > 5:
         texto_comp = "acima" if diferenca_media > 0 else "abaixo"
-        insights_mun.append(f"Comparativo estadual: media {abs(diferenca_media):.1f}% {texto_comp} da media de {uf_municipio}")
+        insights_mun.append(("Comparativo estadual", f"media {abs(diferenca_media):.1f}% {texto_comp} da media de {uf_municipio}"))
     
     # Insight 4: Ranking e posicionamento
-    ranking_estado = df_estado.groupby('Município')['ValorRecolhido'].sum().sort_values(ascending=False)
-    posicao = list(ranking_estado.index).index(municipio_nome) + 1
-    total_municipios = len(ranking_estado)
-    percentil = (1 - (posicao / total_municipios)) * 100
+    posicao = int(metricas_municipio['posicao_estado'])
+    total_municipios = int(metricas_municipio['municipios_estado'])
+    percentil = metricas_municipio['percentil_estado']
     
     if posicao <= 3:
-        insights_mun.append(f"Ranking: {posicao}º lugar no estado ({percentil:.0f}% superior)")
+        insights_mun.append(("Ranking", f"{posicao}º lugar no estado ({percentil:.0f}% superior)"))
     elif posicao <= total_municipios * 0.1:
-        insights_mun.append(f"Ranking: top 10% no estado ({posicao}º de {total_municipios})")
+        insights_mun.append(("Ranking", f"top 10% no estado ({posicao}º de {total_municipios})"))
     elif posicao <= total_municipios * 0.25:
-        insights_mun.append(f"Ranking: top 25% no estado ({posicao}º de {total_municipios})")
+        insights_mun.append(("Ranking", f"top 25% no estado ({posicao}º de {total_municipios})"))
     
     # Insight 5: Diversificação de substâncias
-    num_substancias = df_municipio['Substância'].nunique()
+    num_substancias = int(metricas_municipio['num_substancias'])
     if num_substancias == 1:
-        insights_mun.append("Perfil: exploracao concentrada em uma unica substancia")
+        insights_mun.append(("Perfil", "exploracao concentrada em uma unica substancia"))
     elif num_substancias >= 5:
-        insights_mun.append(f"Perfil: exploracao diversificada em {num_substancias} substancias")
+        insights_mun.append(("Perfil", f"exploracao diversificada em {num_substancias} substancias"))
     
     # Insight 6: Sazonalidade/Volatilidade
-    arrecadacao_mensal = df_municipio.groupby(['Ano', 'Mês'])['ValorRecolhido'].sum()
-    if len(arrecadacao_mensal) >= 12:
-        coef_variacao = (arrecadacao_mensal.std() / arrecadacao_mensal.mean()) * 100
+    if metricas_municipio['meses'] >= 12:
+        coef_variacao = metricas_municipio['cv_mensal']
         if coef_variacao > 50:
-            insights_mun.append(f"Volatilidade: variacao mensal alta (CV {coef_variacao:.0f}%)")
+            insights_mun.append(("Volatilidade", f"variacao mensal alta (CV {coef_variacao:.0f}%)"))
         elif coef_variacao < 20:
-            insights_mun.append("Estabilidade: arrecadacao consistente ao longo do tempo")
+            insights_mun.append(("Estabilidade", "arrecadacao consistente ao longo do tempo"))
     
     # Insight 7: Tendência recente
-    if len(arrecadacao_anos) >= 2:
-        ano_recente = arrecadacao_anos.index[-1]
-        ano_anterior = arrecadacao_anos.index[-2]
-        taxa_recente = calcular_taxa_crescimento(arrecadacao_anos.iloc[-1], arrecadacao_anos.iloc[-2])
+    if metricas_municipio['anos'] >= 2:
+        taxa_recente = metricas_municipio['crescimento_recente']
         
         if taxa_recente > 20:
-            insights_mun.append(f"Tendencia recente: crescimento de {taxa_recente:.1f}% no ultimo ano")
+            insights_mun.append(("Tendencia recente", f"crescimento de {taxa_recente:.1f}% no ultimo ano"))
         elif taxa_recente < -20:
-            insights_mun.append(f"Tendencia recente: queda de {abs(taxa_recente):.1f}% no ultimo ano")
+            insights_mun.append(("Tendencia recente", f"queda de {abs(taxa_recente):.1f}% no ultimo ano"))
     
     return insights_mun
 
@@ -824,10 +827,7 @@ def render_insights(insights, max_items=6, columns=3):
         return
 
     items_html = []
-    for insight in insights[:max_items]:
-        parts = insight.split(":", 1)
-        title = parts[0].strip()
-        body = parts[1].strip() if len(parts) > 1 else ""
+    for title, body in insights[:max_items]:
         item = (
             "<li class=\"insight-item\">"
             "<span class=\"insight-dot\"></span>"
@@ -852,177 +852,10 @@ def render_insights(insights, max_items=6, columns=3):
     )
 
 @st.cache_data
-def analisar_qualidade_dados(df):
-    """Analisa a qualidade dos dados e retorna métricas"""
-    qualidade = {}
-    
-    # 1. Dados faltantes
-    total_registros = len(df)
-    dados_faltantes = {}
-    for col in df.columns:
-        missing = df[col].isna().sum()
-        pct_missing = (missing / total_registros) * 100
-        dados_faltantes[col] = {'quantidade': missing, 'percentual': pct_missing}
-    qualidade['dados_faltantes'] = dados_faltantes
-    
-    # 2. Registros duplicados
-    duplicados = df.duplicated().sum()
-    pct_duplicados = (duplicados / total_registros) * 100
-    qualidade['duplicados'] = {'quantidade': duplicados, 'percentual': pct_duplicados}
-    
-    # 3. Gaps temporais (meses sem dados)
-    df_temp = df.copy()
-    df_temp['AnoMes'] = df_temp['Ano'].astype(str) + '-' + df_temp['Mês'].astype(str).str.zfill(2)
-    periodos_unicos = df_temp['AnoMes'].unique()
-    
-    if len(periodos_unicos) > 0:
-        primeiro_periodo = min(periodos_unicos)
-        ultimo_periodo = max(periodos_unicos)
-        ano_inicio, mes_inicio = map(int, primeiro_periodo.split('-'))
-        ano_fim, mes_fim = map(int, ultimo_periodo.split('-'))
-        
-        total_meses_esperados = (ano_fim - ano_inicio) * 12 + (mes_fim - mes_inicio) + 1
-        meses_com_dados = len(periodos_unicos)
-        gaps = total_meses_esperados - meses_com_dados
-        qualidade['gaps_temporais'] = {'gaps': gaps, 'completude': (meses_com_dados / total_meses_esperados) * 100}
-    else:
-        qualidade['gaps_temporais'] = {'gaps': 0, 'completude': 0}
-    
-    # 4. Valores suspeitos
-    valores_negativos = (df['ValorRecolhido'] < 0).sum()
-    valores_zero = (df['ValorRecolhido'] == 0).sum()
-    
-    # Outliers extremos (3 desvios padrão)
-    media = df['ValorRecolhido'].mean()
-    std = df['ValorRecolhido'].std()
-    outliers_extremos = ((df['ValorRecolhido'] > media + 3*std) | (df['ValorRecolhido'] < media - 3*std)).sum()
-    
-    qualidade['valores_suspeitos'] = {
-        'negativos': valores_negativos,
-        'zeros': valores_zero,
-        'outliers_extremos': outliers_extremos
-    }
-    
-    # 5. Score geral de qualidade (0-100)
-    score = 100
-    
-    # Penalizar por dados faltantes (máx -30 pontos)
-    pct_total_missing = sum([v['percentual'] for v in dados_faltantes.values()]) / len(dados_faltantes)
-    score -= min(30, pct_total_missing * 0.5)
-    
-    # Penalizar por duplicados (máx -20 pontos)
-    score -= min(20, pct_duplicados * 2)
-    
-    # Penalizar por gaps temporais (máx -20 pontos)
-    completude = qualidade['gaps_temporais']['completude']
-    score -= min(20, (100 - completude) * 0.2)
-    
-    # Penalizar por valores suspeitos (máx -30 pontos)
-    pct_suspeitos = ((valores_negativos + outliers_extremos) / total_registros) * 100
-    score -= min(30, pct_suspeitos * 3)
-    
-    qualidade['score'] = max(0, score)
-    
-    return qualidade
-
-@st.cache_data
-def preparar_matriz_correlacao(df):
-    """Prepara matriz de correlação para heatmap"""
-    # Criar tabela dinâmica: Substâncias x Ano
-    pivot_substancia_ano = df.pivot_table(
-        values='ValorRecolhido',
-        index='Substância',
-        columns='Ano',
-        aggfunc='sum',
-        fill_value=0
-    )
-    
-    # Pegar top 10 substâncias para visualização limpa
-    top_substancias = df.groupby('Substância')['ValorRecolhido'].sum().nlargest(10).index
-    pivot_filtrado = pivot_substancia_ano.loc[top_substancias]
-    
-    # Calcular correlação entre substâncias
-    correlacao = pivot_filtrado.T.corr()
-    
-    return correlacao, pivot_filtrado
-
-@st.cache_data
-def analise_pareto(df, coluna_grupo, coluna_valor, top_n=20):
-    """Gera análise de Pareto (80/20) para identificar concentração"""
-    # Agregar valores por grupo
-    dados_agrupados = df.groupby(coluna_grupo)[coluna_valor].sum().sort_values(ascending=False)
-    
-    # Calcular percentual e acumulado
-    total = dados_agrupados.sum()
-    dados_pareto = pd.DataFrame({
-        'Grupo': dados_agrupados.head(top_n).index,
-        'Valor': dados_agrupados.head(top_n).values,
-        'Percentual': (dados_agrupados.head(top_n).values / total * 100),
-    })
-    
-    dados_pareto['Percentual_Acumulado'] = dados_pareto['Percentual'].cumsum()
-    
-    # Identificar ponto 80%
-    idx_80 = (dados_pareto['Percentual_Acumulado'] >= 80).idxmax() if (dados_pareto['Percentual_Acumulado'] >= 80).any() else len(dados_pareto)
-    
-    return dados_pareto, idx_80
-
-@st.cache_data
-def calcular_tendencia_linear(serie_temporal):
-    """Calcula tendência linear para previsão simples usando numpy"""
-    if len(serie_temporal) < 3:
-        return None, None, None
-    
-    try:
-        x = np.arange(len(serie_temporal))
-        y = serie_temporal.values
-        
-        # Regressão linear manual usando numpy
-        # y = mx + b
-        x_mean = np.mean(x)
-        y_mean = np.mean(y)
-        
-        # Calcular slope (m)
-        numerator = np.sum((x - x_mean) * (y - y_mean))
-        denominator = np.sum((x - x_mean) ** 2)
-        slope = numerator / denominator if denominator != 0 else 0
-        
-        # Calcular intercept (b)
-        intercept = y_mean - slope * x_mean
-        
-        # Linha de tendência
-        tendencia = slope * x + intercept
-        
-        # Projeção futura (3 períodos)
-        x_futuro = np.arange(len(serie_temporal), len(serie_temporal) + 3)
-        projecao = slope * x_futuro + intercept
-        
-        # Calcular R² (coeficiente de determinação)
-        y_pred = tendencia
-        ss_res = np.sum((y - y_pred) ** 2)
-        ss_tot = np.sum((y - y_mean) ** 2)
-        r2 = 1 - (ss_res / ss_tot) if ss_tot != 0 else 0
-        
-        return tendencia, projecao, r2
-    except Exception as e:
-        return None, None, None
-
-@st.cache_data
-def analisar_sazonalidade(df):
-    """Analisa padrões sazonais mensais"""
-    # Média de arrecadação por mês (ignorando ano)
-    sazonalidade = df.groupby('Mês')['ValorRecolhido'].agg(['mean', 'std', 'count']).sort_index()
-    sazonalidade['cv'] = (sazonalidade['std'] / sazonalidade['mean']) * 100  # Coeficiente de variação
-    
-    # Identificar mês mais forte e mais fraco
-    mes_forte = sazonalidade['mean'].idxmax()
-    mes_fraco = sazonalidade['mean'].idxmin()
-    
-    # Calcular índice sazonal (média do mês / média geral)
-    media_geral = df['ValorRecolhido'].mean()
-    sazonalidade['indice_sazonal'] = (sazonalidade['mean'] / media_geral) * 100
-    
-    return sazonalidade, mes_forte, mes_fraco
+def analisar_qualidade_dados(digest, rapido=False):
+    """Analisa a qualidade dos dados do dataset e retorna métricas (modo rápido: amostra com intervalos de 95%)"""
+    amostra = AMOSTRA_QUALIDADE_RAPIDA if rapido else None
+    return carregar_perfil_qualidade(DATASETS_DIR, digest, carregar_dados(digest), amostra)
 
 # Paleta de cores profissional Sigma
 SIGMA_COLORS = {
@@ -1051,6 +884,8 @@ def configurar_grafico_sigma(fig, titulo=""):
             yanchor="top"
         ),
         colorway=SIGMA_COLORS['gradient'],
+        # Vírgula decimal e ponto de milhar em eixos e hovers (",.2f" vira 1.234,56)
+        separators=",.",
         margin=dict(l=12, r=12, t=32, b=12),
         hovermode="x unified",
         hoverlabel=dict(
@@ -1123,33 +958,243 @@ def exibir_grafico(fig, **kwargs):
         kwargs["use_container_width"] = True
     return st.plotly_chart(fig, config=PLOTLY_CONFIG, **kwargs)
 
-@st.cache_data(ttl=3600)  # Cache por 1 hora
-def carregar_dados(csv_bytes):
-    """Carrega e processa os dados do CSV enviado"""
-    for encoding in ("utf-8", "latin-1", "cp1252"):
-        try:
-            df = pd.read_csv(io.BytesIO(csv_bytes), sep=';', encoding=encoding)
-            break
-        except UnicodeDecodeError:
-            df = None
+@st.cache_resource(ttl=3600)  # Cache por 1 hora
+def carregar_dados(digest):
+    """Carrega o dataset processado do cache colunar em disco
 
-    if df is None:
-        df = pd.read_csv(io.BytesIO(csv_bytes), sep=';', encoding="utf-8", errors="replace")
-    
-    # Converter colunas numéricas
-    df['ValorRecolhido'] = df['ValorRecolhido'].astype(str).str.replace('R$', '').str.replace('.', '').str.replace(',', '.').str.strip().astype(float)
-    df['QuantidadeComercializada'] = df['QuantidadeComercializada'].astype(str).str.replace(',', '.').str.strip().astype(float)
+    cache_resource compartilha o mesmo frame entre reruns e sessões, sem a cópia
+    (pickle) que cache_data faz a cada acerto; o frame não deve ser alterado in-place.
+    """
+    return ler_dataset_colunar(DATASETS_DIR, digest)
+
+@st.cache_resource(ttl=3600)
+def carregar_cubo(digest):
+    """Cubo agregado do dataset, construído uma vez por versão do dataset"""
+    return carregar_cubo_cfem(DATASETS_DIR, digest, carregar_dados(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_indice_cubo(digest):
+    """Offsets das fatias por UF e por município do cubo do dataset"""
+    return indexar_cubo(carregar_cubo(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_ranking_municipios(digest):
+    """Tabela de ranking dos municípios (na UF e no país) do dataset, consultada pelo índice"""
+    return classificar_municipios(carregar_cubo(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_metricas_municipios(digest):
+    """Métricas dos insights de todos os municípios do dataset, calculadas em lote"""
+    return calcular_metricas_municipios(carregar_cubo(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_tendencias_municipios(digest):
+    """Tendência linear mensal de todos os municípios do dataset, ajustada em lote"""
+    return calcular_tendencias(carregar_acumulados(digest), 'Município')
+
+def montar_tabela_triagem(metricas, tendencias):
+    """Tabela com as métricas e a tendência mensal de todos os municípios, do maior total ao menor, para triagem"""
+    tendencias = tendencias.reindex(metricas.index)
+    tabela = pd.DataFrame({
+        'Total Arrecadado (R$)': metricas['total'].round(2),
+        'Posição na UF': metricas['posicao_estado'],
+        'Participação na UF (%)': metricas['participacao_estado'].round(1),
+        'Crescimento no Período (%)': metricas['crescimento_total'].round(1),
+        'Crescimento Último Ano (%)': metricas['crescimento_recente'].round(1),
+        'Substância Principal': metricas['substancia_principal'],
+        'Participação da Substância (%)': metricas['participacao_substancia'].round(1),
+        'Nº Substâncias': metricas['num_substancias'],
+        'CV Mensal (%)': metricas['cv_mensal'].round(0),
+        'Tendência Mensal (R$/mês)': tendencias['inclinacao'].round(2),
+        'R² da Tendência': tendencias['r2'].round(2),
+    })
+    return tabela.reset_index().sort_values('Total Arrecadado (R$)', ascending=False)
+
+@st.cache_resource(ttl=3600)
+def carregar_tabela_triagem(digest):
+    """Tabela de triagem do dataset, montada uma vez por dataset"""
+    return montar_tabela_triagem(carregar_metricas_municipios(digest), carregar_tendencias_municipios(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_acumulados(digest):
+    """Somas de prefixo mensais por UF, município e substância do dataset"""
+    return construir_acumulados(carregar_cubo(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_perfil_sazonal(digest):
+    """Índices sazonais e meses atípicos de todas as UFs, municípios e substâncias do dataset"""
+    acumulados_dataset = carregar_acumulados(digest)
+    return (
+        carregar_sazonalidade_entidades(DATASETS_DIR, digest, acumulados_dataset),
+        carregar_meses_atipicos(DATASETS_DIR, digest, acumulados_dataset),
+    )
 
-    # Normalizar UF para siglas validas
-    if 'UF' in df.columns:
-        df['UF_raw'] = df['UF']
-        df['UF'] = df['UF'].apply(normalizar_uf)
+@st.cache_resource(ttl=3600, max_entries=32)
+def carregar_perfil_sazonal_painel_global(digest, anos, estados, substancias):
+    """Índices sazonais e meses atípicos das entidades na seleção do Painel Global (sem filtro: os persistidos)"""
+    if not (anos or estados or substancias):
+        return carregar_perfil_sazonal(digest)
+    acumulados_selecao = construir_acumulados(filtrar_painel_global(digest, anos, estados, substancias))
+    return (
+        calcular_perfil_sazonal(acumulados_selecao, calcular_indices_sazonais),
+        calcular_perfil_sazonal(acumulados_selecao, detectar_meses_atipicos),
+    )
 
-    # Normalizar coluna de mes para nomenclatura brasileira (1-12)
-    if 'Mês' in df.columns:
-        df['Mês'] = df['Mês'].apply(normalizar_mes).astype('Int64')
-    
-    return df
+def montar_tabela_meses_atipicos(anomalias):
+    """Tabela dos meses atípicos, do desvio mais extremo ao menos extremo"""
+    anomalias = anomalias.reindex(anomalias['ZRobusto'].abs().sort_values(ascending=False).index)
+    criterio = np.select(
+        [anomalias['ForaIQR'] & anomalias['ZExtremo'], anomalias['ForaIQR']],
+        ['IQR e z robusto', 'IQR'],
+        default='z robusto'
+    )
+    return pd.DataFrame({
+        'UF': anomalias['UF'],
+        'Entidade': anomalias['Entidade'],
+        'Período': [rotulo_periodo(periodo) for periodo in anomalias['Periodo']],
+        'Arrecadação (R$)': anomalias['Valor'].round(2),
+        'Mediana Mensal (R$)': anomalias['Mediana'].round(2),
+        'Z Robusto': anomalias['ZRobusto'].round(1),
+        'Critério': criterio,
+    })
+
+@st.cache_resource(ttl=3600)
+def carregar_bitmaps(digest):
+    """Bitmaps por Ano, UF e Substância do cubo, construídos uma vez por dataset"""
+    return construir_bitmaps(carregar_cubo(digest))
+
+@st.cache_resource(ttl=3600)
+def carregar_bitmaps_dados(digest):
+    """Bitmaps por Ano, UF e Substância do frame bruto, construídos só quando um recorte bruto é pedido"""
+    return construir_bitmaps(carregar_dados(digest))
+
+@st.cache_resource(ttl=3600, max_entries=32)
+def filtrar_painel_global(digest, anos, estados, substancias):
+    """Cubo do Painel Global filtrado, memorizado pela assinatura dos filtros (tupla vazia = sem filtro)"""
+    filtros = {'Ano': anos, 'UF': estados, 'Substância': substancias}
+    return filtrar_por_bitmaps(carregar_cubo(digest), carregar_bitmaps(digest), filtros)
+
+@st.cache_resource(ttl=3600, max_entries=32)
+def selecionar_linhas_painel_global(digest, anos, estados, substancias):
+    """Bitmap compactado das linhas do frame bruto nos filtros (None = todas); memoriza a seleção, não as linhas"""
+    return combinar_bitmaps(carregar_bitmaps_dados(digest), {'Ano': anos, 'UF': estados, 'Substância': substancias})
+
+def recortar_dados_painel_global(digest, filtros, colunas=None):
+    """Linhas do frame bruto nos filtros do Painel Global, materializadas a cada uso (só as ``colunas`` pedidas)"""
+    df = carregar_dados(digest)
+    if colunas is not None:
+        df = df[colunas]
+    selecao = selecionar_linhas_painel_global(digest, *filtros)
+    if selecao is None:
+        return df
+    return df.take(posicoes_bitmap(selecao, len(df)))
+
+@st.cache_resource(ttl=3600, max_entries=32)
+def montar_tabela_detalhada(digest, anos, estados, substancias):
+    """Tabela "Dados Detalhados" do Painel Global a partir do cubo filtrado, memorizada pela assinatura dos filtros"""
+    resumo = resumir_municipios(filtrar_painel_global(digest, anos, estados, substancias)).reset_index()
+    # Valores continuam numéricos (ordenáveis); a moeda só é formatada na exibição
+    tabela = pd.DataFrame({
+        'UF': resumo['UF'],
+        'Município': resumo['Município'],
+        'Total Arrecadado': resumo['total'].round(2),
+        'Média por Registro': resumo['media_registro'].round(2),
+        'Nº Registros': resumo['registros'],
+        'Nº Substâncias': resumo['num_substancias'],
+        'Período': rotular_intervalos_periodo(resumo['periodo_inicial'], resumo['periodo_final']),
+    })
+    return tabela.sort_values('Nº Registros', ascending=False)
+
+@st.cache_resource(ttl=3600, max_entries=32)
+def calcular_concentracao_painel_global(digest, anos, estados, substancias):
+    """Curvas e índices de concentração do Painel Global, memorizados pela assinatura dos filtros
+
+    Um cálculo por dimensão (mais municípios dentro de cada UF) compartilhado pelo gráfico
+    de concentração, pela tabela de índices e pelos insights.
+    """
+    cubo_filtrado = filtrar_painel_global(digest, anos, estados, substancias)
+    concentracao = {dimensao: calcular_concentracao(cubo_filtrado, dimensao) for dimensao in ('UF', 'Município', 'Substância')}
+    if 'CPF_CNPJ' in carregar_dados(digest).columns:
+        # Titular não é dimensão do cubo: só as duas colunas necessárias saem do frame bruto
+        titulares = recortar_dados_painel_global(digest, (anos, estados, substancias), ['CPF_CNPJ', 'ValorRecolhido_centavos'])
+        concentracao['Titular'] = calcular_concentracao(titulares, 'Titular')
+    concentracao['Município por UF'] = calcular_concentracao(cubo_filtrado, 'Município', por='UF')
+    return concentracao
+
+def montar_tabela_concentracao(concentracao):
+    """Índices de concentração por dimensão: entidades, HHI, Gini, corte de Pareto e top 10"""
+    dimensoes = [dimensao for dimensao in ('UF', 'Município', 'Substância', 'Titular') if dimensao in concentracao]
+    resumos = pd.concat([concentracao[dimensao]['resumo'].iloc[:1] for dimensao in dimensoes], ignore_index=True)
+    return pd.DataFrame({
+        'Dimensão': dimensoes,
+        'Entidades': resumos['entidades'],
+        'HHI': resumos['hhi'].round(0),
+        'Gini': resumos['gini'].round(3),
+        f'Entidades até {LIMIAR_PARETO}%': resumos['corte_80'],
+        'Top 10 (%)': [participacao_top(concentracao[dimensao], 10).iloc[0] for dimensao in dimensoes],
+    }).round({'Top 10 (%)': 1})
+
+@st.cache_data(ttl=3600)
+def carregar_quarentena(digest, limite=LINHAS_QUARENTENA_EXIBIDAS):
+    """Primeiras linhas rejeitadas na validação do dataset, com os motivos (só elas vão para o cache)"""
+    return ler_quarentena(DATASETS_DIR, digest, limite)
+
+def montar_kpis_globais_html(total_arrecadado_global, media_mensal_global, num_municipios_global, num_estados_global, num_substancias_global):
+    """Monta os cards HTML dos KPIs do Painel Global"""
+    return f"""
+    <div style='display: grid; grid-template-columns: repeat(5, 1fr); gap: 1rem; margin-bottom: 2rem;'>
+        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);'>
+            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Total Arrecadado</div>
+            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{formatar_moeda_br(total_arrecadado_global)}</div>
+        </div>
+        <div style='background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(240, 147, 251, 0.3);'>
+            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Média Mensal</div>
+            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{formatar_moeda_br(media_mensal_global)}</div>
+        </div>
+        <div style='background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(79, 172, 254, 0.3);'>
+            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Municípios</div>
+            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{num_municipios_global}</div>
+        </div>
+        <div style='background: linear-gradient(135deg, #43e97b 0%, #38f9d7 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(67, 233, 123, 0.3);'>
+            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Estados</div>
+            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{num_estados_global}</div>
+        </div>
+        <div style='background: linear-gradient(135deg, #fa709a 0%, #fee140 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(250, 112, 154, 0.3);'>
+            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Substâncias</div>
+            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{num_substancias_global}</div>
+        </div>
+    </div>
+    """
+
+def ingerir_csv_com_progresso(csv_partes, digest, container):
+    """Processa o(s) CSV(s) CFEM exibindo progresso e totais parciais no container
+
+    Um arquivo é lido em lotes no próprio processo; vários arquivos (ex.: um por ano)
+    são convertidos em paralelo, um processo por arquivo.
+    """
+    painel_parcial = container.empty()
+
+    def exibir_totais_parciais(totais):
+        media_mensal = totais['mensal'].mean() if totais['mensal'] is not None and len(totais['mensal']) else 0
+        with painel_parcial.container():
+            st.progress(
+                min(totais['progresso'], 1.0),
+                text=f"Processando CSV CFEM... {totais['linhas_lidas']:,} registros lidos"
+            )
+            st.caption("Totais parciais: os indicadores serão atualizados ao final da leitura")
+            st.markdown(
+                montar_kpis_globais_html(
+                    totais['total_centavos'] / 100,
+                    media_mensal,
+                    len(totais['municipios']),
+                    len(totais['estados']),
+                    len(totais['substancias'])
+                ),
+                unsafe_allow_html=True
+            )
+
+    ingerir_csvs_cfem_em_paralelo(csv_partes, DATASETS_DIR, digest, ao_processar_arquivo=exibir_totais_parciais)
+    painel_parcial.empty()
 
 def normalizar_texto_generico(valor):
     if pd.isna(valor):
@@ -1213,25 +1258,13 @@ def ajustar_cabecalho_processos(df_raw):
     return df
 
 @st.cache_data(ttl=3600)
-def carregar_processos_csv_bytes(csv_bytes):
-    for encoding in ("utf-8", "latin-1", "cp1252"):
-        try:
-            df_raw = pd.read_csv(io.BytesIO(csv_bytes), encoding=encoding, header=None)
-            return ajustar_cabecalho_processos(df_raw)
-        except UnicodeDecodeError:
-            continue
-    df_raw = pd.read_csv(io.BytesIO(csv_bytes), encoding="utf-8", errors="replace", header=None)
+def carregar_processos_csv_blob(digest):
+    df_raw, _ = ler_csv_detectando_encoding(caminho_blob(ARQUIVOS_DIR, digest), header=None)
     return ajustar_cabecalho_processos(df_raw)
 
 @st.cache_data(ttl=3600)
 def carregar_processos_csv_path(path_str):
-    for encoding in ("utf-8", "latin-1", "cp1252"):
-        try:
-            df_raw = pd.read_csv(path_str, encoding=encoding, header=None)
-            return ajustar_cabecalho_processos(df_raw)
-        except UnicodeDecodeError:
-            continue
-    df_raw = pd.read_csv(path_str, encoding="utf-8", errors="replace", header=None)
+    df_raw, _ = ler_csv_detectando_encoding(path_str, header=None)
     return ajustar_cabecalho_processos(df_raw)
 
 # Sidebar com filtros avancados
@@ -1241,6 +1274,7 @@ with st.sidebar:
     st.divider()
     if st.button("Limpar cache", help="Recarrega todos os dados e calculos"):
         st.cache_data.clear()
+        st.cache_resource.clear()
         st.session_state.cache_limpo = True
         st.success("Cache limpo")
         st.rerun()
@@ -1270,19 +1304,22 @@ with tab_import:
     st.info("💾 **Os arquivos são salvos automaticamente e permanecerão disponíveis mesmo após recarregar a página.**")
     
     # Botão para limpar arquivos salvos
-    if 'csv_data' in st.session_state or 'processos_data' in st.session_state or 'pptx_data' in st.session_state:
+    if 'csv_digests' in st.session_state or 'processos_digest' in st.session_state or 'pptx_digest' in st.session_state:
         if st.button("🗑️ Limpar arquivos salvos", type="secondary"):
             # Limpar session state
-            if 'csv_data' in st.session_state:
-                del st.session_state.csv_data
+            st.session_state.pop('arquivos_recebidos', None)
+            if 'csv_digests' in st.session_state:
+                del st.session_state.csv_digests
                 del st.session_state.csv_name
                 del st.session_state.csv_size
-            if 'processos_data' in st.session_state:
-                del st.session_state.processos_data
+                st.session_state.pop('csv_incrementos', None)
+                st.session_state.pop('csv_incrementos_rejeitados', None)
+            if 'processos_digest' in st.session_state:
+                del st.session_state.processos_digest
                 del st.session_state.processos_name
                 del st.session_state.processos_size
-            if 'pptx_data' in st.session_state:
-                del st.session_state.pptx_data
+            if 'pptx_digest' in st.session_state:
+                del st.session_state.pptx_digest
                 del st.session_state.pptx_name
                 del st.session_state.pptx_size
             
@@ -1307,31 +1344,52 @@ with tab_import:
             """,
             unsafe_allow_html=True
         )
-        csv_upload = st.file_uploader(
-            "Selecione o arquivo CSV CFEM",
+        csv_uploads = st.file_uploader(
+            "Selecione o(s) arquivo(s) CSV CFEM",
             type=["csv"],
-            help="Arquivo CSV com separador ';' e colunas padrão CFEM",
+            accept_multiple_files=True,
+            help="Arquivo CSV com separador ';' e colunas padrão CFEM. Envie vários arquivos (ex.: um por ano) para combiná-los",
             key="csv_uploader"
         )
         
-        # Salvar arquivo no session_state e em disco quando carregado
-        if csv_upload is not None:
-            csv_data = csv_upload.getvalue()
-            st.session_state.csv_data = csv_data
-            st.session_state.csv_name = csv_upload.name
-            st.session_state.csv_size = csv_upload.size
-            
-            # Persistir em disco
-            salvar_arquivo_persistente("csv_data", {
-                'data': csv_data,
-                'name': csv_upload.name,
-                'size': csv_upload.size
-            })
+        # Gravar arquivos no armazém e referenciá-los por digest no session_state
+        if csv_uploads:
+            csv_digests = [registrar_upload(csv_upload) for csv_upload in csv_uploads]
+            if st.session_state.get('csv_digests') != csv_digests:
+                st.session_state.csv_digests = csv_digests
+                st.session_state.csv_name = ", ".join(csv_upload.name for csv_upload in csv_uploads)
+                st.session_state.csv_size = sum(csv_upload.size for csv_upload in csv_uploads)
+                # Novo conjunto base: meses anexados ao anterior deixam de valer
+                st.session_state.csv_incrementos = []
+                st.session_state.pop('csv_incrementos_rejeitados', None)
+                
+                # Persistir em disco
+                persistir_csv_cfem()
         
         # Exibir status do arquivo
-        if 'csv_data' in st.session_state:
+        if 'csv_digests' in st.session_state:
             st.success(f"✓ Arquivo carregado: {st.session_state.csv_name}")
             st.caption(f"Tamanho: {st.session_state.csv_size / (1024*1024):.2f} MB")
+            
+            # Atualização mensal: anexa só as linhas novas sem reprocessar o histórico
+            incremento_upload = st.file_uploader(
+                "Anexar mês ao CSV CFEM (opcional)",
+                type=["csv"],
+                help="CSV no mesmo layout com as linhas de um novo mês; linhas idênticas a uma já existente são ignoradas",
+                key="incremento_uploader"
+            )
+            # O mês entra só na sessão; é persistido depois de anexado com sucesso ao dataset
+            if incremento_upload is not None:
+                incremento_digest = registrar_upload(incremento_upload)
+                incrementos = st.session_state.setdefault('csv_incrementos', [])
+                rejeitados = st.session_state.setdefault('csv_incrementos_rejeitados', {})
+                if incremento_digest not in rejeitados and all(item['digest'] != incremento_digest for item in incrementos):
+                    incrementos.append({
+                        'digest': incremento_digest,
+                        'name': incremento_upload.name,
+                        'size': incremento_upload.size
+                    })
+                    st.session_state.csv_incrementos_pendentes = True
         else:
             st.info("⚠️ Aguardando arquivo CSV CFEM")
         
@@ -1339,6 +1397,7 @@ with tab_import:
         st.markdown("""
         - Separador: `;` (ponto e vírgula)
         - Encoding: UTF-8, Latin-1 ou CP1252
+        - Vários arquivos (ex.: um por ano) são combinados automaticamente
         - Colunas esperadas: Ano, Mês, UF, Município, Substância, ValorRecolhido, etc.
         - Limite: 200 MB
         """)
@@ -1361,22 +1420,23 @@ with tab_import:
             key="processos_uploader"
         )
         
-        # Salvar arquivo no session_state e em disco quando carregado
+        # Gravar arquivo no armazém e referenciá-lo por digest no session_state
         if processos_upload is not None:
-            processos_data = processos_upload.getvalue()
-            st.session_state.processos_data = processos_data
-            st.session_state.processos_name = processos_upload.name
-            st.session_state.processos_size = processos_upload.size
-            
-            # Persistir em disco
-            salvar_arquivo_persistente("processos_data", {
-                'data': processos_data,
-                'name': processos_upload.name,
-                'size': processos_upload.size
-            })
+            processos_digest = registrar_upload(processos_upload)
+            if st.session_state.get('processos_digest') != processos_digest:
+                st.session_state.processos_digest = processos_digest
+                st.session_state.processos_name = processos_upload.name
+                st.session_state.processos_size = processos_upload.size
+                
+                # Persistir em disco
+                salvar_arquivo_persistente("processos_data", {
+                    'digest': processos_digest,
+                    'name': processos_upload.name,
+                    'size': processos_upload.size
+                })
         
         # Exibir status do arquivo
-        if 'processos_data' in st.session_state:
+        if 'processos_digest' in st.session_state:
             st.success(f"✓ Arquivo carregado: {st.session_state.processos_name}")
             st.caption(f"Tamanho: {st.session_state.processos_size / (1024*1024):.2f} MB")
         
@@ -1398,22 +1458,23 @@ with tab_import:
             key="pptx_uploader"
         )
         
-        # Salvar arquivo no session_state e em disco quando carregado
+        # Gravar arquivo no armazém e referenciá-lo por digest no session_state
         if pptx_upload is not None:
-            pptx_data = pptx_upload.getvalue()
-            st.session_state.pptx_data = pptx_data
-            st.session_state.pptx_name = pptx_upload.name
-            st.session_state.pptx_size = pptx_upload.size
-            
-            # Persistir em disco
-            salvar_arquivo_persistente("pptx_data", {
-                'data': pptx_data,
-                'name': pptx_upload.name,
-                'size': pptx_upload.size
-            })
+            pptx_digest = registrar_upload(pptx_upload)
+            if st.session_state.get('pptx_digest') != pptx_digest:
+                st.session_state.pptx_digest = pptx_digest
+                st.session_state.pptx_name = pptx_upload.name
+                st.session_state.pptx_size = pptx_upload.size
+                
+                # Persistir em disco
+                salvar_arquivo_persistente("pptx_data", {
+                    'digest': pptx_digest,
+                    'name': pptx_upload.name,
+                    'size': pptx_upload.size
+                })
         
         # Exibir status do arquivo
-        if 'pptx_data' in st.session_state:
+        if 'pptx_digest' in st.session_state:
             st.success(f"✓ Arquivo carregado: {st.session_state.pptx_name}")
             st.caption(f"Tamanho: {st.session_state.pptx_size / (1024*1024):.2f} MB")
     
@@ -1424,33 +1485,62 @@ with tab_import:
     col_status1, col_status2, col_status3 = st.columns(3)
     
     with col_status1:
-        if 'csv_data' in st.session_state:
+        if 'csv_digests' in st.session_state:
             st.metric("CSV CFEM", "✓ Carregado", delta="Pronto")
         else:
             st.metric("CSV CFEM", "✗ Pendente", delta="Obrigatório")
     
     with col_status2:
-        if 'processos_data' in st.session_state:
+        if 'processos_digest' in st.session_state:
             st.metric("CSV Processos", "✓ Carregado", delta="Opcional")
         else:
             st.metric("CSV Processos", "○ Não enviado", delta="Opcional")
     
     with col_status3:
-        if 'pptx_data' in st.session_state:
+        if 'pptx_digest' in st.session_state:
             st.metric("Template PPTX", "✓ Carregado", delta="Opcional")
         else:
             st.metric("Template PPTX", "○ Não enviado", delta="Opcional")
     
-    if 'csv_data' in st.session_state:
+    if 'csv_digests' in st.session_state:
         st.success("✓ Sistema pronto para uso! Navegue para as abas de análise.")
     else:
         st.warning("⚠️ Envie o arquivo CSV CFEM para habilitar as análises.")
 
-if 'csv_data' not in st.session_state:
+if 'csv_digests' not in st.session_state:
     st.stop()
 
-# Carregar dados do session_state
-df = carregar_dados(st.session_state.csv_data)
+# Carregar dados a partir do armazém (processando na primeira vez; um CSV ou vários)
+csv_digest = combinar_digests(st.session_state.csv_digests)
+try:
+    if not dataset_colunar_existe(DATASETS_DIR, csv_digest):
+        csv_partes = [caminho_blob(ARQUIVOS_DIR, digest) for digest in st.session_state.csv_digests]
+        ingerir_csv_com_progresso(csv_partes, csv_digest, tab_global)
+except ValueError as erro:
+    # Arquivo fora do layout CFEM ou sem nenhuma linha válida: falha antes de qualquer análise
+    with tab_import:
+        st.error(f"CSV CFEM rejeitado na validação: {erro}")
+    st.stop()
+
+# Aplicar os meses anexados: cada um regrava apenas as partições mensais que toca e soma
+# suas células ao cubo do dataset anterior; os derivados do novo digest saem desse cubo.
+# Um mês rejeitado na validação sai da sessão e do índice persistido, e o dataset segue sem ele
+resumos_incrementos = []
+incrementos_aceitos = []
+for incremento in st.session_state.get('csv_incrementos', []):
+    try:
+        csv_digest, resumo_incremento = anexar_csv_cfem_incremental(
+            DATASETS_DIR, csv_digest, caminho_blob(ARQUIVOS_DIR, incremento['digest']), incremento['digest']
+        )
+    except ValueError as erro:
+        st.session_state.setdefault('csv_incrementos_rejeitados', {})[incremento['digest']] = (incremento['name'], str(erro))
+        continue
+    incrementos_aceitos.append(incremento)
+    resumos_incrementos.append((incremento['name'], resumo_incremento))
+if st.session_state.pop('csv_incrementos_pendentes', False) or len(incrementos_aceitos) != len(st.session_state.get('csv_incrementos', [])):
+    st.session_state.csv_incrementos = incrementos_aceitos
+    persistir_csv_cfem()
+df = carregar_dados(csv_digest)
 
 # Extrair anos do DataFrame e atualizar session state
 anos_disponiveis = sorted(df['Ano'].dropna().unique())
@@ -1475,11 +1565,91 @@ else:
 
 # Carregar processos se arquivo foi enviado
 df_processos = None
-if 'processos_data' in st.session_state:
-    df_processos = carregar_processos_csv_bytes(st.session_state.processos_data)
+if 'processos_digest' in st.session_state:
+    df_processos = carregar_processos_csv_blob(st.session_state.processos_digest)
 
-df_filtrado = df
-df_uf_validos = df[df['UF'].isin(UF_VALIDAS)].copy()
+# Informar o encoding detectado na leitura de cada arquivo
+with tab_import:
+    st.caption(f"Encoding detectado no CSV CFEM: {df.attrs.get('encoding', 'N/D')}")
+    if df_processos is not None:
+        st.caption(f"Encoding detectado no CSV de processos: {df_processos.attrs.get('encoding', 'N/D')}")
+    for nome_incremento, erro_incremento in st.session_state.get('csv_incrementos_rejeitados', {}).values():
+        st.warning(f"⚠️ Mês anexado ({nome_incremento}) rejeitado na validação e descartado: {erro_incremento}")
+    for nome_incremento, resumo_incremento in resumos_incrementos:
+        meses_atualizados = ", ".join(resumo_incremento['particoes_atualizadas']) or "nenhum"
+        st.caption(
+            f"Mês anexado ({nome_incremento}): {resumo_incremento['linhas_novas']:,} linhas novas, "
+            f"{resumo_incremento['linhas_duplicadas']:,} duplicadas ignoradas, "
+            f"{resumo_incremento['linhas_quarentena']:,} em quarentena; partições atualizadas: {meses_atualizados}"
+        )
+    
+    # Linhas rejeitadas na validação ficam fora do dataset e dos agregados em cache
+    quarentena = (ler_manifesto(DATASETS_DIR, csv_digest) or {}).get('quarentena') or {}
+    if quarentena.get('linhas'):
+        st.warning(f"⚠️ {quarentena['linhas']:,} linha(s) do CSV CFEM em quarentena, fora das análises")
+        descricoes_motivos = dict(MOTIVOS_QUARENTENA)
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {'Motivo': descricoes_motivos[codigo], 'Código': codigo, 'Linhas': quantidade}
+                    for codigo, quantidade in quarentena['motivos'].items() if quantidade
+                ]
+            ),
+            use_container_width=True,
+            hide_index=True
+        )
+        with st.expander(f"Ver linhas em quarentena (primeiras {LINHAS_QUARENTENA_EXIBIDAS:,})", expanded=False):
+            st.dataframe(carregar_quarentena(csv_digest), use_container_width=True, hide_index=True)
+    else:
+        st.caption("Validação: todas as linhas do CSV CFEM foram aceitas")
+    
+    # Perfil de qualidade do dataset aceito, persistido por digest e modo
+    st.markdown("### 🔎 Qualidade dos Dados")
+    analise_rapida = st.toggle(
+        f"Análise rápida (amostra de ~{AMOSTRA_QUALIDADE_RAPIDA:,} linhas, com intervalos de 95%)",
+        value=len(df) > AMOSTRA_QUALIDADE_RAPIDA,
+        key="qualidade_rapida"
+    )
+    qualidade = analisar_qualidade_dados(csv_digest, rapido=analise_rapida)
+    
+    def texto_medida(medida):
+        """Percentual da medida com o intervalo de 95% quando amostral"""
+        if 'intervalo_95' in medida:
+            inferior, superior = medida['intervalo_95']
+            return f"{medida['percentual']:.2f}% (IC 95%: {inferior:.2f}%–{superior:.2f}%)"
+        return f"{medida['percentual']:.2f}%"
+    
+    col_q1, col_q2, col_q3, col_q4 = st.columns(4)
+    col_q1.metric("Score de Qualidade", f"{qualidade['score']:.0f}/100")
+    col_q2.metric("Duplicados", f"{qualidade['duplicados']['quantidade']:,}", help=texto_medida(qualidade['duplicados']))
+    col_q3.metric("Meses sem Registro", f"{qualidade['gaps_temporais']['gaps']:,}")
+    col_q4.metric("Completude Temporal", f"{qualidade['gaps_temporais']['completude']:.1f}%")
+    st.caption(
+        f"Linhas analisadas: {qualidade['linhas_analisadas']:,} de {qualidade['linhas']:,} "
+        f"({'amostra' if qualidade['modo'] == 'rapido' else 'análise completa'})"
+    )
+    
+    medidas_qualidade = [
+        (f"Faltantes em {coluna}", medida) for coluna, medida in qualidade['dados_faltantes'].items() if medida['quantidade']
+    ] + [
+        ("Valores negativos", qualidade['valores_suspeitos']['negativos']),
+        ("Valores zerados", qualidade['valores_suspeitos']['zeros']),
+        ("Outliers extremos (3σ)", qualidade['valores_suspeitos']['outliers_extremos']),
+    ]
+    st.dataframe(
+        pd.DataFrame(
+            [{'Verificação': nome, 'Linhas': medida['quantidade'], 'Percentual': texto_medida(medida)} for nome, medida in medidas_qualidade]
+        ),
+        use_container_width=True,
+        hide_index=True
+    )
+
+# Cubo agregado (Ano × Mês × UF × Município × Substância × Tipo_PF_PJ) consultado por gráficos, rankings e KPIs
+cubo = carregar_cubo(csv_digest)
+indice_cubo = carregar_indice_cubo(csv_digest)
+ranking_municipios = carregar_ranking_municipios(csv_digest)
+acumulados = carregar_acumulados(csv_digest)
+metricas_municipios = carregar_metricas_municipios(csv_digest)
 
 # ===== ABA 1: MUNICIPIOS =====
 with tab_mun:
@@ -1497,7 +1667,7 @@ with tab_mun:
     with col2:
         if uf_selecionada != "Selecione...":
             municipios_disponiveis_analise = sorted(
-                df[df['UF'].astype(str) == uf_selecionada]['Município'].dropna().unique()
+                municipio for uf, municipio in indice_cubo['municipios'] if uf == uf_selecionada
             )
             municipio_selecionado = st.selectbox(
                 "Selecione o Município:",
@@ -1515,11 +1685,26 @@ with tab_mun:
             )
 
     with col3:
-        anos_disponiveis_analise = sorted(df['Ano'].unique())
-        anos_analise = st.multiselect(
-            "Selecione os Anos:",
-            anos_disponiveis_analise,
-            default=anos_disponiveis_analise
+        periodos_disponiveis_analise = list(range(acumulados['inicio'], acumulados['inicio'] + acumulados['periodos']))
+        if len(periodos_disponiveis_analise) > 1:
+            periodo_inicio, periodo_fim = st.select_slider(
+                "Selecione o Período:",
+                options=periodos_disponiveis_analise,
+                value=(periodos_disponiveis_analise[0], periodos_disponiveis_analise[-1]),
+                format_func=rotulo_periodo
+            )
+        else:
+            periodo_inicio = periodo_fim = acumulados['inicio']
+        periodo_completo = (
+            not periodos_disponiveis_analise
+            or (periodo_inicio, periodo_fim) == (periodos_disponiveis_analise[0], periodos_disponiveis_analise[-1])
+        )
+
+    with st.expander("Triagem de todos os municípios", expanded=False):
+        st.dataframe(
+            estilizar_moeda_br(carregar_tabela_triagem(csv_digest), ['Total Arrecadado (R$)', 'Tendência Mensal (R$/mês)']),
+            use_container_width=True,
+            hide_index=True
         )
 
     if municipio_selecionado is not None:
@@ -1533,33 +1718,35 @@ with tab_mun:
             unsafe_allow_html=True
         )
 
-    # Filtrar dados para o município selecionado
+    # Filtrar as células do cubo para o município selecionado
     if municipio_selecionado is not None:
-        df_municipio = df[
-            (df['UF'].astype(str) == uf_selecionada)
-            & (df['Município'] == municipio_selecionado)
-            & (df['Ano'].isin(anos_analise))
-        ]
+        cubo_municipio = fatiar_cubo(cubo, indice_cubo, uf_selecionada, municipio_selecionado)
+        periodos_municipio = periodos_cubo(cubo_municipio)
+        cubo_municipio = cubo_municipio[(periodos_municipio >= periodo_inicio) & (periodos_municipio <= periodo_fim)]
     else:
-        df_municipio = df.iloc[0:0]
+        cubo_municipio = cubo.iloc[0:0]
     
-    if len(df_municipio) > 0:
-        uf_mun = df_municipio['UF'].iloc[0]
+    if len(cubo_municipio) > 0:
+        uf_mun = cubo_municipio['UF'].iloc[0]
 
         # KPIs do município em cards
         st.divider()
         
-        total_mun = df_municipio['ValorRecolhido'].sum()
+        total_mun = total_periodo(acumulados, 'Município', (uf_mun, municipio_selecionado), periodo_inicio, periodo_fim) / 100
         total_mun_municipio = total_mun * 0.60
         
-        df_estado = df[
-            (df['UF'].astype(str) == str(uf_mun))
-            & (df['Ano'].isin(anos_analise))
-        ]
-        ranking_estado = df_estado.groupby('Município')['ValorRecolhido'].sum().sort_values(ascending=False)
-        posicao = list(ranking_estado.index).index(municipio_selecionado) + 1
-        total_municipios = len(ranking_estado)
-        substancias_mun = df_municipio['Substância'].nunique()
+        # Ranking do período completo vem da tabela pré-calculada; um recorte de meses
+        # reclassifica os totais do intervalo, obtidos por subtração das somas de prefixo
+        if periodo_completo:
+            ranking_periodo = ranking_municipios
+        else:
+            totais_intervalo = totais_periodo(acumulados, 'Município', periodo_inicio, periodo_fim)
+            totais_intervalo = totais_intervalo.loc[totais_intervalo['registros'] > 0, 'total_centavos']
+            ranking_periodo = classificar_totais(totais_intervalo, nacional=False)
+        ranking_mun = consultar_ranking(ranking_periodo, uf_mun, municipio_selecionado)
+        posicao = int(ranking_mun['posicao_estado'])
+        total_municipios = int(ranking_mun['municipios_estado'])
+        substancias_mun = cubo_municipio['Substância'].nunique()
         
         # Cards estilizados
         st.markdown(f"""
@@ -1680,7 +1867,17 @@ with tab_mun:
         
         # ===== ANALISE DO MUNICIPIO =====
         st.markdown("### Análise do município")
-        insights_mun = gerar_insights_municipio(df_municipio, municipio_selecionado, df)
+        # Período completo: a linha do município vem da tabela calculada em lote; um recorte
+        # de meses recalcula a tabela só para a fatia da UF no intervalo
+        if periodo_completo:
+            metricas_periodo = metricas_municipios
+        else:
+            cubo_estado = fatiar_cubo(cubo, indice_cubo, uf_mun)
+            periodos_estado = periodos_cubo(cubo_estado)
+            metricas_periodo = calcular_metricas_municipios(
+                cubo_estado[(periodos_estado >= periodo_inicio) & (periodos_estado <= periodo_fim)]
+            )
+        insights_mun = gerar_insights_municipio(metricas_periodo.loc[(uf_mun, municipio_selecionado)])
 
         insights_col, charts_col = st.columns([1, 2.1], gap="large")
         with insights_col:
@@ -1689,7 +1886,7 @@ with tab_mun:
         with charts_col:
             # Gráfico 1: Evolução temporal da arrecadação
             st.markdown("<h4 style='font-size: 1rem; font-weight: 600; color: #6b7280; margin-bottom: 0.75rem;'>Evolução da Arrecadação ao Longo do Tempo</h4>", unsafe_allow_html=True)
-            arrecadacao_tempo = df_municipio.groupby('Ano')['ValorRecolhido'].sum().sort_index()
+            arrecadacao_tempo = cubo_municipio.groupby('Ano')['ValorRecolhido'].sum().sort_index()
             df_tempo = pd.DataFrame({'Ano': arrecadacao_tempo.index.astype(str), 'Arrecadação': arrecadacao_tempo.values})
             
             fig_tempo = px.bar(
@@ -1714,7 +1911,7 @@ with tab_mun:
             exibir_grafico(fig_tempo, use_container_width=True)
 
             st.markdown("<h4 style='font-size: 1rem; font-weight: 600; color: #6b7280; margin-bottom: 0.75rem;'>Principais Substâncias Exploradas</h4>", unsafe_allow_html=True)
-            substancias_mun = df_municipio.groupby('Substância')['ValorRecolhido'].sum().sort_values(ascending=False).head(10)
+            substancias_mun = cubo_municipio.groupby('Substância', observed=True)['ValorRecolhido'].sum().sort_values(ascending=False).head(10)
             df_subst_mun = pd.DataFrame({'Substância': substancias_mun.index, 'Arrecadação': substancias_mun.values})
             fig_subst_mun = px.bar(
                 df_subst_mun,
@@ -1733,10 +1930,11 @@ with tab_mun:
 
         # Gráfico 2: Arrecadação mensal detalhada (expandido na horizontal)
         st.markdown("<h4 style='font-size: 1rem; font-weight: 600; color: #6b7280; margin-bottom: 0.75rem;'>Arrecadação Mensal Detalhada</h4>", unsafe_allow_html=True)
-        df_municipio_temp = df_municipio.copy()
-        df_municipio_temp['AnoMes'] = df_municipio_temp['Ano'].astype(str) + '-' + df_municipio_temp['Mês'].astype(str).str.zfill(2)
-        arrecadacao_mes_mun = df_municipio_temp.groupby('AnoMes')['ValorRecolhido'].sum().sort_index()
-        df_mes_mun = pd.DataFrame({'Período': arrecadacao_mes_mun.index, 'Arrecadação': arrecadacao_mes_mun.values})
+        arrecadacao_mes_mun = cubo_municipio.groupby('Periodo')['ValorRecolhido'].sum().sort_index()
+        df_mes_mun = pd.DataFrame({
+            'Período': [rotulo_periodo(periodo) for periodo in arrecadacao_mes_mun.index],
+            'Arrecadação': arrecadacao_mes_mun.values,
+        })
         fig_mes_mun = px.bar(
             df_mes_mun,
             x='Período',
@@ -1952,8 +2150,8 @@ with tab_mun:
         st.warning("Não há dados disponíveis para o município e período selecionados.")
 
 # ===== FUNÇÕES PARA GERAR GRÁFICOS ESTÁTICOS =====
-def gerar_graficos_diagnostico(df_municipio, municipio_nome):
-    """Gera gráficos estáticos para inserir no PowerPoint"""
+def gerar_graficos_diagnostico(cubo_municipio, municipio_nome):
+    """Gera gráficos estáticos para inserir no PowerPoint a partir das células do cubo do município"""
     import matplotlib.pyplot as plt
     from pathlib import Path
     import tempfile
@@ -1971,7 +2169,7 @@ def gerar_graficos_diagnostico(df_municipio, municipio_nome):
         progress_bar.progress(10)
         
         plt.figure(figsize=(10, 6))
-        arrecadacao_tempo = df_municipio.groupby('Ano')['ValorRecolhido'].sum().sort_index()
+        arrecadacao_tempo = cubo_municipio.groupby('Ano')['ValorRecolhido'].sum().sort_index()
         plt.plot(arrecadacao_tempo.index, arrecadacao_tempo.values, marker='o', linewidth=3, markersize=10, color='#1e3c72')
         plt.title(f'Evolução da Arrecadação - {municipio_nome}', fontsize=14, fontweight='bold', pad=20)
         plt.xlabel('Ano', fontsize=12)
@@ -1989,7 +2187,7 @@ def gerar_graficos_diagnostico(df_municipio, municipio_nome):
         progress_bar.progress(35)
         
         plt.figure(figsize=(10, 6))
-        top_substancias = df_municipio.groupby('Substância')['ValorRecolhido'].sum().sort_values(ascending=False).head(5)
+        top_substancias = cubo_municipio.groupby('Substância', observed=True)['ValorRecolhido'].sum().sort_values(ascending=False).head(5)
         plt.barh(range(len(top_substancias)), top_substancias.values, color='#2a5298')
         plt.yticks(range(len(top_substancias)), top_substancias.index)
         plt.title('Top 5 Substâncias Exploradas', fontsize=14, fontweight='bold', pad=20)
@@ -2007,7 +2205,7 @@ def gerar_graficos_diagnostico(df_municipio, municipio_nome):
         progress_bar.progress(60)
         
         plt.figure(figsize=(8, 6))
-        dist_tipo = df_municipio.groupby('Tipo_PF_PJ')['ValorRecolhido'].sum()
+        dist_tipo = cubo_municipio.groupby('Tipo_PF_PJ', observed=True)['ValorRecolhido'].sum()
         colors = ['#f59e0b', '#1e3c72']
         wedges, texts, autotexts = plt.pie(dist_tipo.values, labels=dist_tipo.index, autopct='%1.1f%%', colors=colors, startangle=90, textprops={'fontsize': 12, 'weight': 'bold'})
         plt.title('Distribuição: PF vs PJ', fontsize=14, fontweight='bold', pad=20)
@@ -2022,7 +2220,7 @@ def gerar_graficos_diagnostico(df_municipio, municipio_nome):
         progress_bar.progress(85)
         
         plt.figure(figsize=(10, 6))
-        total_mun = df_municipio['ValorRecolhido'].sum()
+        total_mun = cubo_municipio['ValorRecolhido_centavos'].sum() / 100
         cfem_dist = [total_mun * 0.15, total_mun * 0.15, total_mun * 0.60, total_mun * 0.10]
         labels_cfem = ['União (15%)', 'Estados (15%)', 'Município (60%)', 'Mun. Afetados (10%)']
         colors_cfem = ['#1e3c72', '#2a5298', '#00d4ff', '#10b981']
@@ -2057,9 +2255,9 @@ def gerar_graficos_diagnostico(df_municipio, municipio_nome):
 #         key="processos_csv"
 #     )
 #     if processos_upload is not None:
-#         st.session_state["processos_csv_bytes"] = processos_upload.getvalue()
+#         st.session_state["processos_digest"] = registrar_upload(processos_upload)
 #         st.session_state["processos_csv_name"] = processos_upload.name
-#         df_processos = carregar_processos_csv_bytes(st.session_state["processos_csv_bytes"])
+#         df_processos = carregar_processos_csv_blob(st.session_state["processos_digest"])
 #
 #     if df_processos is None:
 #         st.info("Envie o CSV de processos ou mantenha o arquivo padrão na pasta Downloads.")
@@ -2083,7 +2281,7 @@ with tab_global:
         col_f1, col_f2, col_f3, col_f4 = st.columns(4)
         
         with col_f1:
-            anos_global = sorted(df['Ano'].unique())
+            anos_global = sorted(cubo['Ano'].unique())
             anos_selecionados_global = st.multiselect(
                 "Anos",
                 anos_global,
@@ -2092,7 +2290,7 @@ with tab_global:
             )
         
         with col_f2:
-            estados_global = sorted(df[df['UF'].isin(UF_VALIDAS)]['UF'].unique())
+            estados_global = sorted(cubo[cubo['UF'].isin(UF_VALIDAS)]['UF'].unique())
             estados_selecionados_global = st.multiselect(
                 "Estados",
                 estados_global,
@@ -2101,7 +2299,7 @@ with tab_global:
             )
         
         with col_f3:
-            substancias_global = sorted(df['Substância'].dropna().unique())
+            substancias_global = sorted(cubo['Substância'].dropna().unique())
             substancias_selecionadas_global = st.multiselect(
                 "Substâncias (deixe vazio para todas)",
                 substancias_global,
@@ -2136,51 +2334,36 @@ with tab_global:
                 st.session_state.estados_global = estados_global
                 st.rerun()
     
-    # Aplicar filtros
-    df_global = df.copy()
-    if anos_selecionados_global:
-        df_global = df_global[df_global['Ano'].isin(anos_selecionados_global)]
-    if estados_selecionados_global:
-        df_global = df_global[df_global['UF'].isin(estados_selecionados_global)]
-    if substancias_selecionadas_global:
-        df_global = df_global[df_global['Substância'].isin(substancias_selecionadas_global)]
+    # Aplicar filtros: KPIs, gráficos, rankings e a tabela detalhada consultam o cubo; do frame
+    # bruto só a seleção de linhas é memorizada, e as linhas são recortadas para o download e a
+    # concentração por titular. A assinatura ordenada dos filtros é a chave da memorização,
+    # então voltar a uma seleção anterior não recalcula nada
+    filtros_painel_global = (
+        tuple(sorted(anos_selecionados_global)),
+        tuple(sorted(estados_selecionados_global)),
+        tuple(sorted(substancias_selecionadas_global)),
+    )
+    cubo_global = filtrar_painel_global(csv_digest, *filtros_painel_global)
     
     st.divider()
     
     # KPIs Globais principais
     st.markdown("### 📊 Indicadores Principais")
     
-    total_arrecadado_global = df_global['ValorRecolhido'].sum()
-    media_mensal_global = df_global.groupby(['Ano', 'Mês'])['ValorRecolhido'].sum().mean()
-    num_municipios_global = df_global['Município'].nunique()
-    num_estados_global = df_global['UF'].nunique()
-    num_substancias_global = df_global['Substância'].nunique()
+    total_arrecadado_global = cubo_global['ValorRecolhido_centavos'].sum() / 100  # soma exata em centavos
+    media_mensal_global = cubo_global.groupby('Periodo')['ValorRecolhido'].sum().mean()
+    num_municipios_global = cubo_global['Município'].nunique()
+    num_estados_global = cubo_global['UF'].nunique()
+    num_substancias_global = cubo_global['Substância'].nunique()
     
     # Cards KPIs em HTML
-    kpis_html = f"""
-    <div style='display: grid; grid-template-columns: repeat(5, 1fr); gap: 1rem; margin-bottom: 2rem;'>
-        <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(102, 126, 234, 0.3);'>
-            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Total Arrecadado</div>
-            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{formatar_moeda_br(total_arrecadado_global)}</div>
-        </div>
-        <div style='background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(240, 147, 251, 0.3);'>
-            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Média Mensal</div>
-            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{formatar_moeda_br(media_mensal_global)}</div>
-        </div>
-        <div style='background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(79, 172, 254, 0.3);'>
-            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Municípios</div>
-            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{num_municipios_global}</div>
-        </div>
-        <div style='background: linear-gradient(135deg, #43e97b 0%, #38f9d7 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(67, 233, 123, 0.3);'>
-            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Estados</div>
-            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{num_estados_global}</div>
-        </div>
-        <div style='background: linear-gradient(135deg, #fa709a 0%, #fee140 100%); padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(250, 112, 154, 0.3);'>
-            <div style='color: rgba(255,255,255,0.9); font-size: 0.75rem; font-weight: 600; text-transform: uppercase; margin-bottom: 0.5rem;'>Substâncias</div>
-            <div style='color: white; font-size: 1.5rem; font-weight: 700;'>{num_substancias_global}</div>
-        </div>
-    </div>
-    """
+    kpis_html = montar_kpis_globais_html(
+        total_arrecadado_global,
+        media_mensal_global,
+        num_municipios_global,
+        num_estados_global,
+        num_substancias_global
+    )
     st.markdown(kpis_html, unsafe_allow_html=True)
     
     st.divider()
@@ -2192,7 +2375,7 @@ with tab_global:
     
     with col_g1:
         st.markdown("<h4 style='font-size: 1rem; font-weight: 600; color: #6b7280; margin-bottom: 0.75rem;'>Evolução Temporal da Arrecadação</h4>", unsafe_allow_html=True)
-        evolucao_anual = df_global.groupby('Ano')['ValorRecolhido'].sum().reset_index()
+        evolucao_anual = cubo_global.groupby('Ano')['ValorRecolhido'].sum().reset_index()
         fig_evolucao = px.line(
             evolucao_anual,
             x='Ano',
@@ -2212,7 +2395,7 @@ with tab_global:
     
     with col_g2:
         st.markdown("<h4 style='font-size: 1rem; font-weight: 600; color: #6b7280; margin-bottom: 0.75rem;'>Distribuição por Estado</h4>", unsafe_allow_html=True)
-        dist_estados = df_global.groupby('UF')['ValorRecolhido'].sum().sort_values(ascending=False).head(top_n)
+        dist_estados = cubo_global.groupby('UF', observed=True)['ValorRecolhido'].sum().sort_values(ascending=False).head(top_n)
         fig_estados = px.bar(
             x=dist_estados.values,
             y=dist_estados.index,
@@ -2241,7 +2424,7 @@ with tab_global:
             </p>
         """, unsafe_allow_html=True)
         # ...código do mapa (copiar tudo que estava dentro do bloco anterior do mapa)...
-        arrecadacao_estados = df_global.groupby('UF')['ValorRecolhido'].sum().reset_index()
+        arrecadacao_estados = cubo_global.groupby('UF', observed=True)['ValorRecolhido'].sum().reset_index()
         arrecadacao_estados = arrecadacao_estados.sort_values('ValorRecolhido', ascending=False)
         mapa_nomes = {
             'AC': 'Acre', 'AL': 'Alagoas', 'AP': 'Amapá', 'AM': 'Amazonas',
@@ -2253,7 +2436,7 @@ with tab_global:
             'SP': 'São Paulo', 'SE': 'Sergipe', 'TO': 'Tocantins'
         }
         arrecadacao_estados['Estado'] = arrecadacao_estados['UF'].map(mapa_nomes)
-        arrecadacao_estados['Arrecadação_fmt'] = arrecadacao_estados['ValorRecolhido'].apply(formatar_moeda_br)
+        arrecadacao_estados['Arrecadação_fmt'] = formatar_moeda_br_vetorizado(arrecadacao_estados['ValorRecolhido'])
         geojson_urls = [
             "https://raw.githubusercontent.com/tbrugz/geodata-br/master/geojson/geojs-brasil-estados.json",
             "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/brazil-states.geojson",
@@ -2312,6 +2495,10 @@ with tab_global:
                             fig_mapa = configurar_grafico_sigma(fig_mapa)
                             min_log = arrecadacao_estados['ValorRecolhido_log'].min()
                             max_log = arrecadacao_estados['ValorRecolhido_log'].max()
+                            marcas_log = [min_log + (max_log - min_log) * fracao for fracao in (0, 0.2, 0.4, 0.6, 0.8, 1)]
+                            rotulos_log = formatar_moeda_br_vetorizado(10 ** np.array(marcas_log) - 1).tolist()
+                            if min_log <= 0:
+                                rotulos_log[0] = 'R$ 0'
                             fig_mapa.update_layout(
                                 height=650,
                                 margin=dict(l=10, r=120, t=20, b=10),
@@ -2324,16 +2511,8 @@ with tab_global:
                                     ),
                                     tickformat=",.0f",
                                     tickprefix="R$ ",
-                                    tickvals=[min_log, min_log + (max_log - min_log) * 0.2, min_log + (max_log - min_log) * 0.4, 
-                                             min_log + (max_log - min_log) * 0.6, min_log + (max_log - min_log) * 0.8, max_log],
-                                    ticktext=[
-                                        formatar_moeda_br(10**min_log - 1) if min_log > 0 else 'R$ 0',
-                                        formatar_moeda_br(10**(min_log + (max_log - min_log) * 0.2) - 1),
-                                        formatar_moeda_br(10**(min_log + (max_log - min_log) * 0.4) - 1),
-                                        formatar_moeda_br(10**(min_log + (max_log - min_log) * 0.6) - 1),
-                                        formatar_moeda_br(10**(min_log + (max_log - min_log) * 0.8) - 1),
-                                        formatar_moeda_br(10**max_log - 1)
-                                    ],
+                                    tickvals=marcas_log,
+                                    ticktext=rotulos_log,
                                     tickfont=dict(size=9, family='Sora', color='#374151'),
                                     len=0.85,
                                     thickness=20,
@@ -2376,6 +2555,10 @@ with tab_global:
             fig_tree = configurar_grafico_sigma(fig_tree)
             min_log_tree = arrecadacao_estados['ValorRecolhido_log'].min()
             max_log_tree = arrecadacao_estados['ValorRecolhido_log'].max()
+            marcas_log_tree = [min_log_tree + (max_log_tree - min_log_tree) * fracao for fracao in (0, 0.2, 0.4, 0.6, 0.8, 1)]
+            rotulos_log_tree = formatar_moeda_br_vetorizado(10 ** np.array(marcas_log_tree) - 1).tolist()
+            if min_log_tree <= 0:
+                rotulos_log_tree[0] = 'R$ 0'
             fig_tree.update_layout(
                 height=650,
                 margin=dict(l=10, r=120, t=20, b=10),
@@ -2388,16 +2571,8 @@ with tab_global:
                     ),
                     tickformat=",.0f",
                     tickprefix="R$ ",
-                    tickvals=[min_log_tree, min_log_tree + (max_log_tree - min_log_tree) * 0.2, min_log_tree + (max_log_tree - min_log_tree) * 0.4, 
-                             min_log_tree + (max_log_tree - min_log_tree) * 0.6, min_log_tree + (max_log_tree - min_log_tree) * 0.8, max_log_tree],
-                    ticktext=[
-                        formatar_moeda_br(10**min_log_tree - 1) if min_log_tree > 0 else 'R$ 0',
-                        formatar_moeda_br(10**(min_log_tree + (max_log_tree - min_log_tree) * 0.2) - 1),
-                        formatar_moeda_br(10**(min_log_tree + (max_log_tree - min_log_tree) * 0.4) - 1),
-                        formatar_moeda_br(10**(min_log_tree + (max_log_tree - min_log_tree) * 0.6) - 1),
-                        formatar_moeda_br(10**(min_log_tree + (max_log_tree - min_log_tree) * 0.8) - 1),
-                        formatar_moeda_br(10**max_log_tree - 1)
-                    ],
+                    tickvals=marcas_log_tree,
+                    ticktext=rotulos_log_tree,
                     tickfont=dict(size=9, family='Sora', color='#374151'),
                     len=0.85,
                     thickness=20,
@@ -2415,9 +2590,11 @@ with tab_global:
     with col_analise:
         st.markdown("### 🔬 Análises Detalhadas")
         st.markdown("<h4 style='font-size: 1rem; font-weight: 600; color: #6b7280; margin-bottom: 0.75rem;'>Concentração de Arrecadação</h4>", unsafe_allow_html=True)
-        ranking_mun_all = df_global.groupby('Município')['ValorRecolhido'].sum().sort_values(ascending=False)
-        top10_valor = ranking_mun_all.head(10).sum()
-        resto_valor = ranking_mun_all[10:].sum()
+        # Curva completa já ordenada (por UF e município), compartilhada com os insights abaixo
+        concentracao_global = calcular_concentracao_painel_global(csv_digest, *filtros_painel_global)
+        ranking_mun_all = concentracao_global['Município']['curva']
+        top10_valor = ranking_mun_all['Valor'].head(10).sum()
+        resto_valor = ranking_mun_all['Valor'].iloc[10:].sum()
         concentracao_data = pd.DataFrame({
             'Categoria': ['Top 10 Municípios', f'Demais ({len(ranking_mun_all)-10} municípios)'],
             'Valor': [top10_valor, resto_valor]
@@ -2437,59 +2614,60 @@ with tab_global:
         fig_concentracao = configurar_grafico_sigma(fig_concentracao)
         fig_concentracao.update_layout(height=400, showlegend=False, xaxis_title=None, yaxis_title='Valor Arrecadado (R$)')
         exibir_grafico(fig_concentracao, use_container_width=True)
+        resumo_municipios = concentracao_global['Município']['resumo'].iloc[0]
+        st.caption(
+            f"HHI {resumo_municipios['hhi']:.0f} · Gini {resumo_municipios['gini']:.2f} · "
+            f"{int(resumo_municipios['corte_80'])} de {int(resumo_municipios['entidades'])} municípios somam "
+            f"{LIMIAR_PARETO}% da arrecadação"
+        )
+        with st.expander("Curva de Pareto e índices de concentração", expanded=False):
+            dimensao_pareto = st.selectbox(
+                "Dimensão",
+                [dimensao for dimensao in ('Município', 'Substância', 'UF', 'Titular') if dimensao in concentracao_global],
+                key="dimensao_pareto"
+            )
+            curva_pareto = concentracao_global[dimensao_pareto]['curva']
+            fig_pareto = px.line(
+                curva_pareto,
+                x='Populacao_Acumulada',
+                y='Participacao_Acumulada',
+                labels={'Populacao_Acumulada': f'{dimensao_pareto} (% acumulado, do maior ao menor)', 'Participacao_Acumulada': 'Arrecadação acumulada (%)'}
+            )
+            fig_pareto.add_hline(y=LIMIAR_PARETO, line_dash="dash", line_color=SIGMA_COLORS['secondary'])
+            fig_pareto.update_traces(
+                line=dict(color=SIGMA_COLORS['accent'], width=3),
+                hovertemplate='<b>%{x:.1f}%</b> das entidades<br>%{y:.1f}% da arrecadação<extra></extra>'
+            )
+            fig_pareto = configurar_grafico_sigma(fig_pareto)
+            fig_pareto.update_layout(height=320, hovermode="closest")
+            exibir_grafico(fig_pareto, use_container_width=True)
+            st.dataframe(montar_tabela_concentracao(concentracao_global), use_container_width=True, hide_index=True)
+            municipios_por_uf = concentracao_global['Município por UF']
+            st.dataframe(
+                pd.DataFrame({
+                    'Municípios': municipios_por_uf['resumo']['entidades'],
+                    'HHI': municipios_por_uf['resumo']['hhi'].round(0),
+                    'Gini': municipios_por_uf['resumo']['gini'].round(3),
+                    f'Municípios até {LIMIAR_PARETO}%': municipios_por_uf['resumo']['corte_80'],
+                    'Top 3 (%)': participacao_top(municipios_por_uf, 3).round(1),
+                }).reset_index(),
+                use_container_width=True,
+                hide_index=True
+            )
     st.divider()
     
     # Insights automáticos
     st.markdown("### 💡 Insights Principais")
     
-    # Calcular insights
-    # Ranking de substâncias para insights
-    ranking_subst = df_global.groupby('Substância')['ValorRecolhido'].sum().sort_values(ascending=False)
-    maior_ano = evolucao_anual.loc[evolucao_anual['ValorRecolhido'].idxmax(), 'Ano']
-    maior_valor_ano = evolucao_anual['ValorRecolhido'].max()
-    
-    maior_estado = dist_estados.index[0]
-    maior_valor_estado = dist_estados.values[0]
-    participacao_estado = (maior_valor_estado / total_arrecadado_global) * 100
-    
-    maior_municipio = ranking_mun_all.index[0]
-    maior_valor_mun = ranking_mun_all.values[0]
-    
-    maior_substancia = ranking_subst.index[0]
-    maior_valor_subst = ranking_subst.values[0]
-    participacao_subst = (maior_valor_subst / total_arrecadado_global) * 100
-    
-    # Taxa de crescimento
-    if len(evolucao_anual) > 1:
-        valor_inicial = evolucao_anual.iloc[0]['ValorRecolhido']
-        valor_final = evolucao_anual.iloc[-1]['ValorRecolhido']
-        crescimento = ((valor_final - valor_inicial) / valor_inicial) * 100
-        tendencia = "crescimento" if crescimento > 0 else "queda"
-    else:
-        crescimento = 0
-        tendencia = "estável"
-    
+    # Uma única fonte: os mesmos insights automáticos, calculados sobre o cubo filtrado
+    itens_insights = "".join(
+        f"<div><strong style='color: {SIGMA_COLORS['primary']};'>{titulo}:</strong> {descricao}</div>"
+        for titulo, descricao in gerar_insights_automaticos(csv_digest, *filtros_painel_global)
+    )
     insights_html = f"""
     <div style='background: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%); padding: 1.5rem; border-radius: 12px; border-left: 4px solid {SIGMA_COLORS['accent']}; margin-bottom: 1rem;'>
         <div style='display: grid; gap: 1rem;'>
-            <div>
-                <strong style='color: {SIGMA_COLORS['primary']};'>📊 Ano de maior arrecadação:</strong> {int(maior_ano)} com {formatar_moeda_br(maior_valor_ano)}
-            </div>
-            <div>
-                <strong style='color: {SIGMA_COLORS['primary']};'>🗺️ Estado líder:</strong> {maior_estado} concentra {participacao_estado:.1f}% do total nacional ({formatar_moeda_br(maior_valor_estado)})
-            </div>
-            <div>
-                <strong style='color: {SIGMA_COLORS['primary']};'>🏙️ Município destaque:</strong> {maior_municipio} com {formatar_moeda_br(maior_valor_mun)} arrecadados
-            </div>
-            <div>
-                <strong style='color: {SIGMA_COLORS['primary']};'>⛏️ Substância principal:</strong> {maior_substancia} representa {participacao_subst:.1f}% da arrecadação total
-            </div>
-            <div>
-                <strong style='color: {SIGMA_COLORS['primary']};'>📈 Tendência:</strong> {tendencia.capitalize()} de {abs(crescimento):.1f}% entre o primeiro e último ano analisado
-            </div>
-            <div>
-                <strong style='color: {SIGMA_COLORS['primary']};'>🎯 Concentração:</strong> Top 10 municípios representam {(top10_valor/total_arrecadado_global*100):.1f}% da arrecadação total
-            </div>
+            {itens_insights}
         </div>
     </div>
     """
@@ -2497,30 +2675,45 @@ with tab_global:
     
     st.divider()
     
+    # Meses atípicos das entidades na seleção, calculados em lote a partir do cubo filtrado;
+    # sem filtro ativo, os persistidos com o dataset
+    st.markdown("### 🚨 Meses Atípicos")
+    sazonalidade_entidades, meses_atipicos = carregar_perfil_sazonal_painel_global(csv_digest, *filtros_painel_global)
+    st.caption("Considera apenas os anos, UFs e substâncias selecionados nos filtros acima")
+    dimensao_atipicos = st.selectbox(
+        "Analisar meses atípicos por",
+        ["UF", "Município", "Substância"],
+        key="dimensao_atipicos"
+    )
+    atipicos_dimensao = meses_atipicos[meses_atipicos['Dimensão'] == dimensao_atipicos]
+    if len(atipicos_dimensao) == 0:
+        st.info("Nenhum mês atípico encontrado para esta dimensão")
+    else:
+        st.dataframe(montar_tabela_meses_atipicos(atipicos_dimensao), use_container_width=True, hide_index=True, height=300)
+    with st.expander("Índices sazonais (média do mês / média mensal × 100)", expanded=False):
+        indices_dimensao = sazonalidade_entidades[sazonalidade_entidades['Dimensão'] == dimensao_atipicos]
+        indices_dimensao = indices_dimensao.drop(columns='Dimensão').rename(
+            columns={f"mes_{mes:02d}": nome[:3] for mes, nome in enumerate(MESES_PT, start=1)}
+        )
+        st.dataframe(indices_dimensao.round(1), use_container_width=True, hide_index=True)
+    
+    st.divider()
+    
     # Tabela interativa completa
     st.markdown("### 📋 Dados Detalhados")
     
-    # Agregação por município com múltiplas métricas
-    df_detalhado = df_global.groupby(['UF', 'Município']).agg({
-        'ValorRecolhido': ['sum', 'mean', 'count'],
-        'Substância': 'nunique',
-        'Ano': lambda x: f"{x.min()}-{x.max()}"
-    }).reset_index()
-    
-    df_detalhado.columns = ['UF', 'Município', 'Total Arrecadado', 'Média por Registro', 'Nº Registros', 'Nº Substâncias', 'Período']
-    df_detalhado['Total Arrecadado'] = df_detalhado['Total Arrecadado'].apply(formatar_moeda_br)
-    df_detalhado['Média por Registro'] = df_detalhado['Média por Registro'].apply(formatar_moeda_br)
-    df_detalhado = df_detalhado.sort_values('Nº Registros', ascending=False)
+    # Agregação por município com múltiplas métricas, a partir do cubo já filtrado
+    df_detalhado = montar_tabela_detalhada(csv_digest, *filtros_painel_global)
     
     st.dataframe(
-        df_detalhado,
+        estilizar_moeda_br(df_detalhado, ['Total Arrecadado', 'Média por Registro']),
         use_container_width=True,
         hide_index=True,
         height=400
     )
     
     # Botão de download
-    csv = df_global.to_csv(index=False, encoding='utf-8-sig', sep=';')
+    csv = recortar_dados_painel_global(csv_digest, filtros_painel_global).to_csv(index=False, encoding='utf-8-sig', sep=';')
     st.download_button(
         label="📥 Download dados filtrados (CSV)",
         data=csv,
@@ -2538,30 +2731,30 @@ with tab_diag:
     with col1:
         municipio_diagnostico = st.selectbox(
             "Selecione o Município para Diagnóstico",
-            sorted(df['Município'].dropna().unique()),
+            sorted(indice_cubo['nomes_municipios']),
             key="municipio_diag"
         )
     
     with col2:
         if st.button("Gerar Diagnóstico", key="gerar_diag"):
             with st.spinner("Gerando diagnóstico com análises..."):
-                # Preparar dados do município
-                df_mun_diag = df[df['Município'] == municipio_diagnostico]
+                # Preparar as células do cubo do município
+                cubo_mun_diag = fatiar_cubo_por_municipio(cubo, indice_cubo, municipio_diagnostico)
                 
-                if len(df_mun_diag) > 0:
-                    if 'pptx_data' not in st.session_state:
+                if len(cubo_mun_diag) > 0:
+                    if 'pptx_digest' not in st.session_state:
                         st.error("Envie o template PPTX na aba de Importação para gerar o diagnóstico.")
                         st.stop()
 
                     # Extrair informações
-                    uf_mun_diag = df_mun_diag['UF'].iloc[0]
-                    total_mun_diag = df_mun_diag['ValorRecolhido'].sum()
-                    quantidade_registros = len(df_mun_diag)
-                    media_mun_diag = df_mun_diag['ValorRecolhido'].mean()
-                    substancias_mun_diag = df_mun_diag['Substância'].nunique()
+                    uf_mun_diag = cubo_mun_diag['UF'].iloc[0]
+                    total_mun_diag = cubo_mun_diag['ValorRecolhido_centavos'].sum() / 100
+                    quantidade_registros = int(cubo_mun_diag['Registros'].sum())
+                    media_mun_diag = media_por_registro(cubo_mun_diag)
+                    substancias_mun_diag = cubo_mun_diag['Substância'].nunique()
                     
                     # Top substâncias
-                    top_substancias_diag = df_mun_diag.groupby('Substância')['ValorRecolhido'].sum().sort_values(ascending=False).head(5)
+                    top_substancias_diag = cubo_mun_diag.groupby('Substância', observed=True)['ValorRecolhido'].sum().sort_values(ascending=False).head(5)
                     
                     # Distribuição CFEM
                     uniao_diag = total_mun_diag * 0.15
@@ -2573,18 +2766,17 @@ with tab_diag:
                     valor_recuperacao_diag = total_mun_diag * 0.15
                     
                     # Ranking no estado
-                    df_estado_diag = df[df['UF'] == uf_mun_diag]
-                    ranking_estado_diag = df_estado_diag.groupby('Município')['ValorRecolhido'].sum().sort_values(ascending=False)
-                    posicao_diag = list(ranking_estado_diag.index).index(municipio_diagnostico) + 1
-                    total_municipios_diag = len(ranking_estado_diag)
-                    participacao_diag = (total_mun_diag / df_estado_diag['ValorRecolhido'].sum()) * 100
+                    ranking_diag = consultar_ranking(ranking_municipios, uf_mun_diag, municipio_diagnostico)
+                    posicao_diag = int(ranking_diag['posicao_estado'])
+                    total_municipios_diag = int(ranking_diag['municipios_estado'])
+                    participacao_diag = ranking_diag['participacao_estado']
                     
                     try:
                         # Gerar gráficos estáticos
-                        graficos_diag = gerar_graficos_diagnostico(df_mun_diag, municipio_diagnostico)
+                        graficos_diag = gerar_graficos_diagnostico(cubo_mun_diag, municipio_diagnostico)
                         
-                        # Carregar template a partir do session_state
-                        template_bytes = st.session_state.pptx_data
+                        # Carregar template do armazém de arquivos
+                        template_bytes = ler_blob(ARQUIVOS_DIR, st.session_state.pptx_digest)
                         prs = Presentation(io.BytesIO(template_bytes))
                         
                         # Cores corporativas SIGMA
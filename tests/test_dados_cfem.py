@@ -0,0 +1,448 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from dados_cfem import (
+    ajustar_tendencias,
+    anexar_csv_cfem_incremental,
+    calcular_concentracao,
+    calcular_hash_fonte,
+    calcular_metricas_municipios,
+    calcular_perfil_sazonal,
+    caminho_cubo,
+    construir_acumulados,
+    construir_bitmaps,
+    construir_cubo_cfem,
+    classificar_totais,
+    converter_moeda_br_centavos,
+    detectar_meses_atipicos,
+    filtrar_por_bitmaps,
+    formatar_moeda_br_vetorizado,
+    ingerir_csv_cfem_em_lotes,
+    intervalo_wilson,
+    ler_dataset_colunar,
+    ler_manifesto,
+    medir_proporcao,
+    perfilar_qualidade,
+    rotular_intervalos_periodo,
+    selecionar_por_bitmaps,
+    total_periodo,
+    totais_periodo,
+)
+
+CABECALHO_CFEM = "Ano;Mês;Processo;AnoDoProcesso;Tipo_PF_PJ;CPF_CNPJ;Substância;UF;Município;QuantidadeComercializada;UnidadeDeMedida;ValorRecolhido"
+
+
+def formatar_escalar(valor):
+    return f"R$ {valor:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def test_formatar_moeda_igual_ao_formatador_escalar():
+    valores = [0, 5, 0.005, 0.015, 2.675, 0.995, 999999.995, 1234567.891, -1234.5, -0.0, 1e15 + 0.25]
+    assert formatar_moeda_br_vetorizado(valores).tolist() == [formatar_escalar(valor) for valor in valores]
+
+
+def test_formatar_moeda_valores_ausentes():
+    assert formatar_moeda_br_vetorizado(pd.Series([np.nan])).tolist() == ["—"]
+    resultado = formatar_moeda_br_vetorizado([np.nan, np.inf, 1.0, -np.inf])
+    assert resultado.tolist() == ["—", "—", "R$ 1,00", "—"]
+    assert formatar_moeda_br_vetorizado([np.nan], ausente="").tolist() == [""]
+
+
+def test_formatar_moeda_preserva_indice():
+    serie = pd.Series([1500.0, 2.5], index=[7, 3])
+    assert formatar_moeda_br_vetorizado(serie).to_dict() == {7: "R$ 1.500,00", 3: "R$ 2,50"}
+
+
+def gravar_csv(caminho, linhas):
+    caminho.write_text("\n".join([CABECALHO_CFEM, *linhas]) + "\n", encoding="utf-8")
+    return caminho
+
+
+def test_anexar_incremento_deduplica_e_preserva_identificadores(tmp_path):
+    base = gravar_csv(tmp_path / "base.csv", [
+        "2025;11;800001/2010;2010;PJ;00012345678901;FERRO;MG;MARIANA;10;t;1.000,00",
+    ])
+    linha_nova = "2025;12;800002/2010;2010;PJ;00012345678902;FERRO;MG;MARIANA;10;t;2.000,00"
+    linha_rejeitada = "2025;12;800003/2010;2010;PJ;00012345678903;FERRO;XX;MARIANA;10;t;3.000,00"
+    incremento = gravar_csv(tmp_path / "incremento.csv", [linha_nova, linha_nova, linha_rejeitada])
+    repetido = gravar_csv(tmp_path / "repetido.csv", [linha_nova, linha_rejeitada, ""])
+
+    digest_base = calcular_hash_fonte(base)
+    ingerir_csv_cfem_em_lotes(base, tmp_path, digest_base)
+    digest, resumo = anexar_csv_cfem_incremental(tmp_path, digest_base, incremento)
+    assert (resumo['linhas_novas'], resumo['linhas_duplicadas'], resumo['linhas_quarentena']) == (1, 1, 1)
+
+    digest_final, resumo = anexar_csv_cfem_incremental(tmp_path, digest, repetido)
+    assert (resumo['linhas_novas'], resumo['linhas_quarentena']) == (0, 0)
+    assert ler_manifesto(tmp_path, digest_final)['quarentena']['linhas'] == 1
+    assert sorted(ler_dataset_colunar(tmp_path, digest_final)['CPF_CNPJ']) == ['00012345678901', '00012345678902']
+
+
+def test_converter_moeda_br_aceita_formatos_validos():
+    serie = pd.Series(["R$ 1.234,56", "-R$ 5", "R$ -1234,5", "1.234", "1234", " 0,07 "])
+    centavos, erros = converter_moeda_br_centavos(serie)
+    assert not erros.any()
+    assert centavos.tolist() == [123456, -500, -123450, 123400, 123400, 7]
+
+
+def test_converter_moeda_br_centavos_inteiros_por_formato():
+    casos = {
+        "-R$ 1.234,56": -123456,  # negativo com milhar
+        "R$ -7": -700,  # negativo sem decimais
+        "- 0,5": -50,  # negativo com um decimal
+        "R$ 1.000.000": 100000000,  # milhar sem decimais
+        "2,5": 250,  # um decimal
+        "R$ 12.345,6": 1234560,  # milhar com um decimal
+        "R$ 90.071.992.547.409,93": 9007199254740993,  # além da precisão exata do float64
+    }
+    centavos, erros = converter_moeda_br_centavos(pd.Series(list(casos), dtype='str'))
+    assert not erros.any()
+    assert centavos.tolist() == list(casos.values())
+
+
+def test_converter_moeda_br_ausentes_e_excesso_de_digitos_sao_erros():
+    serie = pd.Series([None, "", "R$", "12345678901234567,00", "-"], dtype='str')
+    centavos, erros = converter_moeda_br_centavos(serie)
+    assert erros.all()
+    assert centavos.tolist() == [0, 0, 0, 0, 0]
+
+
+def test_converter_moeda_br_rejeita_milhar_e_decimais_invalidos():
+    serie = pd.Series(["R$ 1.234,567", "1234.56", "12.34", "1.2345,00", "R$ 1.234,56"])
+    centavos, erros = converter_moeda_br_centavos(serie)
+    assert erros.tolist() == [True, True, True, True, False]
+    assert centavos.tolist() == [0, 0, 0, 0, 123456]
+
+
+def test_classificar_totais_empates_mantem_posicao_de_m():
+    indice = pd.MultiIndex.from_tuples(
+        [('MG', 'A'), ('MG', 'B'), ('MG', 'C'), ('MG', 'D'), ('PA', 'E')], names=['UF', 'Município']
+    )
+    tabela = classificar_totais(pd.Series([300, 200, 200, 100, 500], index=indice))
+    assert tabela['posicao_estado'].tolist() == [1, 2, 2, 4, 1]
+    assert tabela['posicao_nacional'].tolist() == [2, 3, 3, 5, 1]
+    assert (tabela['posicao_estado'] <= tabela['municipios_estado']).all()
+
+
+def test_rotular_intervalos_periodo_por_pares_distintos():
+    inicio = pd.Series([2021 * 12, 2021 * 12, 2023 * 12 + 5, None], dtype='Int64')
+    fim = pd.Series([2025 * 12 + 11, 2025 * 12 + 11, 2023 * 12 + 5, 2024 * 12], dtype='Int64')
+    assert rotular_intervalos_periodo(inicio, fim).tolist() == [
+        "2021-01 a 2025-12", "2021-01 a 2025-12", "2023-06 a 2023-06", "N/D",
+    ]
+
+
+def test_lotes_interpretam_moeda_igual_em_qualquer_fronteira(tmp_path):
+    # Com um lote por linha, o lote de "1.500" sozinho seria inferido como número (1,5)
+    fonte = gravar_csv(tmp_path / "lotes.csv", [
+        "2025;1;800001/2010;2010;PJ;00012345678901;FERRO;MG;MARIANA;1.500;t;1.500",
+        "2025;1;800002/2010;2010;PJ;00012345678902;FERRO;MG;MARIANA;2,5;t;R$ 1.500,00",
+    ])
+    totais = ingerir_csv_cfem_em_lotes(fonte, tmp_path, calcular_hash_fonte(fonte), tamanho_lote=1)
+    assert totais['total_centavos'] == 300000
+    df = ler_dataset_colunar(tmp_path, calcular_hash_fonte(fonte))
+    assert sorted(df['ValorRecolhido_centavos']) == [150000, 150000]
+
+
+def test_ingestao_concorrente_do_mesmo_digest(tmp_path):
+    # Sessões do Streamlit são threads do mesmo processo e podem ingerir o mesmo arquivo juntas
+    fonte = gravar_csv(tmp_path / "base.csv", [
+        f"2025;{mes};80000{mes}/2010;2010;PJ;0001234567890{mes};FERRO;MG;MARIANA;10;t;1.000,00" for mes in range(1, 10)
+    ])
+    digest = calcular_hash_fonte(fonte)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        resultados = list(pool.map(lambda _: ingerir_csv_cfem_em_lotes(fonte, tmp_path, digest), range(8)))
+    assert all(totais['total_centavos'] == 900000 for totais in resultados)
+    assert len(ler_dataset_colunar(tmp_path, digest)) == 9
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_anexar_incremento_mantem_linhas_distintas_e_mescla_cubo(tmp_path):
+    base = gravar_csv(tmp_path / "base.csv", [
+        "2025;11;800001/2010;2010;PJ;00012345678901;FERRO;MG;MARIANA;10;t;1.000,00",
+        "2025;12;800001/2010;2010;PJ;00012345678901;FERRO;PA;PARAUAPEBAS;10;t;4.000,00",
+    ])
+    # Mesmo processo, mês e substância pagando em dois municípios: linhas distintas
+    incremento = gravar_csv(tmp_path / "incremento.csv", [
+        "2025;12;800001/2010;2010;PJ;00012345678901;FERRO;MG;MARIANA;10;t;2.000,00",
+        "2025;12;800001/2010;2010;PJ;00012345678901;FERRO;MG;ITABIRA;10;t;3.000,00",
+        "2025;12;800001/2010;2010;PJ;00012345678901;FERRO;PA;PARAUAPEBAS;10;t;4.000,00",
+    ])
+    digest_base = calcular_hash_fonte(base)
+    ingerir_csv_cfem_em_lotes(base, tmp_path, digest_base)
+    digest, resumo = anexar_csv_cfem_incremental(tmp_path, digest_base, incremento)
+    assert (resumo['linhas_novas'], resumo['linhas_duplicadas']) == (2, 1)
+
+    cubo = feather.read_table(caminho_cubo(tmp_path, digest)).to_pandas()
+    esperado = construir_cubo_cfem(ler_dataset_colunar(tmp_path, digest))
+    pd.testing.assert_frame_equal(cubo, esperado)
+    assert cubo['ValorRecolhido_centavos'].sum() == 1000000
+
+
+def test_calcular_concentracao_casos_calculados_a_mao():
+    linhas = [
+        ('AA', 'A1', 100), ('AA', 'A2', 100), ('AA', 'A3', 100), ('AA', 'A4', 100),  # partes iguais
+        ('BB', 'B1', 1000), ('BB', 'B2', 0), ('BB', 'B3', 0),  # monopólio de um único titular
+        ('CC', 'C1', 4000), ('CC', 'C2', 2000), ('CC', 'C3', 4000),  # empate exato em 80%
+    ]
+    df = pd.DataFrame(linhas, columns=['UF', 'Município', 'ValorRecolhido_centavos'])
+    concentracao = calcular_concentracao(df, 'Município', por='UF')
+
+    resumo = concentracao['resumo']
+    assert resumo.index.tolist() == ['AA', 'BB', 'CC']
+    assert resumo['entidades'].tolist() == [4, 3, 3]
+    assert resumo['total'].tolist() == [4.0, 10.0, 100.0]
+    np.testing.assert_allclose(resumo['hhi'], [4 * 25 ** 2, 100 ** 2, 40 ** 2 + 40 ** 2 + 20 ** 2])
+    # Gini = 2 Σ i·x(i) / (n Σx) - (n + 1) / n, com x em ordem crescente
+    np.testing.assert_allclose(resumo['gini'], [0, 2 / 3, 2 * (20 + 2 * 40 + 3 * 40) / 300 - 4 / 3], atol=1e-12)
+    # O terceiro município de CC começa exatamente em 80% e fica fora do corte
+    assert resumo['corte_80'].tolist() == [4, 1, 2]
+
+    curva = concentracao['curva'].set_index(['UF', 'Município'])
+    assert curva.loc['CC', 'Posicao'].tolist() == [1, 2, 3]
+    np.testing.assert_allclose(curva.loc['CC', 'Participacao_Acumulada'], [40, 80, 100])
+    np.testing.assert_allclose(curva.loc['AA', 'Populacao_Acumulada'], [25, 50, 75, 100])
+    assert curva.loc[('BB', 'B1'), 'Participacao'] == 100
+
+
+def test_calcular_concentracao_sem_grupos_soma_cem_por_cento():
+    df = pd.DataFrame({'Substância': ['FERRO', 'OURO', 'FERRO', 'COBRE'], 'ValorRecolhido_centavos': [300, 500, 200, 0]})
+    concentracao = calcular_concentracao(df, 'Substância')
+    assert concentracao['curva']['Substância'].tolist() == ['FERRO', 'OURO', 'COBRE']
+    assert concentracao['curva']['Participacao'].sum() == 100
+    assert concentracao['resumo'][['entidades', 'hhi', 'corte_80']].iloc[0].tolist() == [3, 50 ** 2 + 50 ** 2, 2]
+
+
+def test_ajustar_tendencias_igual_ao_polyfit_por_linha():
+    rng = np.random.default_rng(7)
+    matriz = rng.normal(1000, 250, size=(4, 10)) + 35 * np.arange(10)
+    matriz[1, [0, 3, 4, 8]] = np.nan  # meses ausentes no meio e na ponta
+    matriz[2, :] = np.nan
+    matriz[2, 5] = 500.0  # um único período
+    matriz[3, [2, 6]] = np.nan
+    ajuste = ajustar_tendencias(matriz, passos=2)
+
+    assert ajuste['observacoes'].tolist() == [10, 6, 1, 8]
+    assert np.isnan(ajuste['inclinacao'][2]) and np.isnan(ajuste['projecao'][2]).all()
+    x = np.arange(10)
+    for linha in (0, 1, 3):
+        observado = np.isfinite(matriz[linha])
+        inclinacao, intercepto = np.polyfit(x[observado], matriz[linha, observado], 1)
+        previsto = np.polyval([inclinacao, intercepto], x[observado])
+        desvios = matriz[linha, observado] - matriz[linha, observado].mean()
+        r2 = 1 - ((matriz[linha, observado] - previsto) ** 2).sum() / (desvios ** 2).sum()
+        np.testing.assert_allclose(ajuste['inclinacao'][linha], inclinacao, rtol=1e-9)
+        np.testing.assert_allclose(ajuste['intercepto'][linha], intercepto, rtol=1e-9)
+        np.testing.assert_allclose(ajuste['r2'][linha], r2, rtol=1e-9)
+        np.testing.assert_allclose(ajuste['projecao'][linha], np.polyval([inclinacao, intercepto], [10, 11]), rtol=1e-9)
+
+
+def test_total_periodo_igual_a_soma_mascarada():
+    rng = np.random.default_rng(3)
+    n = 200
+    cubo = pd.DataFrame({
+        'UF': rng.choice(['MG', 'PA', 'GO'], n),
+        'Município': rng.choice(['A', 'B', 'C', 'D'], n),
+        'Substância': rng.choice(['FERRO', 'OURO'], n),
+        'Periodo': pd.array(rng.integers(2023 * 12, 2025 * 12, n), dtype='Int64'),
+        'ValorRecolhido_centavos': rng.integers(0, 10 ** 9, n),
+        'Registros': rng.integers(1, 5, n),
+    })
+    cubo.loc[[0, 1], 'Periodo'] = pd.NA  # células sem período ficam fora de qualquer intervalo
+    acumulados = construir_acumulados(cubo)
+    primeiro, ultimo = int(cubo['Periodo'].min()), int(cubo['Periodo'].max())
+    intervalos = [
+        (primeiro, ultimo), (primeiro, primeiro), (ultimo, ultimo), (primeiro + 5, primeiro + 9),
+        (primeiro + 7, primeiro + 6), (primeiro - 24, primeiro - 1), (ultimo + 1, ultimo + 12), (primeiro - 3, ultimo + 3),
+    ]
+    for inicio, fim in intervalos:
+        mascara = (cubo['Periodo'] >= inicio) & (cubo['Periodo'] <= fim)
+        selecionado = cubo[mascara.fillna(False)]
+        for uf in ('MG', 'PA', 'GO'):
+            esperado = selecionado.loc[selecionado['UF'] == uf, 'ValorRecolhido_centavos'].sum()
+            assert total_periodo(acumulados, 'UF', uf, inicio, fim) == esperado
+        assert total_periodo(acumulados, 'Município', ('PA', 'B'), inicio, fim) == selecionado.loc[
+            (selecionado['UF'] == 'PA') & (selecionado['Município'] == 'B'), 'ValorRecolhido_centavos'
+        ].sum()
+        totais = totais_periodo(acumulados, 'Substância', inicio, fim)
+        esperados = selecionado.groupby('Substância')[['ValorRecolhido_centavos', 'Registros']].sum()
+        esperados = esperados.reindex(totais.index, fill_value=0)
+        assert totais['total_centavos'].tolist() == esperados['ValorRecolhido_centavos'].tolist()
+        assert totais['registros'].tolist() == esperados['Registros'].tolist()
+    assert total_periodo(acumulados, 'UF', 'SP', primeiro, ultimo) == 0
+
+
+def test_detectar_meses_atipicos_iqr_e_z_robusto():
+    matriz = pd.DataFrame([
+        [100, 102, 98, 101, 99, 100, 103, 97, 100, 101, 99, 1000],  # atípico pelos dois critérios
+        [10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 110, 200],  # só pelo IQR
+        [100] * 9 + [np.nan, np.nan, 5000],  # menos de 11 meses: não avaliada
+    ], index=['A', 'B', 'C'], columns=range(24300, 24312), dtype='float64')
+    anomalias = detectar_meses_atipicos(matriz)
+
+    assert anomalias.index.tolist() == ['A', 'B']
+    assert anomalias['Periodo'].tolist() == [24311, 24311]
+    # A: mediana 100, Q1 99, Q3 101,25, MAD 1
+    np.testing.assert_allclose(anomalias.loc['A', ['Mediana', 'LimiteInferior', 'LimiteSuperior']].astype(float), [100, 95.625, 104.625])
+    np.testing.assert_allclose(anomalias.loc['A', 'ZRobusto'], 0.6745 * 900)
+    # B: mediana 65, Q1 37,5, Q3 92,5, MAD 30: fora da cerca superior (175), z robusto ≈ 3,03
+    np.testing.assert_allclose(anomalias.loc['B', 'LimiteSuperior'], 175)
+    np.testing.assert_allclose(anomalias.loc['B', 'ZRobusto'], 0.6745 * 135 / 30)
+    assert anomalias['ForaIQR'].tolist() == [True, True]
+    assert anomalias['ZExtremo'].tolist() == [True, False]
+
+
+def test_meses_atipicos_do_subconjunto_filtrado():
+    periodos = range(2024 * 12, 2025 * 12)
+    linhas = []
+    for periodo in periodos:
+        atipico = periodo == 2024 * 12 + 5
+        # O total de MG é constante; só o recorte por substância mostra o mês atípico
+        linhas.append(('MG', 'MARIANA', 'FERRO', periodo, 100_000 if atipico else 10_000))
+        linhas.append(('MG', 'MARIANA', 'OURO', periodo, 10_000 if atipico else 100_000))
+    cubo = pd.DataFrame(linhas, columns=['UF', 'Município', 'Substância', 'Periodo', 'ValorRecolhido_centavos'])
+    cubo['Periodo'] = cubo['Periodo'].astype('Int64')
+    cubo['Registros'] = 1
+
+    completo = calcular_perfil_sazonal(construir_acumulados(cubo), detectar_meses_atipicos)
+    assert completo.loc[completo['Dimensão'] != 'Substância'].empty
+    assert sorted(completo['Entidade']) == ['FERRO', 'OURO']
+
+    filtrado = calcular_perfil_sazonal(construir_acumulados(cubo[cubo['Substância'] == 'FERRO']), detectar_meses_atipicos)
+    assert filtrado['Dimensão'].tolist() == ['UF', 'Município', 'Substância']
+    assert filtrado['Entidade'].tolist() == ['MG', 'MARIANA', 'FERRO']
+    assert (filtrado['Periodo'] == 2024 * 12 + 5).all()
+    assert (filtrado['Valor'] == 1000).all()
+
+
+def test_perfilar_qualidade_duplicados_nulos_e_wilson():
+    linhas = [
+        (2024, 1, 'MG', 'MARIANA', 'FERRO', 100.0),
+        (2024, 1, 'MG', 'MARIANA', 'FERRO', 100.0),  # duplicada
+        (2024, 1, 'MG', 'MARIANA', 'FERRO', 100.0),  # duplicada
+        (2024, 2, 'PA', 'PARAUAPEBAS', 'OURO', 250.0),
+        (2024, 2, 'PA', 'PARAUAPEBAS', 'OURO', 250.0),  # duplicada
+        (2024, 2, None, 'CATALAO', 'FERRO', 80.0),
+        (2024, 4, None, 'ITABIRA', None, 90.0),
+        (2024, 4, 'GO', 'CATALAO', 'COBRE', 0.0),
+        (2024, 4, 'GO', None, 'COBRE', -5.0),
+        (2024, 4, 'GO', 'CATALAO', 'OURO', 60.0),
+    ]
+    df = pd.DataFrame(linhas, columns=['Ano', 'Mês', 'UF', 'Município', 'Substância', 'ValorRecolhido'])
+    df['Periodo'] = df['Ano'] * 12 + df['Mês'] - 1
+    qualidade = perfilar_qualidade(df)
+
+    assert (qualidade['modo'], qualidade['linhas_analisadas']) == ('completo', 10)
+    assert qualidade['duplicados'] == {'quantidade': 3, 'percentual': 30.0}
+    faltantes = {coluna: medida['quantidade'] for coluna, medida in qualidade['dados_faltantes'].items()}
+    assert faltantes == {'Ano': 0, 'Mês': 0, 'UF': 2, 'Município': 1, 'Substância': 1, 'ValorRecolhido': 0, 'Periodo': 0}
+    assert qualidade['dados_faltantes']['UF']['percentual'] == 20.0
+    assert 'intervalo_95' not in qualidade['dados_faltantes']['UF']
+    assert qualidade['gaps_temporais'] == {'gaps': 1, 'completude': 75.0}
+    assert qualidade['valores_suspeitos']['negativos']['quantidade'] == 1
+    assert qualidade['valores_suspeitos']['zeros']['quantidade'] == 1
+
+    # Intervalo de Wilson de 95% calculado à mão: 3/10 -> [10,78%; 60,32%]; 0/10 -> [0; z²/(n + z²)]
+    np.testing.assert_allclose(intervalo_wilson(3, 10), [10.7791267, 60.3221853])
+    np.testing.assert_allclose(intervalo_wilson(0, 10), [0, 100 * 1.959963984540054 ** 2 / (10 + 1.959963984540054 ** 2)])
+    assert intervalo_wilson(0, 0) == [0.0, 0.0]
+    # Amostra: a quantidade é extrapolada para todas as linhas e o intervalo vem da fração observada
+    assert medir_proporcao(3, 10, 1000) == {'quantidade': 300, 'percentual': 30.0, 'intervalo_95': intervalo_wilson(3, 10)}
+
+
+def test_perfilar_qualidade_modo_rapido_tem_intervalos():
+    df = pd.DataFrame({
+        'Periodo': np.arange(2000) % 24 + 2024 * 12,
+        'ValorRecolhido': np.arange(2000, dtype='float64'),
+        'UF': pd.Series(['MG', None] * 1000, dtype='str'),
+    })
+    qualidade = perfilar_qualidade(df, amostra=500)
+    analisadas = qualidade['linhas_analisadas']
+    assert qualidade['modo'] == 'rapido' and 0 < analisadas < 2000
+    faltantes = qualidade['dados_faltantes']['UF']
+    sucessos = round(faltantes['percentual'] / 100 * analisadas)
+    assert faltantes['intervalo_95'] == intervalo_wilson(sucessos, analisadas)
+    assert faltantes['intervalo_95'][0] <= faltantes['percentual'] <= faltantes['intervalo_95'][1]
+
+
+def test_filtros_por_bitmaps_iguais_a_mascara_isin():
+    rng = np.random.default_rng(11)
+    n = 1001  # não múltiplo de 8: o último byte do bitmap fica incompleto
+    df = pd.DataFrame({
+        'Ano': rng.choice([2022, 2023, 2024], n),
+        'UF': pd.Series(rng.choice(['MG', 'PA', 'GO', 'BA'], n)).astype('category'),
+        'Substância': pd.Series(rng.choice(['FERRO', 'OURO', 'COBRE'], n), dtype='str'),
+        'ValorRecolhido': rng.random(n),
+    }, index=rng.permutation(n) + 500)
+    indice = construir_bitmaps(df)
+    casos = [
+        {'UF': ['MG', 'PA']},  # OU dentro da coluna
+        {'Ano': [2023], 'UF': ['GO'], 'Substância': ['OURO', 'COBRE']},  # E entre colunas
+        {'UF': ['MG', 'SP']},  # SP não ocorre nos dados
+        {'UF': ['SP']},
+        {'Ano': [2024], 'UF': [], 'Substância': ['FERRO']},  # coluna sem valores não filtra
+    ]
+    for filtros in casos:
+        mascara = np.ones(n, dtype=bool)
+        for coluna, valores in filtros.items():
+            if valores:
+                mascara &= df[coluna].isin(valores).to_numpy()
+        assert selecionar_por_bitmaps(indice, filtros).tolist() == np.flatnonzero(mascara).tolist()
+        pd.testing.assert_frame_equal(filtrar_por_bitmaps(df, indice, filtros), df[mascara])
+
+    assert selecionar_por_bitmaps(indice, {'UF': [], 'Ano': ()}) is None
+    assert filtrar_por_bitmaps(df, indice, {}) is df
+
+
+def test_calcular_metricas_municipios_igual_ao_groupby():
+    rng = np.random.default_rng(5)
+    n = 400
+    df = pd.DataFrame({
+        'UF': rng.choice(['MG', 'PA'], n),
+        'Município': rng.choice(['A', 'B', 'C'], n),
+        'Ano': rng.choice([2022, 2023, 2024], n),
+        'Mês': rng.integers(1, 13, n),
+        'Substância': rng.choice(['FERRO', 'OURO', 'COBRE'], n),
+        'Tipo_PF_PJ': rng.choice(['PF', 'PJ'], n),
+        'ValorRecolhido_centavos': rng.integers(0, 10 ** 7, n),
+        'QuantidadeComercializada': rng.random(n),
+    })
+    # Município com um único registro: sem série anual nem variação mensal
+    df.loc[n] = ['GO', 'UNICO', 2024, 3, 'OURO', 'PJ', 12345, 1.0]
+    metricas = calcular_metricas_municipios(construir_cubo_cfem(df))
+
+    chaves = ['UF', 'Município']
+    df['ValorRecolhido'] = df['ValorRecolhido_centavos'] / 100
+    municipios = df.groupby(chaves)
+    anual = df.groupby(chaves + ['Ano'])['ValorRecolhido'].sum().groupby(level=chaves)
+    mensal = df.groupby(chaves + ['Ano', 'Mês'])['ValorRecolhido'].sum().groupby(level=chaves)
+    por_substancia = df.groupby(chaves + ['Substância'])['ValorRecolhido'].sum()
+    media_uf = df.groupby('UF')['ValorRecolhido'].mean()
+
+    def crescimento(valores, inicio):
+        anterior = valores.iloc[inicio] if len(valores) > 1 else 0
+        return (valores.iloc[-1] - anterior) / anterior * 100 if anterior else 0.0
+
+    esperado = pd.DataFrame({
+        'total': municipios['ValorRecolhido'].sum(),
+        'registros': municipios.size(),
+        'media_registro': municipios['ValorRecolhido'].mean(),
+        'diferenca_media_estadual': [
+            (media - media_uf[uf]) / media_uf[uf] * 100 for (uf, _), media in municipios['ValorRecolhido'].mean().items()
+        ],
+        'posicao_estado': municipios['ValorRecolhido_centavos'].sum().groupby(level='UF').rank(method='min', ascending=False),
+        'anos': municipios['Ano'].nunique(),
+        'ano_inicial': municipios['Ano'].min(),
+        'ano_final': municipios['Ano'].max(),
+        'crescimento_total': anual.apply(lambda valores: crescimento(valores, 0)),
+        'crescimento_recente': anual.apply(lambda valores: crescimento(valores, -2)),
+        'substancia_principal': por_substancia.groupby(level=chaves).idxmax().str[-1],
+        'participacao_substancia': por_substancia.groupby(level=chaves).max() / municipios['ValorRecolhido'].sum() * 100,
+        'num_substancias': municipios['Substância'].nunique(),
+        'meses': mensal.size(),
+        'cv_mensal': mensal.std() / mensal.mean() * 100,
+    })
+    pd.testing.assert_frame_equal(metricas[esperado.columns], esperado, check_dtype=False, check_names=False)